@@ -114,7 +114,7 @@ const ImageGallery = ({
                             )}
                             <img
                                 key={images[currentImageIndex].id}
-                                src={getApiUrl(`/media/${images[currentImageIndex].id}/image`)}
+                                src={getApiUrl(`/media/${images[currentImageIndex].id}/image?size=1024`)}
                                 alt={images[currentImageIndex].original_filename}
                                 className={`max-w-full max-h-full object-contain hover:scale-105 transition-transform duration-200 ${loadingStates[images[currentImageIndex].id] ? 'opacity-0' : 'opacity-100'}`}
                                 style={{ maxHeight: '384px' }}
@@ -196,7 +196,7 @@ const ImageGallery = ({
                                         </div>
                                     )}
                                     <img
-                                        src={getApiUrl(`/media/${image.id}/image`)}
+                                        src={getApiUrl(`/media/${image.id}/image?size=256`)}
                                         alt=""
                                         className={`w-full h-full object-cover transition-opacity duration-200 ${loadingStates[image.id] ? 'opacity-0' : 'opacity-100'}`}
                                         loading="lazy"
@@ -279,7 +279,7 @@ const ImageGallery = ({
                     )}
                     <img
                         key={`modal-${images[currentImageIndex].id}`}
-                        src={getApiUrl(`/media/${images[currentImageIndex].id}/image`)}
+                        src={getApiUrl(`/media/${images[currentImageIndex].id}/image?size=2048`)}
                         alt={images[currentImageIndex].original_filename}
                         className={`max-w-full max-h-full object-contain rounded-lg transition-opacity duration-200 ${loadingStates[`modal-${images[currentImageIndex].id}`] ? 'opacity-0' : 'opacity-100'}`}
                         style={{
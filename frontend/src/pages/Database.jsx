@@ -44,16 +44,16 @@ export default function Database() {
     // Form state (pending filters)
     const [filters, setFilters] = useState(emptyFilters);
 
-    // Fetch zones on mount
+    // Fetch zones with cave counts on mount
     useEffect(() => {
         async function fetchZones() {
             try {
-                const response = await fetch(getApiUrl("/caves/zones"), {
+                const response = await fetch(getApiUrl("/caves/facets"), {
                     credentials: "include"
                 });
                 if (response.ok) {
                     const data = await response.json();
-                    setZones(data);
+                    setZones(data.zones.filter((z) => z.zone));
                 }
             } catch (error) {
                 console.error("Error fetching zones:", error);
@@ -72,6 +72,8 @@ export default function Database() {
             if (appliedFilters.depthMax) params.append("depth_max", appliedFilters.depthMax);
             if (appliedFilters.lengthMin) params.append("length_min", appliedFilters.lengthMin);
             if (appliedFilters.lengthMax) params.append("length_max", appliedFilters.lengthMax);
+            // The table only renders cave attributes, so skip entrances and owner lookups
+            params.append("fields", "cave_id,name,zone,code,first_surveyed,last_surveyed,length,depth,vertical_extent,horizontal_extent");
 
             const url = getApiUrl(`/caves/${params.toString() ? `?${params.toString()}` : ""}`);
             const response = await fetch(url, {
@@ -213,8 +215,8 @@ export default function Database() {
                                     className="w-full bg-slate-800 border border-slate-700 rounded-lg px-3 py-2 text-sm text-white focus:outline-none focus:ring-2 focus:ring-teal-500 focus:border-transparent appearance-none cursor-pointer"
                                 >
                                     <option value="">All zones</option>
-                                    {zones.map((zone) => (
-                                        <option key={zone} value={zone}>{zone}</option>
+                                    {zones.map(({ zone, count }) => (
+                                        <option key={zone} value={zone}>{zone} ({count})</option>
                                     ))}
                                 </select>
                             </div>
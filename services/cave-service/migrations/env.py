@@ -21,7 +21,9 @@ if config.config_file_name is not None:
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from src.models.base import Base
-from src.models.cave import Cave, Entrance, CaveMedia
+from src.models.cave import Cave, Entrance, CaveMedia, CatalogueVersion
+from src.models.job import Job
+from src.models.spool import SpoolChunk
 target_metadata = Base.metadata
 
 
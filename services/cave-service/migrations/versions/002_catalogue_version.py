@@ -0,0 +1,33 @@
+"""Add catalogue version counter
+
+Revision ID: 002_catalogue_version
+Revises: 001_initial
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '002_catalogue_version'
+down_revision: Union[str, Sequence[str], None] = '001_initial'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('catalogue_version',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.execute("INSERT INTO catalogue_version (id, version) VALUES (1, 0)")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('catalogue_version')
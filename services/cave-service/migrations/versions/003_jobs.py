@@ -0,0 +1,48 @@
+"""Add background jobs table
+
+Revision ID: 003_jobs
+Revises: 002_catalogue_version
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '003_jobs'
+down_revision: Union[str, Sequence[str], None] = '002_catalogue_version'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('jobs',
+        sa.Column('job_id', sa.String(), nullable=False),
+        sa.Column('job_type', sa.String(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('owner_email', sa.String(), nullable=True),
+        sa.Column('payload', sa.JSON(), nullable=True),
+        sa.Column('result', sa.JSON(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('progress_done', sa.Integer(), nullable=False),
+        sa.Column('progress_total', sa.Integer(), nullable=True),
+        sa.Column('message', sa.String(), nullable=True),
+        sa.Column('cancel_requested', sa.Boolean(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('job_id')
+    )
+    op.create_index(op.f('ix_jobs_job_type'), 'jobs', ['job_type'], unique=False)
+    op.create_index(op.f('ix_jobs_owner_email'), 'jobs', ['owner_email'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_jobs_owner_email'), table_name='jobs')
+    op.drop_index(op.f('ix_jobs_job_type'), table_name='jobs')
+    op.drop_table('jobs')
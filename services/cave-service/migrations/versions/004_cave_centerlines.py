@@ -0,0 +1,39 @@
+"""Add cave centerline levels of detail
+
+Revision ID: 004_cave_centerlines
+Revises: 003_jobs
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '004_cave_centerlines'
+down_revision: Union[str, Sequence[str], None] = '003_jobs'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('cave_centerlines',
+        sa.Column('cave_id', sa.Integer(), nullable=False),
+        sa.Column('level', sa.Integer(), nullable=False),
+        sa.Column('tolerance', sa.Float(), nullable=False),
+        sa.Column('survey_hash', sa.String(), nullable=False),
+        sa.Column('anchor_station', sa.String(), nullable=False),
+        sa.Column('point_count', sa.Integer(), nullable=False),
+        sa.Column('lines', sa.JSON(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['cave_id'], ['caves.cave_id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('cave_id', 'level')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('cave_centerlines')
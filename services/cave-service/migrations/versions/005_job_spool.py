@@ -0,0 +1,41 @@
+"""Spool import uploads in the database and widen job progress counters
+
+Revision ID: 005_job_spool
+Revises: 004_cave_centerlines
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '005_job_spool'
+down_revision: Union[str, Sequence[str], None] = '004_cave_centerlines'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('spool_chunks',
+        sa.Column('spool_id', sa.String(), nullable=False),
+        sa.Column('seq', sa.Integer(), nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('spool_id', 'seq')
+    )
+    op.create_index(op.f('ix_spool_chunks_created_at'), 'spool_chunks', ['created_at'], unique=False)
+    # Import progress is counted in bytes
+    op.alter_column('jobs', 'progress_done', type_=sa.BigInteger(), existing_type=sa.Integer(), existing_nullable=False)
+    op.alter_column('jobs', 'progress_total', type_=sa.BigInteger(), existing_type=sa.Integer(), existing_nullable=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.alter_column('jobs', 'progress_total', type_=sa.Integer(), existing_type=sa.BigInteger(), existing_nullable=True)
+    op.alter_column('jobs', 'progress_done', type_=sa.Integer(), existing_type=sa.BigInteger(), existing_nullable=False)
+    op.drop_index(op.f('ix_spool_chunks_created_at'), table_name='spool_chunks')
+    op.drop_table('spool_chunks')
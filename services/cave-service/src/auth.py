@@ -5,7 +5,7 @@ Auth is verified by calling the OAuth2 proxy's /oauth2/auth endpoint
 with the user's cookies. This allows per-endpoint auth control.
 """
 
-from fastapi import Request, HTTPException, status
+from fastapi import Depends, Request, HTTPException, status
 from typing import Optional
 import httpx
 import os
@@ -20,6 +20,9 @@ OAUTH2_PROXY_AUTH_URL = os.getenv("OAUTH2_PROXY_AUTH_URL", "http://oauth2-proxy.
 # Service authentication token for internal service-to-service communication
 SERVICE_TOKEN = os.getenv("SERVICE_TOKEN", "dev-service-token-123")
 
+# Users allowed to run catalogue-wide maintenance, comma-separated
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
+
 
 class User:
     """Represents an authenticated user."""
@@ -145,3 +148,22 @@ async def require_internal_service(request: Request) -> User:
 
     # Return service user
     return User(email="service@cavemap.internal", user="service")
+
+
+async def require_admin(request: Request, user: User = Depends(require_auth)) -> User:
+    """
+    Dependency that requires the service token or an administrator.
+    Administrators are the users listed in ADMIN_EMAILS.
+    Returns 401 if not authenticated and 403 for other users.
+
+    Usage:
+        @router.post("/maintenance")
+        async def maintenance_endpoint(user: User = Depends(require_admin)):
+            # Only internal services and administrators can access
+    """
+    if request.headers.get("X-Service-Token") != SERVICE_TOKEN and user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Administrator access required"
+        )
+    return user
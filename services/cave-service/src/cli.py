@@ -0,0 +1,79 @@
+"""
+Command line tools for cave-service.
+
+Usage:
+    python -m src.cli import caves.csv --owner user@example.com [--upsert [--prune-entrances]] [--crs EPSG:32634] [--dedupe flag|merge]
+"""
+import argparse
+import asyncio
+import json
+
+from src.db.connection import async_session, init_db
+from src.utils.crs import SUPPORTED_CRS, CoordinateSystem, get_crs
+from src.utils.importers import FORMAT_EXTENSIONS, detect_format, import_caves
+
+
+async def run_import(
+    path: str,
+    owner_email: str,
+    file_format: str,
+    chunk_size: int | None,
+    upsert: bool = False,
+    prune_entrances: bool = False,
+    crs: CoordinateSystem | None = None,
+    dedupe: str | None = None,
+    dedupe_radius_m: float | None = None,
+) -> None:
+    """Import a catalogue file and print the result as JSON."""
+    await init_db()
+    with open(path, "rb") as file:
+        async with async_session() as session:
+            result = await import_caves(
+                session, file, file_format, owner_email,
+                chunk_size=chunk_size, upsert=upsert, prune_entrances=prune_entrances, crs=crs,
+                dedupe=dedupe, dedupe_radius_m=dedupe_radius_m
+            )
+    print(json.dumps(result.model_dump(), indent=2))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Cave service command line tools.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="Import caves from a CSV, GeoJSON or KML file")
+    import_parser.add_argument("path", help="File to import")
+    import_parser.add_argument("--owner", required=True, help="Email of the user the caves are created for")
+    import_parser.add_argument("--format", choices=sorted(set(FORMAT_EXTENSIONS.values())), help="File format (default: from extension)")
+    import_parser.add_argument("--chunk-size", type=int, default=None, help="Caves committed per transaction")
+    import_parser.add_argument("--upsert", action="store_true", help="Update existing caves by name, writing only what changed")
+    import_parser.add_argument("--prune-entrances", action="store_true", help="With --upsert, delete entrances missing from the file")
+    import_parser.add_argument(
+        "--crs", default=None,
+        help=f"EPSG code of the file's coordinates (supported: {', '.join(str(code) for code in SUPPORTED_CRS)}; default: WGS 84)"
+    )
+    import_parser.add_argument(
+        "--dedupe", choices=["flag", "merge"], default=None,
+        help="Report or skip entrances that duplicate an earlier record or an existing entrance"
+    )
+    import_parser.add_argument("--dedupe-radius", type=float, default=None, help="Largest distance between duplicates in metres")
+
+    args = parser.parse_args()
+
+    if args.command == "import":
+        file_format = args.format or detect_format(args.path)
+        if file_format is None:
+            parser.error("cannot detect the file format, pass --format")
+        if args.prune_entrances and not args.upsert:
+            parser.error("--prune-entrances requires --upsert")
+        try:
+            crs = get_crs(args.crs)
+        except ValueError as e:
+            parser.error(str(e))
+        asyncio.run(run_import(
+            args.path, args.owner, file_format, args.chunk_size, args.upsert, args.prune_entrances, crs,
+            args.dedupe, args.dedupe_radius
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,57 @@ class Settings(BaseSettings):
     db_url: Optional[str] = None
     rabbitmq_url: Optional[str] = None
 
+    # Number of caves inserted and committed together by bulk ingest
+    bulk_chunk_size: int = 1000
+
+    # Number of records parsed and validated together by file imports
+    import_batch_size: int = 1000
+    # Longest GeoJSON feature, in characters, an import reads before giving up on the file
+    import_max_feature_size: int = 1024 * 1024
+
+    # Background jobs: durable RabbitMQ queue and number of jobs run at once per replica
+    job_queue: str = "cave-service.jobs"
+    job_concurrency: int = 2
+    # Jobs still queued or running this long after they were created or started are queued again at startup
+    job_stale_minutes: int = 120
+
+    # Uploaded files waiting for an import job are stored in the database in
+    # chunks of this size, and deleted after this many hours if no job ran
+    job_spool_chunk_size: int = 1024 * 1024
+    job_spool_ttl_hours: int = 72
+
+    # Largest number of caves in one /caves/bulk_upload or /caves/bulk_upsert
+    # request; larger uploads go through the /caves/import job
+    bulk_max_rows: int = 10000
+
+    # Worker processes for CPU-bound work such as survey processing
+    process_pool_workers: int = 2
+
+    # Survey files up to this size are processed in the threadpool, larger ones in the process pool
+    survey_inline_max_bytes: int = 256 * 1024
+
+    # Digital elevation model (GeoTIFF) used to fill in entrance altitudes; disabled when unset
+    dem_path: Optional[str] = None
+    # EPSG code of the DEM, overriding the coordinate system stored in the file
+    dem_crs: Optional[str] = None
+    # Decoded DEM tiles/strips kept in memory
+    dem_cache_blocks: int = 64
+    # Altitude difference in metres above which validation reports an entrance
+    dem_mismatch_tolerance_m: float = 25.0
+
+    # Import duplicate detection: entrances closer than this with similar names are duplicates
+    dedupe_radius_m: float = 25.0
+    dedupe_min_similarity: float = 0.6
+
+    # Largest number of entrances the route planner orders in one request
+    route_max_stops: int = 500
+
+    # Nearest-entrance lookups: grid cell height of the entrance index, and the
+    # largest number of points and search radius of one request
+    nearest_cell_m: float = 1000.0
+    nearest_max_points: int = 10000
+    nearest_max_radius_m: float = 10000.0
+
     class Config:
         env_file = ".env"
         extra = "ignore"
@@ -1,9 +1,14 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from src.routes import caves
+from src.routes import caves, jobs
 from src.db.connection import init_db
+from src.utils.compression import CompressionMiddleware
 from src.utils.rabbitmq_consumer import start_rabbitmq_consumer, stop_rabbitmq_consumer
 from src.utils.rabbitmq_publisher import publisher
+from src.utils.data_version import bump_data_version
+from src.utils.jobs import job_runner
+from src.utils.job_handlers import register_job_handlers
+from src.utils.process_pool import shutdown_process_pool
 import asyncio
 
 from contextlib import asynccontextmanager
@@ -32,6 +37,20 @@ async def init_db_with_retry():
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await init_db_with_retry()
+    # Publish writes whose version bump was lost when a previous process died
+    await bump_data_version()
+
+    # Start the background job runner; without RabbitMQ jobs run in-process
+    register_job_handlers(job_runner)
+    try:
+        await job_runner.start()
+        print("✓ Job runner started successfully")
+    except Exception as e:
+        print(f"⚠ Failed to start job runner, running jobs in-process: {str(e)[:100]}")
+    try:
+        await job_runner.requeue_stale()
+    except Exception as e:
+        print(f"⚠ Failed to requeue stale jobs: {str(e)[:100]}")
 
     # Start RabbitMQ consumer
     try:
@@ -65,6 +84,11 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         print(f"⚠ Error closing RabbitMQ publisher: {str(e)[:100]}")
 
+    await job_runner.stop()
+    print("✓ Job runner stopped")
+
+    shutdown_process_pool()
+
 app = FastAPI(
     title="Cave Database API", 
     lifespan=lifespan,
@@ -80,6 +104,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress responses according to Accept-Encoding (br, gzip)
+app.add_middleware(CompressionMiddleware, minimum_size=500)
+
+# Registered before the caves router so /caves/jobs is not taken for a cave id
+app.include_router(jobs.router, prefix="/caves/jobs", tags=["Jobs"])
 app.include_router(caves.router, prefix="/caves", tags=["Caves"])
 
 
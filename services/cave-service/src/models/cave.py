@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, BigInteger, String, Float, ForeignKey, DateTime, JSON
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from src.models.base import Base
 from typing import Optional
@@ -21,6 +21,7 @@ class Cave(Base):
 
     entrances = relationship("Entrance", back_populates="cave", cascade="all, delete-orphan")
     media_files = relationship("CaveMedia", back_populates="cave", cascade="all, delete-orphan")
+    centerlines = relationship("CaveCenterline", back_populates="cave", cascade="all, delete-orphan", passive_deletes=True)
 
 
 class Entrance(Base):
@@ -52,4 +53,32 @@ class CaveMedia(Base):
     added_by = Column(String, nullable=False)  # User email who associated the media
     added_at = Column(DateTime, default=datetime.utcnow)
 
-    cave = relationship("Cave", back_populates="media_files")
\ No newline at end of file
+    cave = relationship("Cave", back_populates="media_files")
+
+
+class CaveCenterline(Base):
+    """Survey centerline of a cave at one level of detail, in metres relative to its anchor station."""
+    __tablename__ = "cave_centerlines"
+
+    cave_id = Column(
+        Integer,
+        ForeignKey("caves.cave_id", ondelete="CASCADE"),
+        primary_key=True
+    )
+    level = Column(Integer, primary_key=True)
+    tolerance: Mapped[float] = mapped_column(Float, nullable=False)  # Douglas-Peucker tolerance in metres
+    survey_hash = Column(String, nullable=False)  # SHA-256 of the survey file the level was built from
+    anchor_station = Column(String, nullable=False)  # Station placed at the cave's first entrance
+    point_count = Column(Integer, nullable=False)
+    lines = Column(JSON, nullable=False)  # [[[east, north, up], ...], ...]
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    cave = relationship("Cave", back_populates="centerlines")
+
+
+class CatalogueVersion(Base):
+    """Single-row counter bumped on every cave/entrance write, used to key response caches."""
+    __tablename__ = "catalogue_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
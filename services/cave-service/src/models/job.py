@@ -0,0 +1,35 @@
+# Identical in every service with background jobs; see src.utils.jobs
+from sqlalchemy import Column, BigInteger, String, Boolean, DateTime, JSON, Text
+from src.models.base import Base
+from datetime import datetime
+from uuid import uuid4
+import enum
+
+
+class JobStatus(str, enum.Enum):
+    """Lifecycle of a background job."""
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+class Job(Base):
+    """Long-running operation executed by the job runner."""
+    __tablename__ = "jobs"
+
+    job_id = Column(String, primary_key=True, default=lambda: uuid4().hex)
+    job_type = Column(String, nullable=False, index=True)
+    status = Column(String, nullable=False, default=JobStatus.QUEUED)
+    owner_email = Column(String, index=True)  # None for system jobs, e.g. event cascades
+    payload = Column(JSON)
+    result = Column(JSON)
+    error = Column(Text)
+    progress_done = Column(BigInteger, nullable=False, default=0)
+    progress_total = Column(BigInteger)
+    message = Column(String)
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
@@ -0,0 +1,13 @@
+from sqlalchemy import Column, Integer, String, DateTime, LargeBinary
+from src.models.base import Base
+from datetime import datetime
+
+
+class SpoolChunk(Base):
+    """Part of an uploaded file waiting for a background job, stored in order of seq."""
+    __tablename__ = "spool_chunks"
+
+    spool_id = Column(String, primary_key=True)
+    seq = Column(Integer, primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
@@ -1,17 +1,44 @@
 import asyncio
-from src.models.cave import Cave, Entrance, CaveMedia
-from src.schemas.cave import CaveCreate, CaveRead, UserStats, EntranceCreate, EntranceRead, MediaFileSummary
-from src.auth import User, get_current_user, require_auth, require_internal_service
+from src.models.cave import Cave, Entrance, CaveMedia, CaveCenterline
+from src.schemas.cave import BulkCaveRow, CaveCreate, CaveRead, CaveFacets, BulkUploadResult, NearestCave, NearestRequest, NearestResult, RouteRequest, RouteResult, RouteStop, SurveyResult, UserStats, EntranceCreate, EntranceRead, MediaFileSummary
+from src.auth import User, get_current_user, require_admin, require_auth, require_internal_service
 from src.utils.cave_operations import delete_cave_by_id
-
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from src.utils.data_version import get_data_version, bump_data_version
+from src.utils.markers import MarkerColumns, encode_markers_binary, encode_markers_json
+from src.utils.response_cache import cached_response, if_none_match_matches, response_cache
+from src.utils.cave_selection import CaveSelection
+from src.utils.facets import build_facets_query, parse_facet_rows
+from src.utils.bulk_ingest import MAX_CHUNK_SIZE, bulk_insert_caves, bulk_upsert_caves, validate_cave_rows
+from src.utils.importers import ImportFormat, detect_format
+from src.utils.dedupe import DedupeMode
+from src.utils.distance import haversine_m
+from src.utils.dem import get_dem
+from src.utils.elevation import fill_missing_elevations
+from src.utils.crs import CRS_DESCRIPTION, CoordinateSystem, entrance_dicts_from_wgs84, entrances_to_wgs84, get_crs
+from src.utils.jobs import job_runner
+from src.utils.spool import spool_upload
+from src.utils.process_pool import run_in_process
+from src.utils.nearest import get_entrance_index
+from src.utils.route_planner import plan_route
+from src.utils.survey_parsers import SurveyError, SurveyFormat, detect_survey_format
+from src.utils.centerline import CenterlineLevel, anchor_station, centerline_geojson, level_for_zoom, process_survey_centerline
+from src.schemas.job import JobRead
+from src.config.settings import settings
+
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response, UploadFile, File
+from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.encoders import jsonable_encoder
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 from sqlalchemy import func, delete
-from src.db.connection import get_session
-from typing import Optional
+from src.db.connection import get_session, async_session
+from typing import Any, Literal, Optional
+from starlette.concurrency import run_in_threadpool
 import httpx
+import numpy as np
+import hashlib
+import json
 import os
 import logging
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
@@ -32,6 +59,9 @@ MEDIA_SERVICE_URL = os.getenv("MEDIA_SERVICE_URL", "http://media-service.default
 # Service authentication token for internal service-to-service communication
 SERVICE_TOKEN = os.getenv("SERVICE_TOKEN", "dev-service-token-123")
 
+# Number of caves fetched per round-trip from the server-side cursor when streaming
+STREAM_BATCH_SIZE = 500
+
 
 @retry(
     stop=stop_after_attempt(3),
@@ -96,6 +126,37 @@ async def fetch_media_files(media_file_ids: list[int]) -> list[dict]:
         return []
 
 
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=1, min=1, max=10),
+    retry=retry_if_exception_type((httpx.TimeoutException, httpx.ConnectError, httpx.NetworkError)),
+)
+async def _fetch_cave_groups_with_retry(cave_ids: list[int]) -> dict[int, list[dict]]:
+    """Fetch group assignments from group-service with retries."""
+    async with httpx.AsyncClient() as client:
+        response = await client.post(
+            f"{GROUP_SERVICE_URL}/groups/caves/groups/batch",
+            json={"cave_ids": cave_ids},
+            headers={"X-Service-Token": SERVICE_TOKEN},
+            timeout=5.0
+        )
+        if response.status_code == 200:
+            return {int(cave_id): groups for cave_id, groups in response.json().items()}
+        else:
+            logger.warning(f"Failed to fetch cave groups: {response.status_code}")
+            return {}
+
+async def fetch_cave_groups(cave_ids: list[int]) -> dict[int, list[dict]]:
+    """Fetch the groups each of the given caves is assigned to from group-service."""
+    if not cave_ids:
+        return {}
+    try:
+        return await _fetch_cave_groups_with_retry(cave_ids)
+    except Exception as e:
+        logger.error(f"Error fetching cave groups after retries: {e}")
+        return {}
+
+
 # --- Health check endpoint (for K8s probes) ---
 # Public - no auth required
 @router.get("/health")
@@ -119,6 +180,49 @@ async def list_zones(session: AsyncSession = Depends(get_session)):
     return [zone for zone in result.scalars().all() if zone]
 
 
+# --- Map markers endpoint ---
+# Public - no auth required
+@router.get("/markers")
+async def list_markers(
+    request: Request,
+    session: AsyncSession = Depends(get_session),
+    format: Optional[Literal["binary", "json"]] = Query(
+        None, description="Payload encoding; defaults to binary when the Accept header asks for application/octet-stream"
+    ),
+):
+    """
+    Get one map marker per entrance as a compact columnar payload.
+
+    See src.utils.markers for the binary layout. Rendered payloads and their
+    compressed variants are cached per catalogue data version and revalidated
+    with ETags.
+    """
+    if format is None:
+        format = "binary" if "application/octet-stream" in request.headers.get("accept", "") else "json"
+
+    version = await get_data_version(session)
+    etag = f'W/"markers-{format}-{version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+
+    if if_none_match_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    cached = response_cache.get(("markers", format), version)
+    if cached is None:
+        result = await session.execute(
+            select(Entrance.cave_id, Entrance.gps_n, Entrance.gps_e, Cave.depth, Cave.length, Cave.zone)
+            .join(Cave, Cave.cave_id == Entrance.cave_id)
+            .order_by(Entrance.cave_id, Entrance.entrance_id)
+        )
+        columns = MarkerColumns(result.all())
+        if format == "binary":
+            cached = response_cache.set(("markers", format), encode_markers_binary(columns), "application/octet-stream", version)
+        else:
+            cached = response_cache.set(("markers", format), encode_markers_json(columns), "application/json", version)
+
+    return cached_response(request, cached, headers)
+
+
 # --- Create cave endpoint ---
 # Protected - requires authentication
 @router.post("/", response_model=CaveRead, status_code=status.HTTP_201_CREATED)
@@ -154,6 +258,7 @@ async def create_cave(
     
     # Add entrances if provided
     if cave.entrances:
+        await fill_missing_elevations(cave.entrances)
         await session.flush()  # Get cave_id
         entrances = [
             Entrance(
@@ -168,6 +273,7 @@ async def create_cave(
         session.add_all(entrances)
 
     await session.commit()
+    await bump_data_version()
     await session.refresh(new_cave, ["entrances"])
 
     # Fetch username for owner
@@ -243,6 +349,8 @@ async def create_entrance(
                 detail="You don't have permission to add entrances to this cave. Either own the cave or be an admin/owner of its assigned group."
             )
 
+    await fill_missing_elevations([entrance])
+
     # Create entrance
     new_entrance = Entrance(
         cave_id=cave_id,
@@ -253,6 +361,7 @@ async def create_entrance(
     )
     session.add(new_entrance)
     await session.commit()
+    await bump_data_version()
     await session.refresh(new_entrance)
 
     return new_entrance
@@ -311,6 +420,10 @@ async def update_entrance(
     if entrance is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Entrance not found")
 
+    # A cleared altitude stays cleared unless the entrance is moved
+    if (entrance_update.gps_n, entrance_update.gps_e) != (entrance.gps_n, entrance.gps_e):
+        await fill_missing_elevations([entrance_update])
+
     # Update entrance fields
     entrance.name = entrance_update.name
     entrance.gps_n = entrance_update.gps_n
@@ -318,6 +431,7 @@ async def update_entrance(
     entrance.asl_m = entrance_update.asl_m
 
     await session.commit()
+    await bump_data_version()
     await session.refresh(entrance)
 
     return entrance
@@ -378,6 +492,212 @@ async def delete_entrance(
 
     await session.delete(entrance)
     await session.commit()
+    await bump_data_version()
+
+
+def _apply_cave_filters(
+    query,
+    search: Optional[str] = None,
+    zone: Optional[str] = None,
+    depth_min: Optional[float] = None,
+    depth_max: Optional[float] = None,
+    length_min: Optional[float] = None,
+    length_max: Optional[float] = None,
+):
+    """Apply the list filters shared by the cave listing endpoints."""
+    if search:
+        query = query.where(Cave.name.ilike(f"%{search}%"))
+    if zone:
+        query = query.where(Cave.zone == zone)
+    if depth_min is not None:
+        query = query.where(Cave.depth >= depth_min)
+    if depth_max is not None:
+        query = query.where(Cave.depth <= depth_max)
+    if length_min is not None:
+        query = query.where(Cave.length >= length_min)
+    if length_max is not None:
+        query = query.where(Cave.length <= length_max)
+    return query
+
+
+def _parse_crs(value: Optional[str]) -> CoordinateSystem:
+    """Look up the crs query parameter, rejecting unsupported systems with 400."""
+    try:
+        return get_crs(value)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+def _project_caves(cave_dicts: list[dict], crs: CoordinateSystem) -> None:
+    """Convert the entrance coordinates of a batch of cave dicts in one transform."""
+    entrance_dicts_from_wgs84([e for cave in cave_dicts for e in cave.get("entrances", ())], crs)
+
+
+def _media_summary(mf: dict) -> dict:
+    """Convert a media-service file record to the MediaFileSummary dict format."""
+    summary = MediaFileSummary(
+        id=mf["id"],
+        filename=mf["filename"],
+        original_filename=mf["original_filename"],
+        content_type=mf["content_type"],
+        file_size=mf["file_size"],
+        uploaded_by=mf["uploaded_by"],
+        uploaded_at=mf["uploaded_at"],
+        download_url=mf.get("download_url")
+    )
+    return {
+        "id": summary.id,
+        "filename": summary.filename,
+        "original_filename": summary.original_filename,
+        "content_type": summary.content_type,
+        "file_size": summary.file_size,
+        "uploaded_by": summary.uploaded_by,
+        "uploaded_at": summary.uploaded_at.isoformat(),
+        "download_url": summary.download_url
+    }
+
+
+def _cave_load_options(selection: CaveSelection) -> list:
+    """Get the eager-load options needed for the selected parts of a cave."""
+    options = []
+    if selection.includes("entrances"):
+        options.append(selectinload(Cave.entrances))
+    if selection.includes("media"):
+        options.append(selectinload(Cave.media_files))
+    return options
+
+
+class CaveExtras:
+    """Data for a batch of caves that lives in other services."""
+
+    def __init__(self):
+        self.usernames_map: dict[str, str] = {}
+        self.media_by_id: dict[int, dict] = {}
+        self.groups_by_cave: dict[int, list[dict]] = {}
+
+    async def load(self, caves: list[Cave], selection: CaveSelection) -> None:
+        """Fetch only the downstream data the selection asks for."""
+        calls = []
+
+        if selection.wants("owner_username"):
+            # Only look up owners not seen in previous batches
+            new_emails = list({cave.owner_email for cave in caves} - self.usernames_map.keys())
+            if new_emails:
+                calls.append(self._load_usernames(new_emails))
+        if selection.includes("media"):
+            media_file_ids = [cm.media_file_id for cave in caves for cm in cave.media_files]
+            if media_file_ids:
+                calls.append(self._load_media(media_file_ids))
+        if selection.includes("groups"):
+            calls.append(self._load_groups([cave.cave_id for cave in caves]))
+
+        await asyncio.gather(*calls)
+
+    async def _load_usernames(self, emails: list[str]) -> None:
+        self.usernames_map.update(await fetch_usernames(emails))
+
+    async def _load_media(self, media_file_ids: list[int]) -> None:
+        for mf in await fetch_media_files(media_file_ids):
+            self.media_by_id[mf["id"]] = _media_summary(mf)
+
+    async def _load_groups(self, cave_ids: list[int]) -> None:
+        self.groups_by_cave.update(await fetch_cave_groups(cave_ids))
+
+
+def _cave_to_dict(
+    cave: Cave,
+    usernames_map: dict[str, str],
+    is_owner: bool = False,
+    selection: Optional[CaveSelection] = None,
+    extras: Optional[CaveExtras] = None,
+) -> dict:
+    """
+    Convert a cave to the CaveRead dict format.
+
+    Without a selection the cave is converted with its entrances, which must
+    be loaded. With a selection only the selected parts are included.
+    """
+    cave_dict = {
+        "cave_id": cave.cave_id,
+        "name": cave.name,
+        "zone": cave.zone,
+        "code": cave.code,
+        "first_surveyed": cave.first_surveyed,
+        "last_surveyed": cave.last_surveyed,
+        "length": cave.length,
+        "depth": cave.depth,
+        "vertical_extent": cave.vertical_extent,
+        "horizontal_extent": cave.horizontal_extent,
+        "owner_username": usernames_map.get(cave.owner_email, cave.owner_email.split('@')[0]),
+        "is_owner": is_owner,
+    }
+
+    if selection is None or selection.includes("entrances"):
+        cave_dict["entrances"] = [
+            {
+                "entrance_id": e.entrance_id,
+                "name": e.name,
+                "gps_n": e.gps_n,
+                "gps_e": e.gps_e,
+                "asl_m": e.asl_m
+            }
+            for e in cave.entrances
+        ]
+    if selection is None:
+        return cave_dict
+
+    if selection.includes("media"):
+        cave_dict["media_files"] = [
+            extras.media_by_id[cm.media_file_id]
+            for cm in cave.media_files
+            if cm.media_file_id in extras.media_by_id
+        ]
+    if selection.includes("groups"):
+        cave_dict["groups"] = extras.groups_by_cave.get(cave.cave_id, [])
+
+    return selection.apply(cave_dict)
+
+
+async def _stream_caves(query, stream_format: str, selection: CaveSelection, crs: CoordinateSystem):
+    """
+    Stream caves from a server-side cursor as a JSON array or NDJSON lines.
+
+    Rows are fetched STREAM_BATCH_SIZE at a time, so memory use stays constant
+    and the first bytes are sent before the query has been fully consumed.
+    The generator opens its own session because the request-scoped session
+    is closed before the response body is sent.
+    """
+    extras = CaveExtras()
+    first = True
+
+    if stream_format == "json":
+        yield b"["
+
+    async with async_session() as session:
+        result = await session.stream(query.execution_options(yield_per=STREAM_BATCH_SIZE))
+        async for caves in result.scalars().partitions():
+            await extras.load(caves, selection)
+
+            cave_dicts = [
+                _cave_to_dict(cave, extras.usernames_map, selection=selection, extras=extras) for cave in caves
+            ]
+            _project_caves(cave_dicts, crs)
+            if selection.is_default:
+                # Shaped by the response model, as the non-streamed list is
+                cave_dicts = [CaveRead.model_validate(cave_dict).model_dump(mode="json") for cave_dict in cave_dicts]
+
+            chunk = []
+            for cave_dict in cave_dicts:
+                line = json.dumps(jsonable_encoder(cave_dict))
+                if stream_format == "json":
+                    chunk.append(line if first else "," + line)
+                else:
+                    chunk.append(line + "\n")
+                first = False
+            yield "".join(chunk).encode()
+
+    if stream_format == "json":
+        yield b"]"
 
 
 # --- List caves endpoint ---
@@ -392,177 +712,299 @@ async def list_caves(
     length_min: Optional[float] = Query(None, description="Minimum length"),
     length_max: Optional[float] = Query(None, description="Maximum length"),
     limit: Optional[int] = Query(None, description="Limit number of results"),
+    stream: Optional[Literal["json", "ndjson"]] = Query(
+        None, description="Stream results incrementally as a JSON array ('json') or newline-delimited JSON ('ndjson')"
+    ),
+    fields: Optional[str] = Query(None, description="Comma-separated cave fields to return, e.g. cave_id,name,depth"),
+    include: Optional[str] = Query(None, description="Comma-separated related data to include: entrances, media, groups (default: entrances)"),
+    crs: Optional[str] = Query(None, description=CRS_DESCRIPTION),
 ):
     """List caves with optional filtering."""
-    query = select(Cave).options(selectinload(Cave.entrances))
-    
-    # Apply filters
-    if search:
-        query = query.where(Cave.name.ilike(f"%{search}%"))
-    if zone:
-        query = query.where(Cave.zone == zone)
-    if depth_min is not None:
-        query = query.where(Cave.depth >= depth_min)
-    if depth_max is not None:
-        query = query.where(Cave.depth <= depth_max)
-    if length_min is not None:
-        query = query.where(Cave.length >= length_min)
-    if length_max is not None:
-        query = query.where(Cave.length <= length_max)
-    
+    selection = CaveSelection(fields, include, default_include={"entrances"})
+    target_crs = _parse_crs(crs)
+
+    query = select(Cave).options(*_cave_load_options(selection))
+    query = _apply_cave_filters(query, search, zone, depth_min, depth_max, length_min, length_max)
+
     query = query.order_by(Cave.name)
     if limit is not None:
         query = query.limit(limit)
+
+    if stream:
+        media_type = "application/x-ndjson" if stream == "ndjson" else "application/json"
+        return StreamingResponse(_stream_caves(query, stream, selection, target_crs), media_type=media_type)
+
     result = await session.execute(query)
     caves = result.scalars().unique().all()
 
-    # Get all unique owner emails for username lookup
-    owner_emails = list(set(cave.owner_email for cave in caves))
-    usernames_map = await fetch_usernames(owner_emails)
-
-    # Convert to dict format
-    cave_list = []
-    for cave in caves:
-        cave_dict = {
-            "cave_id": cave.cave_id,
-            "name": cave.name,
-            "zone": cave.zone,
-            "code": cave.code,
-            "first_surveyed": cave.first_surveyed,
-            "last_surveyed": cave.last_surveyed,
-            "length": cave.length,
-            "depth": cave.depth,
-            "vertical_extent": cave.vertical_extent,
-            "horizontal_extent": cave.horizontal_extent,
-            "owner_username": usernames_map.get(cave.owner_email, cave.owner_email.split('@')[0]),
-            "is_owner": False,  # Public endpoint, can't determine ownership
-            "entrances": [
-                {
-                    "entrance_id": e.entrance_id,
-                    "name": e.name,
-                    "gps_n": e.gps_n,
-                    "gps_e": e.gps_e,
-                    "asl_m": e.asl_m
-                }
-                for e in cave.entrances
-            ]
-        }
-        cave_list.append(cave_dict)
+    extras = CaveExtras()
+    await extras.load(caves, selection)
 
-    return cave_list
+    # Public endpoint, can't determine ownership
+    if selection.is_default:
+        cave_dicts = [_cave_to_dict(cave, extras.usernames_map) for cave in caves]
+        _project_caves(cave_dicts, target_crs)
+        return cave_dicts
 
+    cave_dicts = [
+        _cave_to_dict(cave, extras.usernames_map, selection=selection, extras=extras)
+        for cave in caves
+    ]
+    _project_caves(cave_dicts, target_crs)
+    return JSONResponse(content=jsonable_encoder(cave_dicts))
 
-# --- Delete all caves (TESTING ONLY) ---
-@router.delete("/delete_all")
-async def delete_all_caves(
+
+# --- Facets endpoint ---
+# Public - no auth required
+@router.get("/facets", response_model=CaveFacets)
+async def get_cave_facets(
+    request: Request,
     session: AsyncSession = Depends(get_session),
-    user: User = Depends(require_auth)
+    search: Optional[str] = Query(None, description="Search caves by name (case-insensitive)"),
+    zone: Optional[str] = Query(None, description="Filter by zone"),
+    depth_min: Optional[float] = Query(None, description="Minimum vertical extent (depth)"),
+    depth_max: Optional[float] = Query(None, description="Maximum vertical extent (depth)"),
+    length_min: Optional[float] = Query(None, description="Minimum length"),
+    length_max: Optional[float] = Query(None, description="Maximum length"),
 ):
-    """Delete all caves and their entrances. FOR TESTING ONLY."""
-    deleted_assignments = 0
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.delete(
-                f"{GROUP_SERVICE_URL}/groups/caves/assignments",
-                headers={"X-Service-Token": SERVICE_TOKEN}
+    """
+    Get per-zone counts and depth/length histograms for the caves matching
+    the same filters as the cave list.
+
+    All facets come from a single grouped query and are cached per catalogue
+    data version and filter set.
+    """
+    filters = (search, zone, depth_min, depth_max, length_min, length_max)
+    version = await get_data_version(session)
+
+    cached = response_cache.get(("facets", filters), version)
+    if cached is None:
+        query = _apply_cave_filters(select(Cave), *filters)
+        result = await session.execute(build_facets_query(query))
+        facets = CaveFacets(**parse_facet_rows(result.all()))
+        cached = response_cache.set(("facets", filters), facets.model_dump_json().encode(), "application/json", version)
+
+    return cached_response(request, cached)
+
+
+# --- Expedition route planner ---
+# Public - no auth required
+@router.post("/route", response_model=RouteResult)
+async def plan_cave_route(
+    payload: RouteRequest,
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Order a set of caves and entrances into a short route from a start point.
+
+    Caves are visited through their entrance closest to the start. Legs are
+    straight-line distances; missing altitudes are taken from the DEM when
+    one is configured. The order minimizes distance plus climb_factor times
+    the ascent, using nearest neighbour followed by 2-opt and Or-opt. Ids
+    that do not exist are reported instead of failing the request.
+    """
+    cave_ids = list(dict.fromkeys(payload.cave_ids))
+    entrance_ids = list(dict.fromkeys(payload.entrance_ids))
+    if not cave_ids and not entrance_ids:
+        raise HTTPException(status_code=400, detail="No caves or entrances to visit")
+    if len(cave_ids) + len(entrance_ids) > settings.route_max_stops:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A route can have at most {settings.route_max_stops} stops"
+        )
+
+    start = payload.start
+    stops: dict[int, tuple[Entrance, str]] = {}
+    if entrance_ids:
+        result = await session.execute(
+            select(Entrance, Cave.name)
+            .join(Cave, Cave.cave_id == Entrance.cave_id)
+            .where(Entrance.entrance_id.in_(entrance_ids))
+        )
+        for entrance, cave_name in result.all():
+            stops[entrance.entrance_id] = (entrance, cave_name)
+
+    found_caves = set()
+    if cave_ids:
+        result = await session.execute(
+            select(Entrance, Cave.name)
+            .join(Cave, Cave.cave_id == Entrance.cave_id)
+            .where(Entrance.cave_id.in_(cave_ids))
+            .order_by(Entrance.entrance_id)
+        )
+        rows = result.all()
+        distance = haversine_m(
+            start.gps_n, start.gps_e,
+            np.array([e.gps_n for e, _ in rows], dtype=np.float64),
+            np.array([e.gps_e for e, _ in rows], dtype=np.float64),
+        )
+        closest: dict[int, int] = {}
+        for index, (entrance, _) in enumerate(rows):
+            current = closest.get(entrance.cave_id)
+            if current is None or distance[index] < distance[current]:
+                closest[entrance.cave_id] = index
+        for index in closest.values():
+            entrance, cave_name = rows[index]
+            stops.setdefault(entrance.entrance_id, (entrance, cave_name))
+        found_caves = set(closest)
+
+    visits = list(stops.values())
+    lat = np.array([start.gps_n] + [e.gps_n for e, _ in visits], dtype=np.float64)
+    lon = np.array([start.gps_e] + [e.gps_e for e, _ in visits], dtype=np.float64)
+    asl = np.array([start.asl_m] + [e.asl_m for e, _ in visits], dtype=np.float64)
+    # Unknown altitudes would hide the climbing on legs through them
+    missing = np.isnan(asl)
+    dem = get_dem()
+    if dem is not None and missing.any():
+        asl[missing] = await run_in_threadpool(dem.sample, lon[missing], lat[missing])
+    order, legs = await run_in_threadpool(
+        plan_route, lat, lon, asl, payload.climb_factor, payload.return_to_start
+    )
+
+    route = []
+    cumulative = cost = ascent = descent = 0.0
+    previous = None
+    for position, index in enumerate(order.tolist()):
+        leg = (0.0, 0.0, 0.0) if previous is None else (
+            float(legs.distance[previous, index]),
+            float(legs.ascent[previous, index]),
+            float(legs.descent[previous, index]),
+        )
+        if previous is not None:
+            cost += float(legs.cost[previous, index])
+        cumulative += leg[0]
+        ascent += leg[1]
+        descent += leg[2]
+        stop = dict(
+            order=position,
+            gps_n=float(lat[index]),
+            gps_e=float(lon[index]),
+            asl_m=None if np.isnan(asl[index]) else round(float(asl[index]), 1),
+            leg_distance_m=round(leg[0], 1),
+            leg_ascent_m=round(leg[1], 1),
+            leg_descent_m=round(leg[2], 1),
+            cumulative_distance_m=round(cumulative, 1),
+        )
+        if index:
+            entrance, cave_name = visits[index - 1]
+            stop.update(
+                cave_id=entrance.cave_id,
+                cave_name=cave_name,
+                entrance_id=entrance.entrance_id,
+                entrance_name=entrance.name,
             )
+        route.append(RouteStop(**stop))
+        previous = index
+
+    return RouteResult(
+        stops=route,
+        total_distance_m=round(cumulative, 1),
+        total_ascent_m=round(ascent, 1),
+        total_descent_m=round(descent, 1),
+        cost_m=round(cost, 1),
+        return_to_start=payload.return_to_start,
+        missing_cave_ids=[c for c in cave_ids if c not in found_caves],
+        missing_entrance_ids=[e for e in entrance_ids if e not in stops],
+    )
 
-            if response.status_code not in (200, 204):
-                # log but don't fail the whole delete
-                logger.warning(
-                    "Failed to delete group assignments: %s",
-                    response.status_code,
-                )
-            deleted_assignments = response.json().get("deleted_assignments", 0)
-    except Exception as e:
-        logger.warning(f"Error deleting group assignments: {e}")
 
-    result = await session.execute(delete(Cave))
-    await session.commit()
-    
-    return {"deleted_caves": result.rowcount, "deleted_assignments": deleted_assignments}
+# --- Nearest caves to many points ---
+# Public - no auth required
+@router.post("/entrances/nearest", response_model=NearestResult)
+async def find_nearest_caves(
+    payload: NearestRequest,
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Find the caves closest to each of many points in one request.
+
+    Each cave is reported once per point, through its entrance closest to
+    the point, ranked by distance. The lookup uses an in-memory grid index
+    over all entrances that is rebuilt when the catalogue changes.
+    """
+    if len(payload.points) > settings.nearest_max_points:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {settings.nearest_max_points} points can be looked up at once"
+        )
+    if payload.radius_m > settings.nearest_max_radius_m:
+        raise HTTPException(
+            status_code=400,
+            detail=f"The radius can be at most {settings.nearest_max_radius_m} m"
+        )
+
+    index = await get_entrance_index(session)
+    lat = np.array([point.gps_n for point in payload.points], dtype=np.float64)
+    lon = np.array([point.gps_e for point in payload.points], dtype=np.float64)
+    matches = await run_in_threadpool(index.nearest_caves, lat, lon, payload.radius_m, payload.limit)
+
+    return NearestResult(matches=[
+        [
+            NearestCave(
+                cave_id=int(index.cave_id[match.entrance]),
+                cave_name=index.cave_name[match.entrance],
+                entrance_id=int(index.entrance_id[match.entrance]),
+                entrance_name=index.entrance_name[match.entrance],
+                gps_n=float(index.lat[match.entrance]),
+                gps_e=float(index.lon[match.entrance]),
+                distance_m=round(match.distance_m, 1),
+            )
+            for match in point_matches
+        ]
+        for point_matches in matches
+    ])
+
+
+# --- Delete all caves (TESTING ONLY) ---
+@router.delete("/delete_all", response_model=JobRead, status_code=status.HTTP_202_ACCEPTED)
+async def delete_all_caves(
+    response: Response,
+    user: User = Depends(require_auth)
+):
+    """
+    Delete all caves and their entrances in the background. FOR TESTING ONLY.
+
+    Poll `/caves/jobs/{job_id}` for progress; the result has the numbers of
+    deleted caves and group assignments.
+    """
+    job = await job_runner.submit("delete_all_caves", {}, owner_email=user.email)
+    response.headers["Location"] = f"/caves/jobs/{job.job_id}"
+    return job
 
 
 # --- Get single cave endpoint ---
 # Public - no auth required
 @router.get("/{cave_id}", response_model=CaveRead)
-async def get_cave(cave_id: int, session: AsyncSession = Depends(get_session), user: User = Depends(require_auth)):
+async def get_cave(
+    cave_id: int,
+    session: AsyncSession = Depends(get_session),
+    user: User = Depends(require_auth),
+    fields: Optional[str] = Query(None, description="Comma-separated cave fields to return, e.g. cave_id,name,depth"),
+    include: Optional[str] = Query(None, description="Comma-separated related data to include: entrances, media, groups (default: entrances,media)"),
+):
+    selection = CaveSelection(fields, include, default_include={"entrances", "media"})
+
     result = await session.execute(
         select(Cave)
-        .options(selectinload(Cave.entrances))
-        .options(selectinload(Cave.media_files))
+        .options(*_cave_load_options(selection))
         .where(Cave.cave_id == cave_id)
     )
     cave = result.scalar_one_or_none()
     if cave is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cave not found")
 
-    # Fetch username for owner
-    print(f"fetching usernames for {cave.owner_email}")
-    usernames_map = await fetch_usernames([cave.owner_email])
-    print(f"Usernames map: {usernames_map}")
-
-    # Fetch media files
-    media_file_ids = [cm.media_file_id for cm in cave.media_files]
-    media_files_data = await fetch_media_files(media_file_ids)
-    # Convert to MediaFileSummary format
-    media_files = [
-        MediaFileSummary(
-            id=mf["id"],
-            filename=mf["filename"],
-            original_filename=mf["original_filename"],
-            content_type=mf["content_type"],
-            file_size=mf["file_size"],
-            uploaded_by=mf["uploaded_by"],
-            uploaded_at=mf["uploaded_at"],
-            download_url=mf.get("download_url")
-        )
-        for mf in media_files_data
-    ]
+    # Fetch owner username, media files and groups as requested
+    extras = CaveExtras()
+    await extras.load([cave], selection)
 
     # Check if current user is the owner
     is_owner = cave.owner_email == user.email
 
-    # Convert to dict and add username and ownership info
-    cave_dict = {
-        "cave_id": cave.cave_id,
-        "name": cave.name,
-        "zone": cave.zone,
-        "code": cave.code,
-        "first_surveyed": cave.first_surveyed,
-        "last_surveyed": cave.last_surveyed,
-        "length": cave.length,
-        "depth": cave.depth,
-        "vertical_extent": cave.vertical_extent,
-        "horizontal_extent": cave.horizontal_extent,
-        "owner_username": usernames_map.get(cave.owner_email, cave.owner_email.split('@')[0]),
-        "is_owner": is_owner,
-        "entrances": [
-            {
-                "entrance_id": e.entrance_id,
-                "name": e.name,
-                "gps_n": e.gps_n,
-                "gps_e": e.gps_e,
-                "asl_m": e.asl_m
-            }
-            for e in cave.entrances
-        ],
-        "media_files": [
-            {
-                "id": mf.id,
-                "filename": mf.filename,
-                "original_filename": mf.original_filename,
-                "content_type": mf.content_type,
-                "file_size": mf.file_size,
-                "uploaded_by": mf.uploaded_by,
-                "uploaded_at": mf.uploaded_at.isoformat(),
-                "download_url": mf.download_url
-            }
-            for mf in media_files
-        ]
-    }
+    cave_dict = _cave_to_dict(cave, extras.usernames_map, is_owner, selection=selection, extras=extras)
+    if selection.is_default:
+        return cave_dict
 
-    return cave_dict
+    return JSONResponse(content=jsonable_encoder(cave_dict))
 
 
 # --- Update cave endpoint ---
@@ -659,6 +1101,7 @@ async def update_cave(
     # For now, we'll keep entrances as-is (could be updated separately if needed)
 
     await session.commit()
+    await bump_data_version()
     await session.refresh(cave, ["entrances"])
 
     # Fetch username for owner
@@ -726,6 +1169,169 @@ async def delete_cave(
         )
 
 
+# --- Upload cave survey endpoint ---
+# Protected - requires authentication and ownership or group edit permission
+@router.post("/{cave_id}/survey", response_model=SurveyResult)
+async def upload_cave_survey(
+    cave_id: int,
+    file: UploadFile = File(..., description="Survex .svx, Therion .th or Compass .dat survey file"),
+    format: Optional[SurveyFormat] = Query(None, description="Survey format (default: detected from the file name)"),
+    apply: bool = Query(True, description="Write the computed statistics and centerline to the cave"),
+    session: AsyncSession = Depends(get_session),
+    user: User = Depends(require_auth)
+):
+    """
+    Compute a cave's length, depth, vertical and horizontal extent from survey data.
+
+    The shots are reduced to a station network whose loops are closed by
+    least squares. Unless `apply` is false, the statistics replace the
+    values stored on the cave and the centerline levels of detail are
+    rebuilt if the survey file changed.
+    """
+    result = await session.execute(select(Cave).where(Cave.cave_id == cave_id))
+    cave = result.scalar_one_or_none()
+    if cave is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cave not found")
+
+    # Check ownership or group permissions
+    if cave.owner_email != user.email:
+        has_permission = False
+        try:
+            async with httpx.AsyncClient() as client:
+                response = await client.get(
+                    f"{GROUP_SERVICE_URL}/groups/{cave_id}/permissions/{user.email}",
+                    timeout=5.0
+                )
+                if response.status_code == 200:
+                    has_permission = response.json().get("can_edit", False)
+        except Exception as e:
+            logger.error(f"Error checking cave permissions with group service: {e}")
+
+        if not has_permission:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="You don't have permission to edit this cave. Either own the cave or be an admin/owner of its assigned group."
+            )
+
+    survey_format = format or detect_survey_format(file.filename)
+    if survey_format is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Unknown survey format. Use a .svx, .th or .dat file or pass the format parameter."
+        )
+
+    content = await file.read()
+    survey_hash = hashlib.sha256(content).hexdigest()
+    stored_hash = await session.scalar(
+        select(CaveCenterline.survey_hash).where(CaveCenterline.cave_id == cave_id).limit(1)
+    )
+    simplify = apply and stored_hash != survey_hash
+
+    try:
+        # Small surveys are cheaper in a thread than shipped to another process
+        if len(content) > settings.survey_inline_max_bytes:
+            network, levels = await run_in_process(process_survey_centerline, content, survey_format, simplify)
+        else:
+            network, levels = await run_in_threadpool(process_survey_centerline, content, survey_format, simplify)
+    except SurveyError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid {survey_format} survey: {e}")
+
+    stats = network.statistics()
+    if apply:
+        cave.length = stats["length"]
+        cave.depth = stats["depth"]
+        cave.vertical_extent = stats["vertical_extent"]
+        cave.horizontal_extent = stats["horizontal_extent"]
+        if simplify:
+            await session.execute(delete(CaveCenterline).where(CaveCenterline.cave_id == cave_id))
+            anchor = network.station_names[anchor_station(network)]
+            session.add_all([
+                CaveCenterline(
+                    cave_id=cave_id,
+                    level=level.level,
+                    tolerance=level.tolerance,
+                    survey_hash=survey_hash,
+                    anchor_station=anchor,
+                    point_count=level.point_count,
+                    lines=level.lines,
+                )
+                for level in levels
+            ])
+        await session.commit()
+        await bump_data_version()
+
+    return SurveyResult(
+        format=survey_format,
+        stations=len(network.station_names),
+        shots=len(network.legs),
+        splays=network.splays,
+        loops=network.loops,
+        max_adjustment=network.max_adjustment,
+        applied=apply,
+        centerline_updated=simplify,
+        warnings=network.warnings,
+        **stats,
+    )
+
+
+# --- Get cave centerline endpoint ---
+# Public - no authentication required
+@router.get("/{cave_id}/centerline")
+async def get_cave_centerline(
+    cave_id: int,
+    request: Request,
+    zoom: Optional[float] = Query(None, ge=0, le=24, description="Map zoom; picks the coarsest level that stays within a pixel"),
+    level: Optional[int] = Query(None, ge=0, description="Level of detail, 0 being every survey station (overrides zoom)"),
+    session: AsyncSession = Depends(get_session)
+):
+    """
+    Get a cave's survey centerline as GeoJSON, placed at its first entrance.
+
+    Levels of detail are simplified once per survey upload. Rendered
+    responses are cached per catalogue data version and revalidated with
+    ETags, so they follow entrance moves and survey re-uploads.
+    """
+    result = await session.execute(
+        select(CaveCenterline.level, CaveCenterline.tolerance).where(CaveCenterline.cave_id == cave_id)
+    )
+    tolerances = dict(result.all())
+    if not tolerances:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cave has no centerline")
+
+    result = await session.execute(
+        select(Entrance).where(Entrance.cave_id == cave_id).order_by(Entrance.entrance_id).limit(1)
+    )
+    entrance = result.scalar_one_or_none()
+    if entrance is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cave has no entrance to place the centerline at")
+
+    if level is None:
+        level = level_for_zoom(tolerances, zoom, entrance.gps_n) if zoom is not None else min(tolerances)
+    elif level not in tolerances:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Centerline level {level} not found")
+
+    version = await get_data_version(session)
+    etag = f'W/"centerline-{cave_id}-{level}-{version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if if_none_match_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    cached = response_cache.get(("centerline", cave_id, level), version)
+    if cached is None:
+        row = await session.get(CaveCenterline, (cave_id, level))
+        body = centerline_geojson(
+            cave_id,
+            CenterlineLevel(level=row.level, tolerance=row.tolerance, lines=row.lines, point_count=row.point_count),
+            entrance.gps_n,
+            entrance.gps_e,
+            entrance.asl_m,
+        )
+        cached = response_cache.set(("centerline", cave_id, level), body, "application/geo+json", version)
+
+    return cached_response(request, cached, headers)
+
+
 # --- Associate media with cave endpoint ---
 # Protected - requires authentication
 @router.post("/{cave_id}/media/{media_file_id}", status_code=status.HTTP_201_CREATED)
@@ -883,6 +1489,13 @@ async def delete_media_from_cave(
     await session.delete(cave_media)
     await session.commit()
 
+    # Keep the file while another cave still links to it
+    still_linked = await session.scalar(
+        select(CaveMedia.cave_id).where(CaveMedia.media_file_id == media_file_id).limit(1)
+    )
+    if still_linked is not None:
+        return
+
     # Tell media-service to delete the underlying media file
     try:
         async with httpx.AsyncClient() as client:
@@ -947,46 +1560,153 @@ async def get_user_stats(
         total_depth=total_depth
     )
     
-    # --- uUpload list of caves ()TES# --- Upload list of caves (TESTING ONLY) ---# --- Upload list of caves (TESTING ONLY) ---
-@router.post("/bulk_upload", status_code=status.HTTP_201_CREATED)
+
+
+def _require_bulk_size(caves: list) -> None:
+    """Keep request-bound bulk writes short; larger uploads go through the import job."""
+    if len(caves) > settings.bulk_max_rows:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.bulk_max_rows} caves per request; use /caves/import for larger uploads"
+        )
+
+
+# --- Bulk upload caves ---
+# Protected - requires authentication
+@router.post("/bulk_upload", response_model=BulkUploadResult, status_code=status.HTTP_201_CREATED)
 async def bulk_upload_caves(
-    caves: list[CaveCreate],
+    caves: list[BulkCaveRow],
     session: AsyncSession = Depends(get_session),
+    user: User = Depends(require_auth),
+    chunk_size: Optional[int] = Query(None, ge=1, le=MAX_CHUNK_SIZE, description="Caves committed per transaction (default from settings)"),
+    crs: Optional[str] = Query(None, description=CRS_DESCRIPTION),
+):
+    """
+    Bulk upload caves in the CaveCreate format.
+
+    Caves are inserted in chunks with one multi-row INSERT per chunk and
+    committed chunk by chunk. Invalid or conflicting rows are reported in
+    `errors` instead of aborting the whole upload. At most
+    settings.bulk_max_rows caves per request; import larger sets with
+    /caves/import.
+    """
+    _require_bulk_size(caves)
+    source_crs = _parse_crs(crs)
+    result = BulkUploadResult()
+    valid = validate_cave_rows(caves, result)
+    entrances_to_wgs84([e for _, cave in valid for e in cave.entrances or ()], source_crs)
+    await bulk_insert_caves(session, valid, user.email, result=result, chunk_size=chunk_size)
+    result.errors.sort(key=lambda e: e.index)
+    return result
+
+
+# --- Bulk upsert caves ---
+# Protected - requires authentication
+@router.post("/bulk_upsert", response_model=BulkUploadResult)
+async def bulk_upsert_caves_route(
+    caves: list[BulkCaveRow],
+    session: AsyncSession = Depends(get_session),
+    user: User = Depends(require_auth),
+    chunk_size: Optional[int] = Query(None, ge=1, le=MAX_CHUNK_SIZE, description="Caves committed per transaction (default from settings)"),
+    prune_entrances: bool = Query(False, description="Delete existing entrances that are not in the upload"),
+    crs: Optional[str] = Query(None, description=CRS_DESCRIPTION),
+):
+    """
+    Bulk insert or update caves by name in the CaveCreate format.
+
+    Safe to re-run with the same data: caves whose fields and entrances are
+    unchanged are skipped without writing. Entrances are matched by
+    coordinates. Only your own caves are updated. At most
+    settings.bulk_max_rows caves per request.
+    """
+    _require_bulk_size(caves)
+    source_crs = _parse_crs(crs)
+    result = BulkUploadResult()
+    valid = validate_cave_rows(caves, result)
+    entrances_to_wgs84([e for _, cave in valid for e in cave.entrances or ()], source_crs)
+    await bulk_upsert_caves(
+        session, valid, user.email, result=result, chunk_size=chunk_size, prune_entrances=prune_entrances
+    )
+    result.errors.sort(key=lambda e: e.index)
+    return result
+
+
+# --- Import caves from a file ---
+# Protected - requires authentication
+@router.post("/import", response_model=JobRead, status_code=status.HTTP_202_ACCEPTED)
+async def import_caves_file(
+    response: Response,
+    file: UploadFile = File(..., description="CSV, GeoJSON or KML file with one entrance per record"),
+    format: Optional[ImportFormat] = Query(None, description="File format (default: detected from the file name)"),
+    chunk_size: Optional[int] = Query(None, ge=1, le=MAX_CHUNK_SIZE, description="Caves committed per transaction (default from settings)"),
+    upsert: bool = Query(False, description="Update existing caves by name instead of reporting conflicts"),
+    prune_entrances: bool = Query(False, description="With upsert, delete existing entrances missing from the file"),
+    crs: Optional[str] = Query(None, description=CRS_DESCRIPTION),
+    dedupe: Optional[DedupeMode] = Query(
+        None, description="Report ('flag') or skip ('merge') entrances that duplicate an earlier record or an existing entrance"
+    ),
+    dedupe_radius_m: Optional[float] = Query(None, gt=0, description="Largest distance between duplicate entrances (default from settings)"),
     user: User = Depends(require_auth)
 ):
-    """Bulk upload caves. For testing purposes only."""
-    created_caves = []
-    for cave_data in caves:
-        new_cave = Cave(
-            name=cave_data.name,
-            zone=cave_data.zone,
-            code=cave_data.code,
-            first_surveyed=cave_data.first_surveyed,
-            last_surveyed=cave_data.last_surveyed,
-            length=cave_data.length,
-            depth=cave_data.depth,
-            vertical_extent=cave_data.vertical_extent,
-            horizontal_extent=cave_data.horizontal_extent,
-            owner_email=user.email
+    """
+    Import caves and entrances from a CSV, GeoJSON or KML file in the background.
+
+    The upload is spooled to the database and imported by a background job; poll
+    `/caves/jobs/{job_id}` for progress and the final counts and per-row
+    errors. The file is parsed incrementally and fed to the bulk insert path
+    in batches. With upsert, re-importing the same file only writes what
+    changed. With dedupe, entrances within the radius of another one and
+    with a similar name are listed in the result's `duplicates`.
+    """
+    file_format = format or detect_format(file.filename)
+    if file_format is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Unknown file format. Use a .csv, .geojson or .kml file or pass the format parameter."
         )
-        session.add(new_cave)
-        await session.flush()  # Get cave_id
+    source_crs = _parse_crs(crs)
+
+    async with async_session() as session:
+        spool_id, _ = await spool_upload(session, file)
+
+    job = await job_runner.submit(
+        "import_caves",
+        {
+            "spool_id": spool_id,
+            "filename": file.filename,
+            "format": file_format,
+            "owner_email": user.email,
+            "chunk_size": chunk_size,
+            "upsert": upsert,
+            "prune_entrances": prune_entrances,
+            "crs": f"EPSG:{source_crs.code}",
+            "dedupe": dedupe,
+            "dedupe_radius_m": dedupe_radius_m,
+        },
+        owner_email=user.email,
+    )
+    response.headers["Location"] = f"/caves/jobs/{job.job_id}"
+    return job
 
-        # Add entrances if provided
-        if cave_data.entrances:
-            entrances = [
-                Entrance(
-                    cave_id=new_cave.cave_id,
-                    name=ent.name,
-                    gps_n=ent.gps_n,
-                    gps_e=ent.gps_e,
-                    asl_m=ent.asl_m
-                )
-                for ent in cave_data.entrances
-            ]
-            session.add_all(entrances)
 
-        created_caves.append(new_cave)
+# --- Backfill entrance altitudes from the DEM ---
+# Protected - requires the service token or an administrator
+@router.post("/elevations/backfill", response_model=JobRead, status_code=status.HTTP_202_ACCEPTED)
+async def backfill_entrance_elevations(
+    response: Response,
+    validate: bool = Query(False, description="Also report entrances whose altitude disagrees with the DEM"),
+    user: User = Depends(require_admin)
+):
+    """
+    Fill in missing entrance altitudes (asl_m) from the DEM in the background.
 
-    await session.commit()
-    return {"created": len(created_caves)}
\ No newline at end of file
+    Only entrances without an altitude are written. With validate, existing
+    altitudes that differ from the DEM by more than the configured
+    tolerance are listed in the job result for review.
+    """
+    if get_dem() is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="No elevation model configured")
+
+    job = await job_runner.submit("elevation_backfill", {"validate": validate}, owner_email=user.email)
+    response.headers["Location"] = f"/caves/jobs/{job.job_id}"
+    return job
@@ -1,6 +1,6 @@
 # schemas.py
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, field_validator, model_validator
+from typing import Annotated, Any, List, Optional, Union
 from datetime import datetime
 
 class EntranceBase(BaseModel):
@@ -48,6 +48,15 @@ class MediaFileSummary(BaseModel):
     download_url: Optional[str] = None
 
 
+class CaveGroupSummary(BaseModel):
+    """Summary of a group assignment from group-service."""
+    group_id: int
+    group_name: str
+    group_description: Optional[str] = None
+    assigned_at: datetime
+    assigned_by: str
+
+
 class CaveBase(BaseModel):
     name: str
     zone: Optional[str] = None
@@ -69,12 +78,190 @@ class CaveRead(CaveBase):
     is_owner: bool
     entrances: List[EntranceRead] = []
     media_files: List[MediaFileSummary] = []
+    groups: List[CaveGroupSummary] = []
 
     class Config:
         from_attributes = True
 
+class CaveImportRow(BaseModel):
+    """One record of an import file: cave attributes plus at most one entrance."""
+    name: str
+    zone: Optional[str] = None
+    code: Optional[str] = None
+    first_surveyed: Optional[str] = None
+    last_surveyed: Optional[str] = None
+    length: Optional[float] = None
+    depth: Optional[float] = None
+    vertical_extent: Optional[float] = None
+    horizontal_extent: Optional[float] = None
+    entrance_name: Optional[str] = None
+    gps_n: Optional[float] = None
+    gps_e: Optional[float] = None
+    asl_m: Optional[float] = None
+
+    @field_validator("*", mode="before")
+    @classmethod
+    def empty_to_none(cls, value):
+        """Treat blank spreadsheet cells as missing values."""
+        if isinstance(value, str):
+            value = value.strip()
+            return value or None
+        return value
+
+    @model_validator(mode="after")
+    def both_coordinates(self):
+        """An entrance needs both coordinates; a row with one of them is an error, not a cave without entrance."""
+        if (self.gps_n is None) != (self.gps_e is None):
+            raise ValueError("gps_n and gps_e must be given together")
+        return self
+
+
+# A row of a bulk upload; rows that are not a valid CaveCreate are kept as
+# submitted, so they are reported in BulkUploadResult.errors instead of
+# rejecting the whole request
+BulkCaveRow = Annotated[Union[CaveCreate, dict[str, Any]], Field(union_mode="left_to_right")]
+
+
+class BulkRowError(BaseModel):
+    """A row that could not be ingested."""
+    index: int = Field(..., description="Position of the row in the submitted data")
+    name: Optional[str] = None
+    error: str
+
+
+class DuplicateEntrance(BaseModel):
+    """An imported entrance close to, and named like, another one."""
+    index: int = Field(..., description="Position of the record in the file")
+    name: Optional[str] = None
+    duplicate_of_index: Optional[int] = Field(None, description="Earlier record in the file it duplicates")
+    duplicate_of_entrance_id: Optional[int] = Field(None, description="Existing entrance it duplicates")
+    duplicate_of_name: Optional[str] = None
+    distance_m: float
+    similarity: float = Field(..., description="Name similarity between 0 and 1")
+    merged: bool = Field(..., description="Whether the record was skipped in favour of the one it duplicates")
+
+
+class BulkUploadResult(BaseModel):
+    """Outcome of a bulk ingest."""
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    errors: List[BulkRowError] = []
+    duplicates: List[DuplicateEntrance] = []
+
+
+class SurveyResult(BaseModel):
+    """Statistics computed from an uploaded survey file."""
+    format: str
+    stations: int
+    shots: int
+    splays: int
+    loops: int
+    length: float
+    depth: float
+    vertical_extent: float
+    horizontal_extent: float
+    max_adjustment: float = Field(..., description="Largest loop closure correction of a traverse, in metres")
+    applied: bool
+    centerline_updated: bool = Field(False, description="Whether the stored centerline levels were rebuilt")
+    warnings: List[str] = []
+
+
+class RoutePoint(BaseModel):
+    """Start of a planned route."""
+    gps_n: float = Field(..., ge=-90, le=90, description="Latitude (N)")
+    gps_e: float = Field(..., ge=-180, le=180, description="Longitude (E)")
+    asl_m: Optional[float] = None
+
+
+class RouteRequest(BaseModel):
+    """Caves and entrances to visit, in any order."""
+    start: RoutePoint
+    cave_ids: List[int] = Field([], description="Caves to visit, each through its entrance closest to the start")
+    entrance_ids: List[int] = Field([], description="Entrances to visit")
+    return_to_start: bool = False
+    climb_factor: float = Field(10.0, ge=0, description="Metres of walking one metre of ascent is worth")
+
+
+class RouteStop(BaseModel):
+    """A stop on a planned route with the leg that leads to it."""
+    order: int
+    cave_id: Optional[int] = Field(None, description="None for the start point")
+    cave_name: Optional[str] = None
+    entrance_id: Optional[int] = None
+    entrance_name: Optional[str] = None
+    gps_n: float
+    gps_e: float
+    asl_m: Optional[float] = None
+    leg_distance_m: float = Field(..., description="Straight-line distance from the previous stop")
+    leg_ascent_m: float
+    leg_descent_m: float
+    cumulative_distance_m: float
+
+
+class RouteResult(BaseModel):
+    """Visiting order for a set of entrances."""
+    stops: List[RouteStop]
+    total_distance_m: float
+    total_ascent_m: float
+    total_descent_m: float
+    cost_m: float = Field(..., description="Distance plus climb_factor times the ascent, the quantity minimized")
+    return_to_start: bool
+    missing_cave_ids: List[int] = []
+    missing_entrance_ids: List[int] = []
+
+
+class NearestRequest(BaseModel):
+    """Points to find the closest caves for, e.g. photo positions."""
+    points: List[RoutePoint]
+    radius_m: float = Field(500.0, gt=0, description="Largest distance from a point to a cave entrance")
+    limit: int = Field(5, ge=1, le=50, description="Most caves returned per point")
+
+
+class NearestCave(BaseModel):
+    """A cave near a point, through its entrance closest to the point."""
+    cave_id: int
+    cave_name: str
+    entrance_id: int
+    entrance_name: Optional[str] = None
+    gps_n: float
+    gps_e: float
+    distance_m: float
+
+
+class NearestResult(BaseModel):
+    """Caves near each requested point, in the order of the points."""
+    matches: List[List[NearestCave]] = Field(..., description="Nearest first; empty when no cave is within the radius")
+
+
 class UserStats(BaseModel):
     """Statistics for a user."""
     caves_uploaded: int
     total_length: float
-    total_depth: float
\ No newline at end of file
+    total_depth: float
+
+
+class ZoneFacet(BaseModel):
+    """Number of caves in a zone."""
+    zone: Optional[str] = None
+    count: int
+
+
+class HistogramBucket(BaseModel):
+    """Histogram bucket covering [min, max); max is None for the open last bucket."""
+    min: float
+    max: Optional[float] = None
+    count: int
+
+
+class HistogramFacet(BaseModel):
+    buckets: List[HistogramBucket]
+    missing: int = Field(0, description="Caves without a value")
+
+
+class CaveFacets(BaseModel):
+    """Facet counts for the caves matching a filter set."""
+    total: int
+    zones: List[ZoneFacet]
+    depth: HistogramFacet
+    length: HistogramFacet
@@ -0,0 +1,23 @@
+# Identical in every service with background jobs; see src.utils.jobs
+from pydantic import BaseModel
+from typing import Any, Optional
+from datetime import datetime
+from src.models.job import JobStatus
+
+
+class JobRead(BaseModel):
+    """Status and progress of a background job."""
+    job_id: str
+    job_type: str
+    status: JobStatus
+    progress_done: int
+    progress_total: Optional[int] = None
+    message: Optional[str] = None
+    result: Optional[dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,398 @@
+import logging
+from itertools import islice
+from typing import Any, Awaitable, Callable, Iterable, Iterator, Optional, Union
+from pydantic import ValidationError
+from sqlalchemy import and_, delete, insert, literal_column, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.config.settings import settings
+from src.models.cave import Cave, Entrance
+from src.schemas.cave import CaveCreate, BulkRowError, BulkUploadResult, EntranceCreate
+from src.utils.data_version import bump_data_version
+from src.utils.elevation import fill_missing_elevations
+
+logger = logging.getLogger(__name__)
+
+
+def chunked(items: Iterable, size: int) -> Iterator[list]:
+    """Yield lists of at most size items."""
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _format_validation_error(error: ValidationError) -> str:
+    """Summarize a pydantic validation error on one line."""
+    return "; ".join(
+        f"{'.'.join(str(loc) for loc in e['loc']) or 'row'}: {e['msg']}" for e in error.errors()
+    )
+
+
+def validate_cave_rows(
+    rows: list[Union[CaveCreate, dict[str, Any]]],
+    result: BulkUploadResult,
+    start_index: int = 0,
+) -> list[tuple[int, CaveCreate]]:
+    """
+    Validate raw cave rows, recording invalid rows in result.
+
+    Returns (index, cave) pairs for the valid rows.
+    """
+    valid = []
+    for offset, row in enumerate(rows):
+        index = start_index + offset
+        try:
+            valid.append((index, CaveCreate.model_validate(row)))
+        except ValidationError as e:
+            name = row.get("name") if isinstance(row, dict) else None
+            result.errors.append(BulkRowError(index=index, name=name, error=_format_validation_error(e)))
+    return valid
+
+
+# Cave columns written by bulk ingest; owner_email is never changed by an upsert
+CAVE_FIELDS = (
+    "zone",
+    "code",
+    "first_surveyed",
+    "last_surveyed",
+    "length",
+    "depth",
+    "vertical_extent",
+    "horizontal_extent",
+)
+
+# Entrances are matched by coordinates rounded to about 1 cm
+COORDINATE_PRECISION = 7
+
+# PostgreSQL binds at most this many parameters per statement, and a cave
+# row of the multi-row INSERT binds one per column
+MAX_BIND_PARAMETERS = 32767
+MAX_CHUNK_SIZE = MAX_BIND_PARAMETERS // (len(CAVE_FIELDS) + 2)
+
+ChunkWriter = Callable[[AsyncSession, list[tuple[int, CaveCreate]], str, BulkUploadResult], Awaitable[None]]
+
+
+def _cave_row(cave: CaveCreate, owner_email: str) -> dict:
+    return {
+        "name": cave.name,
+        "zone": cave.zone,
+        "code": cave.code,
+        "first_surveyed": cave.first_surveyed,
+        "last_surveyed": cave.last_surveyed,
+        "length": cave.length,
+        "depth": cave.depth,
+        "vertical_extent": cave.vertical_extent,
+        "horizontal_extent": cave.horizontal_extent,
+        "owner_email": owner_email,
+    }
+
+
+def _entrance_rows(cave: CaveCreate, cave_id: int, unique: bool = False) -> list[dict]:
+    """Entrance rows of a cave; with unique, only the first entrance at each position."""
+    return [
+        {
+            "cave_id": cave_id,
+            "name": ent.name,
+            "gps_n": ent.gps_n,
+            "gps_e": ent.gps_e,
+            "asl_m": ent.asl_m,
+        }
+        for ent in (_unique_entrances(cave) if unique else cave.entrances or [])
+    ]
+
+
+def _entrance_key(gps_n: float, gps_e: float) -> tuple[float, float]:
+    return round(gps_n, COORDINATE_PRECISION), round(gps_e, COORDINATE_PRECISION)
+
+
+def _unique_entrances(cave: CaveCreate) -> list[EntranceCreate]:
+    """The first uploaded entrance at each position, as upserts match entrances by position."""
+    unique: dict[tuple[float, float], EntranceCreate] = {}
+    for ent in cave.entrances or []:
+        unique.setdefault(_entrance_key(ent.gps_n, ent.gps_e), ent)
+    return list(unique.values())
+
+
+async def _insert_chunk(
+    session: AsyncSession,
+    chunk: list[tuple[int, CaveCreate]],
+    owner_email: str,
+    result: BulkUploadResult,
+) -> None:
+    """
+    Insert one chunk of caves with a single multi-row INSERT ... RETURNING,
+    then all of their entrances in one batch.
+
+    Names that already exist are skipped by ON CONFLICT and reported as
+    per-row errors.
+    """
+    stmt = (
+        pg_insert(Cave)
+        .values([_cave_row(cave, owner_email) for _, cave in chunk])
+        .on_conflict_do_nothing(index_elements=[Cave.name])
+        .returning(Cave.cave_id, Cave.name)
+    )
+    ids_by_name = {name: cave_id for cave_id, name in (await session.execute(stmt)).all()}
+
+    entrance_rows = []
+    for index, cave in chunk:
+        cave_id = ids_by_name.get(cave.name)
+        if cave_id is None:
+            result.errors.append(BulkRowError(index=index, name=cave.name, error="Cave name already exists."))
+            continue
+        entrance_rows.extend(_entrance_rows(cave, cave_id))
+
+    if entrance_rows:
+        await session.execute(insert(Entrance), entrance_rows)
+
+    result.created += len(ids_by_name)
+
+
+async def _sync_entrances(
+    session: AsyncSession,
+    caves: list[tuple[CaveCreate, int]],
+    prune: bool,
+) -> set[int]:
+    """
+    Bring the entrances of existing caves in line with the upload.
+
+    Entrances are matched by coordinates: unmatched uploaded entrances are
+    inserted, matched ones are updated only when their name or altitude
+    differs, and existing entrances missing from the upload are deleted only
+    when prune is set (they may have been added by hand).
+
+    Returns:
+        set[int]: Ids of the caves whose entrances changed
+    """
+    cave_ids = [cave_id for _, cave_id in caves]
+    existing: dict[int, dict[tuple[float, float], Entrance]] = {cave_id: {} for cave_id in cave_ids}
+    rows = await session.execute(select(Entrance).where(Entrance.cave_id.in_(cave_ids)))
+    for entrance in rows.scalars():
+        existing[entrance.cave_id].setdefault(_entrance_key(entrance.gps_n, entrance.gps_e), entrance)
+
+    inserts, updates, deletes = [], [], []
+    changed: set[int] = set()
+    for cave, cave_id in caves:
+        current = existing[cave_id]
+        matched: set[tuple[float, float]] = set()
+        for ent in _unique_entrances(cave):
+            key = _entrance_key(ent.gps_n, ent.gps_e)
+            entrance = current.get(key)
+            if entrance is None:
+                inserts.append({"cave_id": cave_id, "name": ent.name, "gps_n": ent.gps_n, "gps_e": ent.gps_e, "asl_m": ent.asl_m})
+                changed.add(cave_id)
+            elif (entrance.name, entrance.asl_m) != (ent.name, ent.asl_m):
+                updates.append({"entrance_id": entrance.entrance_id, "name": ent.name, "asl_m": ent.asl_m})
+                changed.add(cave_id)
+            matched.add(key)
+
+        if prune:
+            stale = [e.entrance_id for key, e in current.items() if key not in matched]
+            if stale:
+                deletes.extend(stale)
+                changed.add(cave_id)
+
+    if inserts:
+        await session.execute(insert(Entrance), inserts)
+    if updates:
+        await session.execute(update(Entrance), updates)
+    if deletes:
+        await session.execute(delete(Entrance).where(Entrance.entrance_id.in_(deletes)))
+    return changed
+
+
+async def _upsert_chunk(
+    session: AsyncSession,
+    chunk: list[tuple[int, CaveCreate]],
+    owner_email: str,
+    result: BulkUploadResult,
+    prune_entrances: bool = False,
+) -> None:
+    """
+    Upsert one chunk of caves by name with a single INSERT ... ON CONFLICT DO UPDATE.
+
+    The update only fires for caves owned by the uploader whose columns
+    actually differ, so unchanged rows are not rewritten. Entrances of
+    existing caves are then diffed by coordinates.
+    """
+    stmt = pg_insert(Cave).values([_cave_row(cave, owner_email) for _, cave in chunk])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Cave.name],
+        set_={field: stmt.excluded[field] for field in CAVE_FIELDS},
+        where=and_(
+            Cave.owner_email == owner_email,
+            or_(*(getattr(Cave, field).is_distinct_from(stmt.excluded[field]) for field in CAVE_FIELDS)),
+        ),
+    ).returning(Cave.cave_id, Cave.name, literal_column("xmax = 0").label("inserted"))
+    written = {name: (cave_id, inserted) for cave_id, name, inserted in (await session.execute(stmt)).all()}
+
+    # Rows skipped by the WHERE clause are either unchanged or owned by someone else
+    skipped = [cave.name for _, cave in chunk if cave.name not in written]
+    existing = {}
+    if skipped:
+        rows = await session.execute(
+            select(Cave.name, Cave.cave_id, Cave.owner_email).where(Cave.name.in_(skipped))
+        )
+        existing = {name: (cave_id, email) for name, cave_id, email in rows.all()}
+
+    new_entrances, synced, updated_ids = [], [], set()
+    for index, cave in chunk:
+        if cave.name in written:
+            cave_id, inserted = written[cave.name]
+            if inserted:
+                new_entrances.extend(_entrance_rows(cave, cave_id, unique=True))
+                result.created += 1
+                continue
+            updated_ids.add(cave_id)
+            synced.append((cave, cave_id))
+            continue
+
+        found = existing.get(cave.name)
+        if found is None:
+            # Deleted between the upsert and the lookup
+            result.errors.append(BulkRowError(index=index, name=cave.name, error="Cave was deleted during the upload."))
+            continue
+        cave_id, email = found
+        if email != owner_email:
+            result.errors.append(BulkRowError(index=index, name=cave.name, error="Cave name belongs to another user."))
+            continue
+        synced.append((cave, cave_id))
+
+    if new_entrances:
+        await session.execute(insert(Entrance), new_entrances)
+
+    if synced:
+        changed = updated_ids | await _sync_entrances(session, synced, prune_entrances)
+        result.updated += len(changed)
+        result.unchanged += len(synced) - len(changed)
+
+
+def _snapshot(result: BulkUploadResult) -> tuple[int, int, int, int]:
+    return result.created, result.updated, result.unchanged, len(result.errors)
+
+
+def _restore(result: BulkUploadResult, snapshot: tuple[int, int, int, int]) -> None:
+    """Discard what a rolled back write added to the result."""
+    result.created, result.updated, result.unchanged, error_count = snapshot
+    del result.errors[error_count:]
+
+
+async def _write_rows_individually(
+    session: AsyncSession,
+    chunk: list[tuple[int, CaveCreate]],
+    owner_email: str,
+    result: BulkUploadResult,
+    write_chunk: ChunkWriter,
+) -> None:
+    """Write a failed chunk row by row in savepoints to isolate the bad rows."""
+    for index, cave in chunk:
+        snapshot = _snapshot(result)
+        try:
+            async with session.begin_nested():
+                await write_chunk(session, [(index, cave)], owner_email, result)
+        except Exception as e:
+            _restore(result, snapshot)
+            result.errors.append(BulkRowError(index=index, name=cave.name, error=str(e).splitlines()[0]))
+
+
+async def _write_in_chunks(
+    session: AsyncSession,
+    caves: Iterable[tuple[int, CaveCreate]],
+    owner_email: str,
+    result: BulkUploadResult,
+    chunk_size: int,
+    write_chunk: ChunkWriter,
+) -> None:
+    """Run write_chunk over deduplicated chunks, committing after each one."""
+    for chunk in chunked(caves, min(chunk_size, MAX_CHUNK_SIZE)):
+        # Duplicate names inside a chunk cannot be told apart by RETURNING
+        seen: set[str] = set()
+        unique_chunk = []
+        for index, cave in chunk:
+            if cave.name in seen:
+                result.errors.append(BulkRowError(index=index, name=cave.name, error="Duplicate cave name in upload."))
+                continue
+            seen.add(cave.name)
+            unique_chunk.append((index, cave))
+
+        if not unique_chunk:
+            continue
+        await fill_missing_elevations([e for _, cave in unique_chunk for e in cave.entrances or ()])
+
+        snapshot = _snapshot(result)
+        written_before = result.created + result.updated
+        try:
+            await write_chunk(session, unique_chunk, owner_email, result)
+        except Exception as e:
+            logger.warning(f"Bulk write of {len(unique_chunk)} caves failed, retrying row by row: {str(e).splitlines()[0]}")
+            await session.rollback()
+            _restore(result, snapshot)
+            await _write_rows_individually(session, unique_chunk, owner_email, result, write_chunk)
+
+        await session.commit()
+        if result.created + result.updated > written_before:
+            await bump_data_version()
+
+
+async def bulk_insert_caves(
+    session: AsyncSession,
+    caves: Iterable[tuple[int, CaveCreate]],
+    owner_email: str,
+    result: Optional[BulkUploadResult] = None,
+    chunk_size: Optional[int] = None,
+) -> BulkUploadResult:
+    """
+    Insert caves and their entrances in chunks, committing after each chunk.
+
+    Each chunk costs two statements regardless of its size. A chunk that
+    fails as a whole is retried row by row so that one bad row does not
+    abort the rest of the import; failures are reported in the result
+    instead of raised.
+
+    Args:
+        session: Database session
+        caves: (index, cave) pairs; the index is used in error reports
+        owner_email: Email of the user the caves are created for
+        result: Result to accumulate into, e.g. across batches of a stream
+        chunk_size: Caves per transaction (default: settings.bulk_chunk_size, at most MAX_CHUNK_SIZE)
+
+    Returns:
+        BulkUploadResult: Number of created caves and per-row errors
+    """
+    result = result if result is not None else BulkUploadResult()
+    await _write_in_chunks(session, caves, owner_email, result, chunk_size or settings.bulk_chunk_size, _insert_chunk)
+    return result
+
+
+async def bulk_upsert_caves(
+    session: AsyncSession,
+    caves: Iterable[tuple[int, CaveCreate]],
+    owner_email: str,
+    result: Optional[BulkUploadResult] = None,
+    chunk_size: Optional[int] = None,
+    prune_entrances: bool = False,
+) -> BulkUploadResult:
+    """
+    Insert or update caves by name in chunks, committing after each chunk.
+
+    Re-running the same upload is a no-op: caves whose columns and entrances
+    are unchanged are not written at all. Only caves owned by the uploader
+    are updated; name clashes with other users' caves are reported as errors.
+
+    Args:
+        session: Database session
+        caves: (index, cave) pairs; the index is used in error reports
+        owner_email: Email of the uploading user
+        result: Result to accumulate into, e.g. across batches of a stream
+        chunk_size: Caves per transaction (default: settings.bulk_chunk_size, at most MAX_CHUNK_SIZE)
+        prune_entrances: Delete existing entrances that are not in the upload
+
+    Returns:
+        BulkUploadResult: Created, updated and unchanged counts and per-row errors
+    """
+    async def write_chunk(session, chunk, owner_email, result):
+        await _upsert_chunk(session, chunk, owner_email, result, prune_entrances=prune_entrances)
+
+    result = result if result is not None else BulkUploadResult()
+    await _write_in_chunks(session, caves, owner_email, result, chunk_size or settings.bulk_chunk_size, write_chunk)
+    return result
@@ -1,11 +1,13 @@
 import httpx
 import logging
 import os
+from typing import Awaitable, Callable, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from src.db.connection import async_session
 from src.models.cave import Cave
 from src.utils.cave_operations import delete_cave_by_id
+from src.utils.data_version import bump_data_version
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
 logger = logging.getLogger(__name__)
@@ -20,13 +22,19 @@ SERVICE_TOKEN = os.getenv("SERVICE_TOKEN", "dev-service-token-123")
 class CaveDeletionHandler:
     """Handles cave ownership management when users are deleted"""
 
-    async def handle_user_deletion(self, user_email: str, user_id: str = None) -> None:
+    async def handle_user_deletion(
+        self,
+        user_email: str,
+        user_id: str = None,
+        on_progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+    ) -> None:
         """
         Handle user deletion by managing cave ownership inheritance.
 
         Args:
             user_email: Email of the deleted user
             user_id: User ID of the deleted user (optional)
+            on_progress: Awaited with (handled, total) after every cave
         """
         logger.info(f"Processing user deletion for {user_email}")
         
@@ -43,8 +51,10 @@ class CaveDeletionHandler:
             
             logger.info(f"Found {len(caves)} caves owned by {user_email}")
             
-            for cave in caves:
+            for handled, cave in enumerate(caves, start=1):
                 await self._handle_cave_inheritance(session, cave, user_email)
+                if on_progress is not None:
+                    await on_progress(handled, len(caves))
     
     async def _handle_cave_inheritance(self, session: AsyncSession, cave: Cave, user_email: str) -> None:
         """
@@ -75,6 +85,7 @@ class CaveDeletionHandler:
                 # Transfer ownership to the inherited user
                 cave.owner_email = inherit_email
                 await session.commit()
+                await bump_data_version()
                 logger.info(f"Transferred cave {cave_id} ownership to {inherit_email}")
 
             elif action == "delete":
@@ -1,12 +1,37 @@
 import logging
+import os
+from typing import Any, Awaitable, Callable, Optional
+import httpx
+from sqlalchemy import delete, func
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from src.config.settings import settings
 from src.models.cave import Cave, CaveMedia
 from src.utils.rabbitmq_publisher import publisher
+from src.utils.data_version import bump_data_version
 
 logger = logging.getLogger(__name__)
 
+# Group service URL for removing cave assignments
+GROUP_SERVICE_URL = os.getenv("GROUP_SERVICE_URL", "http://group-service.default.svc.cluster.local")
 
+# Service token for internal service-to-service communication
+SERVICE_TOKEN = os.getenv("SERVICE_TOKEN", "dev-service-token-123")
+
+
+async def media_only_in_cave(session: AsyncSession, cave_id: int) -> list[int]:
+    """
+    Media files of a cave that no other cave links to.
+
+    A photo can belong to several caves, e.g. the cave it was uploaded to
+    and the one nearest its GPS position; it is only deleted with the last.
+    """
+    other_links = select(CaveMedia.media_file_id).where(CaveMedia.cave_id != cave_id)
+    result = await session.execute(
+        select(CaveMedia.media_file_id)
+        .where(CaveMedia.cave_id == cave_id, CaveMedia.media_file_id.not_in(other_links))
+    )
+    return list(result.scalars().all())
 
 
 async def delete_cave_by_id(session: AsyncSession, cave_id: int) -> bool:
@@ -33,18 +58,14 @@ async def delete_cave_by_id(session: AsyncSession, cave_id: int) -> bool:
     cave_name = cave.name
     owner_email = cave.owner_email
 
-    # Collect media file IDs before deleting the cave
-    media_file_ids = []
-    media_result = await session.execute(
-        select(CaveMedia.media_file_id).where(CaveMedia.cave_id == cave_id)
-    )
-    for row in media_result:
-        media_file_ids.append(row[0])
+    # Collect the media files to delete before the cave's links are cascade deleted
+    media_file_ids = await media_only_in_cave(session, cave_id)
 
     try:
         # Delete the cave (entrances and media associations will be cascade deleted)
         await session.delete(cave)
         await session.commit()
+        await bump_data_version()
 
         logger.info(f"Successfully deleted cave {cave_id} ({cave_name}) from database")
 
@@ -63,9 +84,51 @@ async def delete_cave_by_id(session: AsyncSession, cave_id: int) -> bool:
         await session.rollback()
         return False
 
-        return True
 
+async def delete_all_caves(
+    session: AsyncSession,
+    on_progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+) -> dict[str, Any]:
+    """
+    Delete all caves and their entrances, and all group cave assignments.
+
+    Caves are deleted settings.bulk_chunk_size at a time, each chunk in its
+    own transaction. FOR TESTING ONLY.
+
+    Args:
+        session: Database session
+        on_progress: Awaited with (deleted, total) after every chunk
+    """
+    deleted_assignments = 0
+    try:
+        async with httpx.AsyncClient() as client:
+            response = await client.delete(
+                f"{GROUP_SERVICE_URL}/groups/caves/assignments",
+                headers={"X-Service-Token": SERVICE_TOKEN}
+            )
+
+            if response.status_code not in (200, 204):
+                # log but don't fail the whole delete
+                logger.warning(
+                    "Failed to delete group assignments: %s",
+                    response.status_code,
+                )
+            deleted_assignments = response.json().get("deleted_assignments", 0)
     except Exception as e:
-        logger.error(f"Error deleting cave {cave_id}: {e}")
-        await session.rollback()
-        return False
+        logger.warning(f"Error deleting group assignments: {e}")
+
+    total = await session.scalar(select(func.count()).select_from(Cave))
+    deleted = 0
+    while True:
+        result = await session.execute(select(Cave.cave_id).order_by(Cave.cave_id).limit(settings.bulk_chunk_size))
+        cave_ids = result.scalars().all()
+        if not cave_ids:
+            break
+        result = await session.execute(delete(Cave).where(Cave.cave_id.in_(cave_ids)))
+        await session.commit()
+        await bump_data_version()
+        deleted += result.rowcount
+        if on_progress is not None:
+            await on_progress(deleted, total)
+
+    return {"deleted_caves": deleted, "deleted_assignments": deleted_assignments}
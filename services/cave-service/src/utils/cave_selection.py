@@ -0,0 +1,82 @@
+from typing import Optional
+from fastapi import HTTPException, status
+from src.schemas.cave import CaveRead
+
+# Expandable parts of a cave, mapped to the CaveRead field that holds them
+INCLUDE_FIELDS = {
+    "entrances": "entrances",
+    "media": "media_files",
+    "groups": "groups",
+}
+
+CAVE_FIELDS = set(CaveRead.model_fields)
+
+
+def _split(value: Optional[str]) -> Optional[set[str]]:
+    """Split a comma-separated query parameter into a set of names."""
+    if value is None:
+        return None
+    return {part.strip() for part in value.split(",") if part.strip()}
+
+
+class CaveSelection:
+    """
+    The parts of a cave representation requested through the `fields` and
+    `include` query parameters.
+
+    `include` decides which related data is loaded (and therefore which
+    queries and downstream service calls are made); `fields` trims the
+    returned object. A relation named in `fields` is included implicitly.
+    """
+
+    def __init__(self, fields: Optional[str], include: Optional[str], default_include: set[str]):
+        requested_fields = _split(fields)
+        requested_include = _split(include)
+
+        if requested_fields is not None:
+            unknown = requested_fields - CAVE_FIELDS
+            if unknown:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Unknown fields: {', '.join(sorted(unknown))}"
+                )
+        if requested_include is not None:
+            unknown = requested_include - INCLUDE_FIELDS.keys()
+            if unknown:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Unknown include values: {', '.join(sorted(unknown))}"
+                )
+
+        if requested_include is None:
+            if requested_fields is None:
+                requested_include = set(default_include)
+            else:
+                requested_include = {
+                    name for name, field in INCLUDE_FIELDS.items() if field in requested_fields
+                }
+        elif requested_fields is not None:
+            requested_include |= {
+                name for name, field in INCLUDE_FIELDS.items() if field in requested_fields
+            }
+
+        if requested_fields is not None:
+            requested_fields |= {INCLUDE_FIELDS[name] for name in requested_include}
+
+        self.fields = requested_fields
+        self.include = requested_include
+        self.is_default = fields is None and include is None
+
+    def includes(self, name: str) -> bool:
+        """Check whether a related part ('entrances', 'media', 'groups') is requested."""
+        return name in self.include
+
+    def wants(self, field: str) -> bool:
+        """Check whether a CaveRead field is part of the response."""
+        if field in INCLUDE_FIELDS.values():
+            return field in {INCLUDE_FIELDS[name] for name in self.include}
+        return self.fields is None or field in self.fields
+
+    def apply(self, cave_dict: dict) -> dict:
+        """Trim a cave dict down to the requested fields."""
+        return {key: value for key, value in cave_dict.items() if self.wants(key)}
@@ -0,0 +1,189 @@
+"""
+Cave centerlines at several levels of detail.
+
+The survey network's traverses (station chains between junctions) are the
+centerline polylines. Each level keeps the points that Douglas-Peucker
+simplification with the level's tolerance retains in plan view. Every
+traverse is simplified in the same vectorized pass: all polylines are
+concatenated, and each iteration splits every segment whose farthest point
+is beyond the tolerance at once, so the number of NumPy passes grows with
+the recursion depth rather than with the number of points or traverses.
+
+Levels are stored in metres relative to an anchor station, the first
+entrance marked in the survey or else its first station, and placed on the
+map through the cave's first entrance when served. Moving the entrance
+therefore needs no regeneration.
+"""
+import json
+import math
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from src.utils.survey_network import SurveyNetwork, process_survey
+
+# Douglas-Peucker tolerance in metres for each level of detail; level 0 keeps every station
+LEVEL_TOLERANCES = (0.0, 0.5, 2.0, 8.0, 32.0)
+
+# Web Mercator ground resolution at zoom 0 on the equator, metres per 256 px tile pixel
+ZOOM0_RESOLUTION = 156543.03392
+
+WGS84_A = 6378137.0
+WGS84_E2 = 0.00669437999014
+
+
+@dataclass
+class CenterlineLevel:
+    """One level of detail: polylines of (east, north, up) metres relative to the anchor station."""
+    level: int
+    tolerance: float
+    lines: list[list[list[float]]]
+    point_count: int
+
+
+def douglas_peucker(points: np.ndarray, fixed: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Simplify concatenated polylines.
+
+    Args:
+        points: (n, 2) plan coordinates of all polylines back to back
+        fixed: (n,) points that must be kept, at least the ends of every polyline
+        tolerance: Largest allowed distance of a dropped point from the simplified line
+
+    Returns:
+        np.ndarray: Mask of the points to keep
+    """
+    n = len(points)
+    keep = fixed.copy()
+    if tolerance <= 0 or n <= 2:
+        keep[:] = True
+        return keep
+
+    index = np.arange(n)
+    while True:
+        # Kept neighbours on either side of every point define its segment
+        previous = np.maximum.accumulate(np.where(keep, index, 0))
+        following = np.minimum.accumulate(np.where(keep, index, n - 1)[::-1])[::-1]
+
+        a, b = points[previous], points[following]
+        segment = b - a
+        length2 = np.einsum("ij,ij->i", segment, segment)
+        t = np.divide(np.einsum("ij,ij->i", points - a, segment), length2, out=np.zeros(n), where=length2 > 0)
+        offset = points - (a + np.clip(t, 0.0, 1.0)[:, None] * segment)
+        distance = np.einsum("ij,ij->i", offset, offset)
+        distance[keep] = -1.0
+
+        # Farthest point of every segment: sort by segment, then by descending distance
+        order = np.lexsort((-distance, previous))
+        first = np.ones(n, dtype=bool)
+        first[1:] = previous[order][1:] != previous[order][:-1]
+        farthest = order[first]
+        farthest = farthest[distance[farthest] > tolerance * tolerance]
+        if not len(farthest):
+            return keep
+        keep[farthest] = True
+
+
+def anchor_station(network: SurveyNetwork) -> int:
+    """Station placed at the cave's first entrance."""
+    return int(network.entrances[0]) if network.entrances.size else 0
+
+
+def build_centerline_levels(network: SurveyNetwork) -> list[CenterlineLevel]:
+    """Simplify the network's traverses for every level of detail."""
+    paths = [path for path in network.traverses if len(path) >= 2]
+    if not paths:
+        return []
+    stations = np.concatenate(paths)
+    local = network.positions[stations] - network.positions[anchor_station(network)]
+    local = np.round(local, 2)
+
+    ends = np.cumsum([len(path) for path in paths])
+    fixed = np.zeros(len(stations), dtype=bool)
+    fixed[ends - 1] = True
+    fixed[np.concatenate([[0], ends[:-1]])] = True
+    line_id = np.repeat(np.arange(len(paths)), [len(path) for path in paths])
+
+    levels = []
+    for level, tolerance in enumerate(LEVEL_TOLERANCES):
+        keep = douglas_peucker(local[:, :2], fixed, tolerance)
+        split = np.cumsum(np.bincount(line_id[keep], minlength=len(paths)))[:-1]
+        lines = [line.tolist() for line in np.split(local[keep], split)]
+        levels.append(CenterlineLevel(level=level, tolerance=tolerance, lines=lines, point_count=int(keep.sum())))
+    return levels
+
+
+def process_survey_centerline(
+    content: bytes, survey_format: str, simplify: bool = True
+) -> tuple[SurveyNetwork, Optional[list[CenterlineLevel]]]:
+    """
+    Solve a survey and, if requested, build its centerline levels.
+
+    Runs in a worker process for large files, like process_survey.
+    """
+    network = process_survey(content, survey_format)
+    return network, build_centerline_levels(network) if simplify else None
+
+
+def level_for_zoom(tolerances: dict[int, float], zoom: float, latitude: float) -> int:
+    """
+    Pick the coarsest stored level whose tolerance stays within one
+    screen pixel at the given map zoom.
+    """
+    resolution = ZOOM0_RESOLUTION * math.cos(math.radians(latitude)) / 2 ** zoom
+    suitable = [level for level, tolerance in tolerances.items() if tolerance <= resolution]
+    if not suitable:
+        return min(tolerances)
+    return max(suitable, key=lambda level: tolerances[level])
+
+
+def centerline_geojson(
+    cave_id: int,
+    level: CenterlineLevel,
+    latitude: float,
+    longitude: float,
+    altitude: Optional[float],
+) -> bytes:
+    """
+    Render a level as a GeoJSON FeatureCollection placed at an entrance.
+
+    Local metres are converted with the WGS84 radii of curvature at the
+    entrance, which is accurate to centimetres over the extent of a cave.
+    Heights are absolute when the entrance altitude is known and relative
+    to the entrance otherwise.
+    """
+    if level.lines:
+        local = np.concatenate([np.asarray(line, dtype=np.float64) for line in level.lines])
+    else:
+        local = np.zeros((0, 3))
+
+    phi = math.radians(latitude)
+    w = 1.0 - WGS84_E2 * math.sin(phi) ** 2
+    meridian_radius = WGS84_A * (1.0 - WGS84_E2) / w ** 1.5
+    normal_radius = WGS84_A / math.sqrt(w)
+
+    coordinates = np.empty_like(local)
+    coordinates[:, 0] = np.round(longitude + np.degrees(local[:, 0] / (normal_radius * math.cos(phi))), 7)
+    coordinates[:, 1] = np.round(latitude + np.degrees(local[:, 1] / meridian_radius), 7)
+    coordinates[:, 2] = np.round(local[:, 2] + (altitude or 0.0), 2)
+    split = np.cumsum([len(line) for line in level.lines])[:-1]
+
+    collection = {
+        "type": "FeatureCollection",
+        "features": [{
+            "type": "Feature",
+            "geometry": {
+                "type": "MultiLineString",
+                "coordinates": [part.tolist() for part in np.split(coordinates, split)] if level.lines else [],
+            },
+            "properties": {
+                "cave_id": cave_id,
+                "level": level.level,
+                "tolerance": level.tolerance,
+                "points": level.point_count,
+                "relative_altitude": altitude is None,
+            },
+        }],
+    }
+    return json.dumps(collection, separators=(",", ":")).encode()
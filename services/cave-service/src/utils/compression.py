@@ -0,0 +1,249 @@
+"""
+Response compression with Accept-Encoding negotiation.
+
+CompressionMiddleware compresses response bodies with brotli or gzip,
+whichever the client prefers and the service supports. Only text, JSON and
+XML bodies are compressed; other media types, small bodies, partial
+content, responses that already carry a Content-Encoding (e.g.
+pre-compressed cached bodies) and responses that offer byte ranges (e.g.
+stored files) are passed through untouched. Range offsets and strong ETags
+refer to the unencoded bytes, so encoding such a response would break
+resuming it with Range and If-Range. Streaming responses are compressed
+chunk by chunk with a flush after every chunk, so incremental delivery is
+preserved. Bodies and chunks of THREADPOOL_MIN_SIZE bytes or more are
+compressed in the threadpool instead of on the event loop.
+
+This module is kept identical in cave-service, group-service and
+media-service, which are built and deployed separately; change all copies
+together.
+"""
+import gzip
+import logging
+import zlib
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; fall back to gzip only
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Bodies smaller than this are not worth compressing
+MINIMUM_SIZE = 500
+
+# Bodies and streamed chunks at least this large are compressed off the event loop
+THREADPOOL_MIN_SIZE = 64 * 1024
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Media types worth compressing; everything else, e.g. images, archives and
+# application/octet-stream, is sent as is
+COMPRESSIBLE_MEDIA_PREFIXES = ("text/",)
+COMPRESSIBLE_MEDIA_SUFFIXES = ("+json", "+xml")
+COMPRESSIBLE_MEDIA_TYPES = {
+    "application/json",
+    "application/x-ndjson",
+    "application/xml",
+    "application/javascript",
+}
+
+
+def supported_encodings() -> list[str]:
+    """Get the encodings this service can produce, in order of preference."""
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def select_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Pick the best supported encoding from an Accept-Encoding header.
+
+    Returns None when the client accepts none of the supported encodings.
+    """
+    if not accept_encoding:
+        return None
+
+    qualities: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        qualities[token] = q
+
+    best, best_q = None, 0.0
+    for encoding in supported_encodings():
+        q = qualities.get(encoding, qualities.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def is_compressible(media_type: Optional[str]) -> bool:
+    """Check whether a media type is worth compressing."""
+    if not media_type:
+        return False
+    media_type = media_type.split(";")[0].strip().lower()
+    return (
+        media_type in COMPRESSIBLE_MEDIA_TYPES
+        or media_type.startswith(COMPRESSIBLE_MEDIA_PREFIXES)
+        or media_type.endswith(COMPRESSIBLE_MEDIA_SUFFIXES)
+    )
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """Compress a complete body with the given encoding."""
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+class _StreamCompressor:
+    """Incremental compressor that flushes after every chunk."""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, chunk: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(chunk) + self._compressor.flush()
+        return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def _add_vary(headers: list) -> list:
+    """Add Accept-Encoding to the Vary header of a raw ASGI header list."""
+    for i, (name, value) in enumerate(headers):
+        if name.lower() == b"vary":
+            if b"accept-encoding" not in value.lower():
+                headers[i] = (name, value + b", Accept-Encoding")
+            return headers
+    headers.append((b"vary", b"Accept-Encoding"))
+    return headers
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing responses according to Accept-Encoding."""
+
+    def __init__(self, app, minimum_size: int = MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = None
+        for name, value in scope.get("headers", []):
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+
+        encoding = select_encoding(accept_encoding)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(send, encoding, self.minimum_size)
+        await self.app(scope, receive, responder)
+
+
+class _CompressionResponder:
+    """Wraps the ASGI send callable and compresses the body on the way out."""
+
+    def __init__(self, send, encoding: str, minimum_size: int):
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start_message = None
+        self.passthrough = False
+        self.compressor: Optional[_StreamCompressor] = None
+
+    def _should_skip(self) -> bool:
+        """Decide from the response start whether compression applies at all."""
+        if self.start_message["status"] in (204, 206, 304):
+            return True
+        headers = {name.lower(): value for name, value in self.start_message["headers"]}
+        if b"content-encoding" in headers or b"content-range" in headers:
+            return True
+        if headers.get(b"accept-ranges", b"none").lower() != b"none":
+            return True
+        content_type = headers.get(b"content-type", b"").decode("latin-1")
+        return not is_compressible(content_type)
+
+    async def __call__(self, message):
+        message_type = message["type"]
+
+        if message_type == "http.response.start":
+            self.start_message = message
+            self.start_message["headers"] = list(message.get("headers", []))
+            self.passthrough = self._should_skip()
+            if self.passthrough:
+                await self.send(message)
+            return
+
+        if message_type != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.compressor is None:
+            headers = [
+                (name, value) for name, value in self.start_message["headers"]
+                if name.lower() != b"content-length"
+            ]
+
+            if not more_body:
+                # Complete body in a single message
+                if len(body) < self.minimum_size:
+                    self.passthrough = True
+                    await self.send(self.start_message)
+                    await self.send(message)
+                    return
+                if len(body) >= THREADPOOL_MIN_SIZE:
+                    body = await run_in_threadpool(compress, body, self.encoding)
+                else:
+                    body = compress(body, self.encoding)
+                headers.append((b"content-encoding", self.encoding.encode()))
+                headers.append((b"content-length", str(len(body)).encode()))
+                self.start_message["headers"] = _add_vary(headers)
+                await self.send(self.start_message)
+                await self.send({"type": "http.response.body", "body": body, "more_body": False})
+                return
+
+            # Streaming body: compress incrementally
+            self.compressor = _StreamCompressor(self.encoding)
+            headers.append((b"content-encoding", self.encoding.encode()))
+            self.start_message["headers"] = _add_vary(headers)
+            await self.send(self.start_message)
+
+        if len(body) >= THREADPOOL_MIN_SIZE:
+            data = await run_in_threadpool(self.compressor.compress, body)
+        else:
+            data = self.compressor.compress(body) if body else b""
+        if not more_body:
+            data += self.compressor.finish()
+        await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
@@ -0,0 +1,243 @@
+"""
+Coordinate reference system conversion for entrance coordinates.
+
+Entrances are stored as WGS84 latitude/longitude. Imports and exports can
+use one of the projected systems found in historical cave registers
+instead. All transforms work on whole NumPy arrays:
+
+- Transverse Mercator with the 6th order Krüger series, accurate to well
+  below a millimetre within a zone, and an iterative inverse latitude.
+- Datum shifts with a 7-parameter Helmert transform through geocentric
+  coordinates (position vector convention).
+
+Projected coordinates are (easting, northing) in metres and are mapped to
+the entrance fields as gps_e = easting and gps_n = northing.
+"""
+import math
+from dataclasses import dataclass
+from typing import Any, Optional, Sequence
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class Ellipsoid:
+    a: float
+    inverse_flattening: float
+
+    @property
+    def f(self) -> float:
+        return 1.0 / self.inverse_flattening
+
+    @property
+    def e2(self) -> float:
+        return self.f * (2.0 - self.f)
+
+
+WGS84 = Ellipsoid(6378137.0, 298.257223563)
+BESSEL_1841 = Ellipsoid(6377397.155, 299.1528128)
+
+
+@dataclass(frozen=True)
+class TransverseMercator:
+    ellipsoid: Ellipsoid
+    central_meridian: float
+    scale: float
+    false_easting: float
+    false_northing: float = 0.0
+
+    def _series(self) -> tuple[float, list[float], list[float]]:
+        n = self.ellipsoid.f / (2.0 - self.ellipsoid.f)
+        n2, n3, n4, n5, n6 = n ** 2, n ** 3, n ** 4, n ** 5, n ** 6
+        rectifying_radius = self.ellipsoid.a / (1.0 + n) * (1.0 + n2 / 4.0 + n4 / 64.0 + n6 / 256.0)
+        alpha = [
+            n / 2 - 2 / 3 * n2 + 5 / 16 * n3 + 41 / 180 * n4 - 127 / 288 * n5 + 7891 / 37800 * n6,
+            13 / 48 * n2 - 3 / 5 * n3 + 557 / 1440 * n4 + 281 / 630 * n5 - 1983433 / 1935360 * n6,
+            61 / 240 * n3 - 103 / 140 * n4 + 15061 / 26880 * n5 + 167603 / 181440 * n6,
+            49561 / 161280 * n4 - 179 / 168 * n5 + 6601661 / 7257600 * n6,
+            34729 / 80640 * n5 - 3418889 / 1995840 * n6,
+            212378941 / 319334400 * n6,
+        ]
+        beta = [
+            n / 2 - 2 / 3 * n2 + 37 / 96 * n3 - 1 / 360 * n4 - 81 / 512 * n5 + 96199 / 604800 * n6,
+            1 / 48 * n2 + 1 / 15 * n3 - 437 / 1440 * n4 + 46 / 105 * n5 - 1118711 / 3870720 * n6,
+            17 / 480 * n3 - 37 / 840 * n4 - 209 / 4480 * n5 + 5569 / 90720 * n6,
+            4397 / 161280 * n4 - 11 / 504 * n5 - 830251 / 7257600 * n6,
+            4583 / 161280 * n5 - 108847 / 3991680 * n6,
+            20648693 / 638668800 * n6,
+        ]
+        return rectifying_radius, alpha, beta
+
+    def forward(self, lon: np.ndarray, lat: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Geographic degrees to (easting, northing)."""
+        radius, alpha, _ = self._series()
+        e = math.sqrt(self.ellipsoid.e2)
+        phi = np.radians(lat)
+        dlon = np.radians(lon - self.central_meridian)
+
+        sin_phi = np.sin(phi)
+        t = np.sinh(np.arctanh(sin_phi) - e * np.arctanh(e * sin_phi))
+        xi_prime = np.arctan2(t, np.cos(dlon))
+        eta_prime = np.arctanh(np.sin(dlon) / np.sqrt(1.0 + t * t))
+
+        xi, eta = xi_prime.copy(), eta_prime.copy()
+        for j, coefficient in enumerate(alpha, start=1):
+            xi += coefficient * np.sin(2 * j * xi_prime) * np.cosh(2 * j * eta_prime)
+            eta += coefficient * np.cos(2 * j * xi_prime) * np.sinh(2 * j * eta_prime)
+
+        easting = self.false_easting + self.scale * radius * eta
+        northing = self.false_northing + self.scale * radius * xi
+        return easting, northing
+
+    def inverse(self, easting: np.ndarray, northing: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """(easting, northing) to geographic degrees."""
+        radius, _, beta = self._series()
+        e2 = self.ellipsoid.e2
+        e = math.sqrt(e2)
+        xi = (np.asarray(northing, dtype=np.float64) - self.false_northing) / (self.scale * radius)
+        eta = (np.asarray(easting, dtype=np.float64) - self.false_easting) / (self.scale * radius)
+
+        xi_prime, eta_prime = xi.copy(), eta.copy()
+        for j, coefficient in enumerate(beta, start=1):
+            xi_prime -= coefficient * np.sin(2 * j * xi) * np.cosh(2 * j * eta)
+            eta_prime -= coefficient * np.cos(2 * j * xi) * np.sinh(2 * j * eta)
+
+        tau_prime = np.sin(xi_prime) / np.sqrt(np.sinh(eta_prime) ** 2 + np.cos(xi_prime) ** 2)
+        dlon = np.arctan2(np.sinh(eta_prime), np.cos(xi_prime))
+
+        # Newton iteration for tan(latitude) from the conformal latitude
+        tau = tau_prime.copy()
+        for _ in range(4):
+            sigma = np.sinh(e * np.arctanh(e * tau / np.sqrt(1.0 + tau * tau)))
+            tau_i = tau * np.sqrt(1.0 + sigma * sigma) - sigma * np.sqrt(1.0 + tau * tau)
+            tau += (tau_prime - tau_i) / np.sqrt(1.0 + tau_i * tau_i) * (
+                (1.0 + (1.0 - e2) * tau * tau) / ((1.0 - e2) * np.sqrt(1.0 + tau * tau))
+            )
+
+        return self.central_meridian + np.degrees(dlon), np.degrees(np.arctan(tau))
+
+
+@dataclass(frozen=True)
+class CoordinateSystem:
+    code: int
+    name: str
+    ellipsoid: Ellipsoid
+    projection: Optional[TransverseMercator] = None
+    # tx, ty, tz (m), rx, ry, rz (arc seconds), scale (ppm) to WGS84; None for WGS84 based systems
+    to_wgs84_params: Optional[tuple[float, ...]] = None
+
+    @property
+    def is_wgs84(self) -> bool:
+        return self.projection is None and self.to_wgs84_params is None
+
+    def to_wgs84(self, x: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Coordinates in this system to WGS84 (longitude, latitude)."""
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        lon, lat = self.projection.inverse(x, y) if self.projection else (x, y)
+        if self.to_wgs84_params is not None:
+            lon, lat = _shift_datum(lon, lat, self.ellipsoid, WGS84, self.to_wgs84_params)
+        return lon, lat
+
+    def from_wgs84(self, lon: np.ndarray, lat: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """WGS84 (longitude, latitude) to coordinates in this system."""
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        if self.to_wgs84_params is not None:
+            inverse_params = tuple(-p for p in self.to_wgs84_params)
+            lon, lat = _shift_datum(lon, lat, WGS84, self.ellipsoid, inverse_params)
+        return self.projection.forward(lon, lat) if self.projection else (lon, lat)
+
+
+# Three-parameter MGI 1901 to WGS 84 shift for the former Yugoslavia, accurate to a few metres
+MGI_1901_TO_WGS84 = (682.0, -203.0, 480.0, 0.0, 0.0, 0.0, 0.0)
+
+SUPPORTED_CRS: dict[int, CoordinateSystem] = {
+    4326: CoordinateSystem(4326, "WGS 84", WGS84),
+    32633: CoordinateSystem(32633, "WGS 84 / UTM zone 33N", WGS84, TransverseMercator(WGS84, 15.0, 0.9996, 500000.0)),
+    32634: CoordinateSystem(32634, "WGS 84 / UTM zone 34N", WGS84, TransverseMercator(WGS84, 21.0, 0.9996, 500000.0)),
+    31275: CoordinateSystem(
+        31275, "MGI / Balkans zone 5", BESSEL_1841,
+        TransverseMercator(BESSEL_1841, 15.0, 0.9999, 5500000.0), MGI_1901_TO_WGS84,
+    ),
+    31276: CoordinateSystem(
+        31276, "MGI / Balkans zone 6", BESSEL_1841,
+        TransverseMercator(BESSEL_1841, 18.0, 0.9999, 6500000.0), MGI_1901_TO_WGS84,
+    ),
+    31277: CoordinateSystem(
+        31277, "MGI / Balkans zone 7", BESSEL_1841,
+        TransverseMercator(BESSEL_1841, 21.0, 0.9999, 7500000.0), MGI_1901_TO_WGS84,
+    ),
+}
+
+CRS_DESCRIPTION = (
+    "Coordinate reference system of gps_e/gps_n as an EPSG code, e.g. EPSG:32634 "
+    f"(supported: {', '.join(str(code) for code in SUPPORTED_CRS)}; default: WGS 84)"
+)
+
+
+def get_crs(value: Optional[str]) -> CoordinateSystem:
+    """
+    Look up a supported system by EPSG code ("EPSG:32634" or "32634").
+
+    Raises:
+        ValueError: If the code is malformed or not supported
+    """
+    if value is None:
+        return SUPPORTED_CRS[4326]
+    code = value.strip().upper().removeprefix("EPSG:")
+    if not code.isdigit() or int(code) not in SUPPORTED_CRS:
+        supported = ", ".join(f"EPSG:{code}" for code in SUPPORTED_CRS)
+        raise ValueError(f"Unsupported CRS '{value}'. Supported: {supported}")
+    return SUPPORTED_CRS[int(code)]
+
+
+def _shift_datum(
+    lon: np.ndarray, lat: np.ndarray, source: Ellipsoid, target: Ellipsoid, params: tuple[float, ...]
+) -> tuple[np.ndarray, np.ndarray]:
+    """Helmert transform of ellipsoidal coordinates at zero height."""
+    tx, ty, tz, rx, ry, rz, ppm = params
+    phi, lam = np.radians(lat), np.radians(lon)
+
+    # Geodetic to geocentric on the source ellipsoid
+    sin_phi = np.sin(phi)
+    nu = source.a / np.sqrt(1.0 - source.e2 * sin_phi ** 2)
+    x = nu * np.cos(phi) * np.cos(lam)
+    y = nu * np.cos(phi) * np.sin(lam)
+    z = nu * (1.0 - source.e2) * sin_phi
+
+    rx, ry, rz = (math.radians(r / 3600.0) for r in (rx, ry, rz))
+    s = 1.0 + ppm * 1e-6
+    x, y, z = (
+        tx + s * (x - rz * y + ry * z),
+        ty + s * (rz * x + y - rx * z),
+        tz + s * (-ry * x + rx * y + z),
+    )
+
+    # Geocentric to geodetic on the target ellipsoid
+    p = np.hypot(x, y)
+    lam = np.arctan2(y, x)
+    phi = np.arctan2(z, p * (1.0 - target.e2))
+    for _ in range(4):
+        nu = target.a / np.sqrt(1.0 - target.e2 * np.sin(phi) ** 2)
+        height = p / np.cos(phi) - nu
+        phi = np.arctan2(z, p * (1.0 - target.e2 * nu / (nu + height)))
+    return np.degrees(lam), np.degrees(phi)
+
+
+def entrances_to_wgs84(entrances: Sequence[Any], crs: CoordinateSystem) -> None:
+    """Convert the gps_e/gps_n attributes of entrance-like objects in place."""
+    if crs.is_wgs84 or not entrances:
+        return
+    lon, lat = crs.to_wgs84([e.gps_e for e in entrances], [e.gps_n for e in entrances])
+    for entrance, e, n in zip(entrances, np.round(lon, 7).tolist(), np.round(lat, 7).tolist()):
+        entrance.gps_e, entrance.gps_n = e, n
+
+
+def entrance_dicts_from_wgs84(entrances: Sequence[dict], crs: CoordinateSystem) -> None:
+    """Convert the gps_e/gps_n values of entrance dicts in place."""
+    if crs.is_wgs84 or not entrances:
+        return
+    x, y = crs.from_wgs84([e["gps_e"] for e in entrances], [e["gps_n"] for e in entrances])
+    for entrance, e, n in zip(entrances, np.round(x, 3).tolist(), np.round(y, 3).tolist()):
+        entrance["gps_e"], entrance["gps_n"] = e, n
@@ -0,0 +1,66 @@
+import logging
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.dialects.postgresql import insert
+from src.db.connection import async_session
+from src.models.cave import CatalogueVersion
+from tenacity import before_sleep_log, retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+
+logger = logging.getLogger(__name__)
+
+# The catalogue version lives in a single row
+CATALOGUE_VERSION_ID = 1
+
+
+async def get_data_version(session: AsyncSession) -> int:
+    """
+    Get the current catalogue data version.
+
+    The version changes whenever caves or entrances are written, so it can be
+    used to key cached responses that are derived from the catalogue.
+    """
+    version = await session.scalar(
+        select(CatalogueVersion.version).where(CatalogueVersion.id == CATALOGUE_VERSION_ID)
+    )
+    return version or 0
+
+
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=0.5, min=0.5, max=5),
+    retry=retry_if_exception_type((DBAPIError, OSError)),
+    before_sleep=before_sleep_log(logger, logging.WARNING),
+    reraise=True,
+)
+async def _increment_data_version() -> None:
+    stmt = insert(CatalogueVersion).values(id=CATALOGUE_VERSION_ID, version=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[CatalogueVersion.id],
+        set_={"version": CatalogueVersion.version + 1},
+    )
+    async with async_session() as session:
+        await session.execute(stmt)
+        await session.commit()
+
+
+async def bump_data_version() -> None:
+    """
+    Increment the catalogue data version in its own short transaction.
+
+    Call it after committing the change it describes. The version row is
+    locked only for this one statement, so concurrent writes do not queue
+    on it for the length of their transactions. Readers get the version
+    before the data it keys, so one that sees the new version also sees the
+    change; one that reads between the commit and the bump at worst caches
+    the new data under the old version, which is replaced by the bump.
+
+    The bump is retried and never raises, since the change is already
+    committed; a bump that still fails is logged. The service also bumps
+    the version at startup, which publishes a change whose bump was lost
+    with the process.
+    """
+    try:
+        await _increment_data_version()
+    except Exception as e:
+        logger.error(f"Failed to bump the catalogue data version, cached responses may be stale until the next write: {e}")
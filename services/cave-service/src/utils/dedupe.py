@@ -0,0 +1,144 @@
+"""
+Spatial duplicate detection for entrances.
+
+Points are binned into a uniform grid whose cells are at least the search
+radius wide, so any two points within the radius lie in the same or in
+adjacent cells. After sorting the points by cell, the candidates in each
+neighbouring cell are found with one searchsorted call per cell offset;
+only half of the eight neighbours are visited so every unordered pair is
+produced once. The work is proportional to the number of points plus the
+number of close pairs instead of all n² pairs.
+
+Candidate pairs are filtered with vectorized haversine distances, then by
+fuzzy name similarity (difflib ratio on normalized names), which is only
+computed for the few pairs that are close enough.
+"""
+import math
+import re
+import unicodedata
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+from typing import Literal, Optional
+
+import numpy as np
+
+from src.utils.distance import EARTH_RADIUS_M, haversine_m
+
+DedupeMode = Literal["flag", "merge"]
+
+# Cell offsets covering each unordered pair of neighbouring cells once
+_HALF_NEIGHBOURHOOD = ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1))
+_CELL_KEY_SHIFT = 1 << 32
+
+_NON_ALPHANUMERIC = re.compile(r"[^0-9a-z]+")
+
+
+@dataclass
+class DuplicatePair:
+    first: int
+    second: int
+    distance_m: float
+    similarity: float
+
+
+def normalize_name(name: Optional[str]) -> str:
+    """Casefold, strip accents and punctuation so 'Jama pod Kalom (vhod)' ~ 'jama pod kalom vhod'."""
+    if not name:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", name.casefold())
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return _NON_ALPHANUMERIC.sub(" ", stripped).strip()
+
+
+def name_similarity(a: str, b: str) -> float:
+    """Similarity of two normalized names between 0 and 1."""
+    if a == b:
+        return 1.0
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def neighbour_pairs(lat: np.ndarray, lon: np.ndarray, radius_m: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Candidate pairs of points that may lie within radius_m of each other.
+
+    Returns:
+        tuple: Index arrays (i, j) of the candidate pairs, each unordered pair once
+    """
+    n = len(lat)
+    if n < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # Equirectangular projection at the mean latitude; widening the cells by
+    # the largest scale error keeps every close pair in neighbouring cells
+    mean_cos = math.cos(math.radians(float(np.mean(lat))))
+    min_cos = max(math.cos(math.radians(float(np.max(np.abs(lat))))), 1e-6)
+    cell = radius_m * max(1.0, mean_cos / min_cos)
+    x = np.radians(lon) * EARTH_RADIUS_M * mean_cos
+    y = np.radians(lat) * EARTH_RADIUS_M
+    cx = np.floor(x / cell).astype(np.int64)
+    cy = np.floor(y / cell).astype(np.int64)
+    keys = cx * _CELL_KEY_SHIFT + cy
+
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    firsts, seconds = [], []
+    for dx, dy in _HALF_NEIGHBOURHOOD:
+        target = keys + dx * _CELL_KEY_SHIFT + dy
+        start = np.searchsorted(sorted_keys, target, side="left")
+        counts = np.searchsorted(sorted_keys, target, side="right") - start
+        total = int(counts.sum())
+        if not total:
+            continue
+        i = np.repeat(np.arange(n), counts)
+        # Position of every candidate inside its cell's run of sorted points
+        run_offset = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        j = order[np.repeat(start, counts) + run_offset]
+        if (dx, dy) == (0, 0):
+            keep = i < j
+            i, j = i[keep], j[keep]
+        firsts.append(i)
+        seconds.append(j)
+
+    if not firsts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(firsts), np.concatenate(seconds)
+
+
+def find_duplicate_pairs(
+    lat: np.ndarray,
+    lon: np.ndarray,
+    names: list[str],
+    radius_m: float,
+    min_similarity: float,
+    reference: Optional[np.ndarray] = None,
+) -> list[DuplicatePair]:
+    """
+    Find pairs of points within radius_m whose names are similar enough.
+
+    Args:
+        lat, lon: WGS84 coordinates in degrees
+        names: Names normalized with normalize_name
+        radius_m: Largest distance between duplicates
+        min_similarity: Smallest name similarity between duplicates (0-1)
+        reference: Points that are only compared with non-reference points,
+            e.g. entrances already in the database
+
+    Returns:
+        list[DuplicatePair]: Duplicate pairs with their distance and similarity
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    i, j = neighbour_pairs(lat, lon, radius_m)
+    if reference is not None:
+        keep = ~(reference[i] & reference[j])
+        i, j = i[keep], j[keep]
+
+    distance = haversine_m(lat[i], lon[i], lat[j], lon[j])
+    close = distance <= radius_m
+    pairs = []
+    for a, b, d in zip(i[close].tolist(), j[close].tolist(), distance[close].tolist()):
+        similarity = name_similarity(names[a], names[b])
+        if similarity >= min_similarity:
+            pairs.append(DuplicatePair(min(a, b), max(a, b), d, similarity))
+    return pairs
@@ -0,0 +1,298 @@
+"""
+Digital elevation model sampling from a local GeoTIFF.
+
+The raster is memory-mapped and read one block (tile or strip) at a time.
+Decoded blocks are kept in a small LRU cache, so sampling entrances that
+cluster in a karst area touches only a handful of blocks and the operating
+system pages in only the bytes those blocks occupy.
+
+Supported files are single-band, tiled or stripped, classic or BigTIFF,
+uncompressed or Deflate compressed (optionally with horizontal
+differencing), with integer or floating point samples. The georeferencing
+must be an axis-aligned ModelPixelScale/ModelTiepoint or
+ModelTransformation, which is what GDAL writes for north-up DEMs. The
+coordinate system comes from settings.dem_crs or the file's GeoKeys.
+"""
+import logging
+import math
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from src.config.settings import settings
+from src.utils.crs import SUPPORTED_CRS, CoordinateSystem, get_crs
+
+logger = logging.getLogger(__name__)
+
+# TIFF tags
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+ROWS_PER_STRIP = 278
+STRIP_BYTE_COUNTS = 279
+PREDICTOR = 317
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+SAMPLE_FORMAT = 339
+MODEL_PIXEL_SCALE = 33550
+MODEL_TIEPOINT = 33922
+MODEL_TRANSFORMATION = 34264
+GEO_KEY_DIRECTORY = 34735
+GDAL_NODATA = 42113
+
+# GeoKeys
+GT_RASTER_TYPE = 1025
+GEOGRAPHIC_TYPE = 2048
+PROJECTED_CS_TYPE = 3072
+RASTER_PIXEL_IS_POINT = 2
+
+# TIFF field type -> NumPy type code
+FIELD_TYPES = {1: "u1", 2: "S1", 3: "u2", 4: "u4", 5: "u4", 6: "i1", 7: "u1", 8: "i2", 9: "i4",
+               10: "i4", 11: "f4", 12: "f8", 16: "u8", 17: "i8", 18: "u8"}
+SAMPLE_KINDS = {1: "u", 2: "i", 3: "f"}
+DEFLATE = (8, 32946)
+
+
+class DemError(Exception):
+    """The DEM file cannot be read."""
+
+
+class DemRaster:
+    """Memory-mapped single-band GeoTIFF with bilinear sampling."""
+
+    def __init__(self, path: str, crs: Optional[str] = None, cache_blocks: int = 64):
+        self.path = path
+        self._data = np.memmap(path, dtype=np.uint8, mode="r")
+        self._cache: "OrderedDict[int, np.ndarray]" = OrderedDict()
+        self._cache_blocks = cache_blocks
+        self._lock = threading.Lock()
+
+        tags = self._read_first_ifd()
+        self.width = int(tags[IMAGE_WIDTH][0])
+        self.height = int(tags[IMAGE_LENGTH][0])
+        if int(tags.get(SAMPLES_PER_PIXEL, [1])[0]) != 1:
+            raise DemError("Only single-band DEMs are supported")
+
+        bits = int(tags.get(BITS_PER_SAMPLE, [8])[0])
+        kind = SAMPLE_KINDS.get(int(tags.get(SAMPLE_FORMAT, [1])[0]))
+        if kind is None or bits not in (8, 16, 32, 64):
+            raise DemError(f"Unsupported sample format {kind}{bits}")
+        self.dtype = np.dtype(f"{self._byte_order}{kind}{bits // 8}")
+
+        self.compression = int(tags.get(COMPRESSION, [1])[0])
+        if self.compression != 1 and self.compression not in DEFLATE:
+            raise DemError(f"Unsupported TIFF compression {self.compression}; use none or Deflate")
+        self.predictor = int(tags.get(PREDICTOR, [1])[0])
+        if self.predictor not in (1, 2):
+            raise DemError(f"Unsupported TIFF predictor {self.predictor}")
+
+        if TILE_OFFSETS in tags:
+            self.block_width = int(tags[TILE_WIDTH][0])
+            self.block_height = int(tags[TILE_LENGTH][0])
+            self.block_offsets = tags[TILE_OFFSETS].astype(np.int64)
+            self.block_sizes = tags[TILE_BYTE_COUNTS].astype(np.int64)
+        else:
+            self.block_width = self.width
+            self.block_height = min(int(tags.get(ROWS_PER_STRIP, [self.height])[0]), self.height)
+            self.block_offsets = tags[STRIP_OFFSETS].astype(np.int64)
+            self.block_sizes = tags[STRIP_BYTE_COUNTS].astype(np.int64)
+        self.blocks_across = math.ceil(self.width / self.block_width)
+
+        nodata = tags.get(GDAL_NODATA)
+        self.nodata = float(nodata.tobytes().rstrip(b"\x00").decode()) if nodata is not None else None
+
+        self._read_georeferencing(tags)
+        self.crs = get_crs(crs) if crs else self._crs_from_geokeys(tags)
+
+    # --- TIFF structure ---
+
+    def _read_first_ifd(self) -> dict[int, np.ndarray]:
+        header = bytes(self._data[:16])
+        if header[:2] == b"II":
+            self._byte_order = "<"
+        elif header[:2] == b"MM":
+            self._byte_order = ">"
+        else:
+            raise DemError("Not a TIFF file")
+        magic = int(np.frombuffer(header, f"{self._byte_order}u2", 1, 2)[0])
+        if magic == 42:
+            big, offset = False, int(np.frombuffer(header, f"{self._byte_order}u4", 1, 4)[0])
+        elif magic == 43:
+            big, offset = True, int(np.frombuffer(header, f"{self._byte_order}u8", 1, 8)[0])
+        else:
+            raise DemError("Not a TIFF file")
+
+        count_type, entry_size, value_size = ("u8", 20, 8) if big else ("u2", 12, 4)
+        count = int(self._values(count_type, 1, offset)[0])
+        entries_start = offset + (8 if big else 2)
+
+        tags = {}
+        for i in range(count):
+            entry = entries_start + i * entry_size
+            tag, field_type = (int(v) for v in self._values("u2", 2, entry))
+            n = int(self._values("u8" if big else "u4", 1, entry + 4)[0])
+            type_code = FIELD_TYPES.get(field_type)
+            if type_code is None:
+                continue
+            if field_type in (5, 10):
+                n *= 2  # rationals are pairs of integers
+            value_offset = entry + (12 if big else 8)
+            if np.dtype(type_code).itemsize * n > value_size:
+                value_offset = int(self._values("u8" if big else "u4", 1, value_offset)[0])
+            values = self._values(type_code, n, value_offset)
+            if field_type in (5, 10):
+                values = values[0::2] / values[1::2]
+            tags[tag] = values
+        return tags
+
+    def _values(self, type_code: str, count: int, offset: int) -> np.ndarray:
+        dtype = np.dtype(type_code).newbyteorder(self._byte_order)
+        return np.frombuffer(self._data, dtype=dtype, count=count, offset=offset)
+
+    def _read_georeferencing(self, tags: dict[int, np.ndarray]) -> None:
+        if MODEL_PIXEL_SCALE in tags and MODEL_TIEPOINT in tags:
+            scale_x, scale_y = float(tags[MODEL_PIXEL_SCALE][0]), float(tags[MODEL_PIXEL_SCALE][1])
+            i, j, _, x, y, _ = (float(v) for v in tags[MODEL_TIEPOINT][:6])
+            self.origin_x, self.origin_y = x - i * scale_x, y + j * scale_y
+            self.pixel_width, self.pixel_height = scale_x, scale_y
+        elif MODEL_TRANSFORMATION in tags:
+            m = tags[MODEL_TRANSFORMATION]
+            if m[1] != 0 or m[4] != 0:
+                raise DemError("Rotated DEMs are not supported")
+            self.origin_x, self.origin_y = float(m[3]), float(m[7])
+            self.pixel_width, self.pixel_height = float(m[0]), -float(m[5])
+        else:
+            raise DemError("DEM has no georeferencing")
+
+        # Pixel-is-area rasters are referenced at the pixel corner, pixel-is-point at its centre
+        self.centre_offset = 0.0 if self._geokeys(tags).get(GT_RASTER_TYPE) == RASTER_PIXEL_IS_POINT else 0.5
+
+    @staticmethod
+    def _geokeys(tags: dict[int, np.ndarray]) -> dict[int, int]:
+        directory = tags.get(GEO_KEY_DIRECTORY)
+        if directory is None:
+            return {}
+        keys = {}
+        for entry in directory[4:4 + 4 * int(directory[3])].reshape(-1, 4):
+            key, location, _, value = (int(v) for v in entry)
+            if location == 0:  # short values stored inline
+                keys[key] = value
+        return keys
+
+    def _crs_from_geokeys(self, tags: dict[int, np.ndarray]) -> CoordinateSystem:
+        keys = self._geokeys(tags)
+        code = keys.get(PROJECTED_CS_TYPE) or keys.get(GEOGRAPHIC_TYPE) or 4326
+        if code not in SUPPORTED_CRS:
+            raise DemError(f"DEM coordinate system EPSG:{code} is not supported; set DEM_CRS")
+        return SUPPORTED_CRS[code]
+
+    # --- Blocks ---
+
+    def _block(self, index: int) -> np.ndarray:
+        """Decode a block to float32 with NaN for nodata, through the LRU cache."""
+        with self._lock:
+            block = self._cache.get(index)
+            if block is not None:
+                self._cache.move_to_end(index)
+                return block
+
+        offset, size = int(self.block_offsets[index]), int(self.block_sizes[index])
+        raw = self._data[offset:offset + size]
+        if self.compression in DEFLATE:
+            raw = zlib.decompress(raw.tobytes())
+        values = np.frombuffer(raw, dtype=self.dtype).reshape(-1, self.block_width)
+        if self.predictor == 2:
+            values = np.cumsum(values, axis=1, dtype=self.dtype)
+
+        block = values.astype(np.float32)
+        if self.nodata is not None:
+            block[block == np.float32(self.nodata)] = np.nan
+
+        with self._lock:
+            self._cache[index] = block
+            while len(self._cache) > self._cache_blocks:
+                self._cache.popitem(last=False)
+        return block
+
+    def _gather(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        """Pixel values at integer positions, reading each block once."""
+        blocks = (rows // self.block_height) * self.blocks_across + cols // self.block_width
+        values = np.empty(len(rows), dtype=np.float32)
+        for index in np.unique(blocks):
+            selected = blocks == index
+            block = self._block(int(index))
+            values[selected] = block[rows[selected] % self.block_height, cols[selected] % self.block_width]
+        return values
+
+    # --- Sampling ---
+
+    def sample(self, lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+        """
+        Bilinearly interpolated elevations at WGS84 points.
+
+        Returns NaN for points outside the raster or surrounded by nodata.
+        Corners without data are left out of the interpolation.
+        """
+        x, y = self.crs.from_wgs84(lon, lat)
+        col = (np.asarray(x) - self.origin_x) / self.pixel_width - self.centre_offset
+        row = (self.origin_y - np.asarray(y)) / self.pixel_height - self.centre_offset
+
+        inside = (col >= -0.5) & (col <= self.width - 0.5) & (row >= -0.5) & (row <= self.height - 0.5)
+        result = np.full(len(col), np.nan)
+        if not inside.any():
+            return result
+        col, row = col[inside], row[inside]
+
+        col0, row0 = np.floor(col), np.floor(row)
+        fx, fy = col - col0, row - row0
+        col0, row0 = col0.astype(np.int64), row0.astype(np.int64)
+        c0, c1 = np.clip(col0, 0, self.width - 1), np.clip(col0 + 1, 0, self.width - 1)
+        r0, r1 = np.clip(row0, 0, self.height - 1), np.clip(row0 + 1, 0, self.height - 1)
+
+        corners = np.stack([
+            self._gather(r0, c0), self._gather(r0, c1),
+            self._gather(r1, c0), self._gather(r1, c1),
+        ]).astype(np.float64)
+        weights = np.stack([(1 - fx) * (1 - fy), fx * (1 - fy), (1 - fx) * fy, fx * fy])
+        valid = ~np.isnan(corners)
+        weights = np.where(valid, weights, 0.0)
+        total = weights.sum(axis=0)
+
+        weighted = (np.where(valid, corners, 0.0) * weights).sum(axis=0)
+        result[inside] = np.divide(weighted, total, out=np.full(len(total), np.nan), where=total > 0)
+        return result
+
+
+_dem: Optional[DemRaster] = None
+_dem_lock = threading.Lock()
+_dem_failed = False
+
+
+def get_dem() -> Optional[DemRaster]:
+    """Open the configured DEM once; None when none is configured or it cannot be read."""
+    global _dem, _dem_failed
+    if _dem is not None or _dem_failed or not settings.dem_path:
+        return _dem
+    with _dem_lock:
+        if _dem is None and not _dem_failed:
+            try:
+                if not os.path.exists(settings.dem_path):
+                    raise DemError(f"{settings.dem_path} does not exist")
+                _dem = DemRaster(settings.dem_path, settings.dem_crs, settings.dem_cache_blocks)
+                logger.info(
+                    f"Opened DEM {settings.dem_path}: {_dem.width}x{_dem.height} "
+                    f"{_dem.dtype}, EPSG:{_dem.crs.code}"
+                )
+            except (DemError, ValueError, OSError) as e:
+                _dem_failed = True
+                logger.error(f"Cannot use DEM {settings.dem_path}: {e}")
+    return _dem
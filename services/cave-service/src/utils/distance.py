@@ -0,0 +1,19 @@
+"""Great-circle distances on whole coordinate arrays."""
+import numpy as np
+
+# Mean Earth radius (IUGG), metres
+EARTH_RADIUS_M = 6371008.8
+
+
+def haversine_m(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    Haversine distance in metres between WGS84 points given in degrees.
+
+    Arguments broadcast against each other, so one call can compute pairs,
+    one-to-many distances or a full matrix (lat1[:, None], lat2[None, :]).
+    """
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = np.radians(np.asarray(lon2) - np.asarray(lon1))
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
@@ -0,0 +1,130 @@
+"""
+Entrance altitudes from the configured DEM.
+
+New entrances, and entrances moved to new coordinates, without asl_m are
+filled in inline; an altitude cleared on an entrance that stays put is left
+empty. Existing entrances are filled in, or checked against the DEM, by the
+elevation_backfill job.
+"""
+import logging
+from typing import Any, Awaitable, Callable, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import Float, Integer, column, func, select, update, values
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from src.config.settings import settings
+from src.models.cave import Entrance
+from src.utils.data_version import bump_data_version
+from src.utils.dem import get_dem
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 1000
+MAX_REPORTED_MISMATCHES = 100
+
+
+async def fill_missing_elevations(entrances: Sequence[Any]) -> int:
+    """
+    Set asl_m from the DEM on entrance-like objects that have none.
+
+    Works on ORM entrances and EntranceCreate objects alike. Does nothing
+    when no DEM is configured.
+
+    Returns:
+        int: Number of entrances filled in
+    """
+    dem = get_dem()
+    missing = [e for e in entrances if e.asl_m is None and e.gps_n is not None and e.gps_e is not None]
+    if dem is None or not missing:
+        return 0
+
+    elevations = await run_in_threadpool(dem.sample, [e.gps_e for e in missing], [e.gps_n for e in missing])
+    filled = 0
+    for entrance, elevation in zip(missing, elevations.tolist()):
+        if not np.isnan(elevation):
+            entrance.asl_m = round(elevation, 1)
+            filled += 1
+    return filled
+
+
+async def backfill_elevations(
+    session: AsyncSession,
+    validate: bool = False,
+    on_progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+) -> dict[str, Any]:
+    """
+    Fill in asl_m for every entrance without one.
+
+    With validate, entrances that already have asl_m are compared with the
+    DEM as well and those off by more than settings.dem_mismatch_tolerance_m
+    are reported; their values are not changed. Entrances are processed in
+    keyset-paginated batches that are committed one by one.
+    """
+    dem = get_dem()
+    if dem is None:
+        raise RuntimeError("No DEM configured")
+
+    query = select(Entrance.entrance_id, Entrance.cave_id, Entrance.gps_n, Entrance.gps_e, Entrance.asl_m)
+    count_query = select(func.count()).select_from(Entrance)
+    if not validate:
+        query = query.where(Entrance.asl_m.is_(None))
+        count_query = count_query.where(Entrance.asl_m.is_(None))
+    total = await session.scalar(count_query)
+
+    done = filled = outside = mismatch_count = 0
+    mismatches = []
+    last_id = 0
+    while True:
+        result = await session.execute(
+            query.where(Entrance.entrance_id > last_id).order_by(Entrance.entrance_id).limit(BACKFILL_BATCH_SIZE)
+        )
+        rows = result.all()
+        if not rows:
+            break
+        last_id = rows[-1].entrance_id
+
+        elevations = await run_in_threadpool(dem.sample, [r.gps_e for r in rows], [r.gps_n for r in rows])
+        updates = []
+        for row, elevation in zip(rows, elevations.tolist()):
+            if np.isnan(elevation):
+                outside += 1
+            elif row.asl_m is None:
+                updates.append((row.entrance_id, round(elevation, 1)))
+            elif abs(row.asl_m - elevation) > settings.dem_mismatch_tolerance_m:
+                mismatch_count += 1
+                if len(mismatches) < MAX_REPORTED_MISMATCHES:
+                    mismatches.append({
+                        "entrance_id": row.entrance_id,
+                        "cave_id": row.cave_id,
+                        "asl_m": row.asl_m,
+                        "dem_m": round(elevation, 1),
+                    })
+
+        written = 0
+        if updates:
+            # One UPDATE ... FROM (VALUES ...) that skips altitudes set while the job runs
+            sampled = values(column("entrance_id", Integer), column("asl_m", Float), name="sampled").data(updates)
+            result = await session.execute(
+                update(Entrance)
+                .where(Entrance.entrance_id == sampled.c.entrance_id, Entrance.asl_m.is_(None))
+                .values(asl_m=sampled.c.asl_m)
+                .returning(Entrance.entrance_id)
+                .execution_options(synchronize_session=False)
+            )
+            written = len(result.all())
+            filled += written
+        await session.commit()
+        if written:
+            await bump_data_version()
+
+        done += len(rows)
+        if on_progress is not None:
+            await on_progress(done, total)
+
+    summary = {"checked": done, "filled": filled, "outside_dem": outside}
+    if validate:
+        summary["mismatches"] = mismatch_count
+        summary["mismatched_entrances"] = mismatches
+    return summary
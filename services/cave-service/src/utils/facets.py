@@ -0,0 +1,100 @@
+from sqlalchemy import case, func, literal_column, tuple_
+from sqlalchemy.future import select
+from src.models.cave import Cave
+
+# Lower edges of the histogram buckets; the last bucket is open-ended
+DEPTH_BUCKET_EDGES = [0, 10, 25, 50, 100, 250, 500, 1000]
+LENGTH_BUCKET_EDGES = [0, 50, 100, 250, 500, 1000, 5000, 10000]
+
+# GROUPING() bitmasks for (zone, depth_bucket, length_bucket); a set bit
+# means the column is aggregated away in that grouping set
+_ZONE_SET = 0b011
+_DEPTH_SET = 0b101
+_LENGTH_SET = 0b110
+_TOTAL_SET = 0b111
+
+
+def _bucket_expression(column, edges: list[float]):
+    """Map a column to the index of its histogram bucket (NULL stays NULL)."""
+    whens = [(column.is_(None), None)]
+    whens += [
+        (column < literal_column(repr(float(upper))), literal_column(str(index)))
+        for index, upper in enumerate(edges[1:])
+    ]
+    return case(*whens, else_=literal_column(str(len(edges) - 1)))
+
+
+def build_facets_query(filtered_query):
+    """
+    Build a single grouped query returning zone counts and depth/length
+    histograms for the caves selected by filtered_query.
+
+    filtered_query must be a select over Cave with the caller's filters
+    applied; its WHERE clause is reused for one scan grouped by GROUPING SETS.
+    """
+    filtered = (
+        filtered_query
+        .with_only_columns(
+            Cave.zone.label("zone"),
+            _bucket_expression(Cave.depth, DEPTH_BUCKET_EDGES).label("depth_bucket"),
+            _bucket_expression(Cave.length, LENGTH_BUCKET_EDGES).label("length_bucket"),
+        )
+        .subquery()
+    )
+    zone, depth_bucket, length_bucket = filtered.c.zone, filtered.c.depth_bucket, filtered.c.length_bucket
+
+    return (
+        select(
+            func.grouping(zone, depth_bucket, length_bucket).label("grouping"),
+            zone,
+            depth_bucket,
+            length_bucket,
+            func.count().label("count"),
+        )
+        .group_by(func.grouping_sets(
+            tuple_(zone),
+            tuple_(depth_bucket),
+            tuple_(length_bucket),
+            tuple_(),
+        ))
+    )
+
+
+def _histogram(counts: dict, edges: list[float]) -> dict:
+    """Build a histogram facet from bucket index -> count."""
+    buckets = [
+        {
+            "min": lower,
+            "max": edges[index + 1] if index + 1 < len(edges) else None,
+            "count": counts.get(index, 0),
+        }
+        for index, lower in enumerate(edges)
+    ]
+    return {"buckets": buckets, "missing": counts.get(None, 0)}
+
+
+def parse_facet_rows(rows) -> dict:
+    """Turn the rows of build_facets_query into the CaveFacets format."""
+    total = 0
+    zones = []
+    depth_counts: dict = {}
+    length_counts: dict = {}
+
+    for grouping, zone, depth_bucket, length_bucket, count in rows:
+        if grouping == _TOTAL_SET:
+            total = count
+        elif grouping == _ZONE_SET:
+            zones.append({"zone": zone, "count": count})
+        elif grouping == _DEPTH_SET:
+            depth_counts[depth_bucket] = count
+        elif grouping == _LENGTH_SET:
+            length_counts[length_bucket] = count
+
+    zones.sort(key=lambda z: (z["zone"] is None, z["zone"] or ""))
+
+    return {
+        "total": total,
+        "zones": zones,
+        "depth": _histogram(depth_counts, DEPTH_BUCKET_EDGES),
+        "length": _histogram(length_counts, LENGTH_BUCKET_EDGES),
+    }
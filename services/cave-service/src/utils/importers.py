@@ -0,0 +1,641 @@
+"""
+Streaming importers for cave catalogues in CSV, GeoJSON and KML.
+
+Files are processed as a generator pipeline so that only one batch of
+records is in memory at a time:
+
+    iter_records  ->  batches  ->  validate (TypeAdapter)  ->  group into caves  ->  bulk insert
+
+Each record describes a cave and at most one entrance. Consecutive records
+with the same cave name are merged into one cave with several entrances,
+which matches how field spreadsheets list one entrance per row; cave
+attributes left empty on the first record are taken from later ones.
+
+With duplicate detection, a first pass over the file collects only the
+coordinates and names of the records, which are compared with each other
+and with the existing entrances around them before the import pass.
+"""
+import codecs
+import csv
+import io
+import json
+import logging
+import math
+import os
+import re
+import xml.etree.ElementTree as ET
+from typing import Any, Awaitable, BinaryIO, Callable, Iterator, Literal, Optional
+import numpy as np
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from src.config.settings import settings
+from src.models.cave import Cave, Entrance
+from src.schemas.cave import CaveCreate, CaveImportRow, EntranceCreate, BulkRowError, BulkUploadResult, DuplicateEntrance
+from src.utils.bulk_ingest import bulk_insert_caves, bulk_upsert_caves, chunked
+from src.utils.crs import CoordinateSystem, entrances_to_wgs84
+from src.utils.dedupe import DedupeMode, find_duplicate_pairs, name_similarity, normalize_name
+from src.utils.distance import EARTH_RADIUS_M, haversine_m
+
+logger = logging.getLogger(__name__)
+
+ImportFormat = Literal["csv", "geojson", "kml"]
+
+# Column and property aliases used by the spreadsheets and GIS exports we import
+FIELD_ALIASES = {
+    "cave": "name",
+    "cave_name": "name",
+    "entrance": "entrance_name",
+    "lat": "gps_n",
+    "latitude": "gps_n",
+    "n": "gps_n",
+    "lon": "gps_e",
+    "lng": "gps_e",
+    "longitude": "gps_e",
+    "e": "gps_e",
+    "elevation": "asl_m",
+    "altitude": "asl_m",
+    "asl": "asl_m",
+    "alt": "asl_m",
+}
+
+FORMAT_EXTENSIONS = {
+    ".csv": "csv",
+    ".geojson": "geojson",
+    ".json": "geojson",
+    ".kml": "kml",
+}
+
+_READ_SIZE = 64 * 1024
+
+_row_list_adapter = TypeAdapter(list[CaveImportRow])
+
+
+def detect_format(filename: Optional[str]) -> Optional[str]:
+    """Guess the import format from a file name."""
+    if not filename:
+        return None
+    return FORMAT_EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+
+
+def _normalize_record(raw: dict[str, Any]) -> dict[str, Any]:
+    """Map source column names onto CaveImportRow field names."""
+    record = {}
+    for key, value in raw.items():
+        if key is None:
+            continue
+        key = key.strip().lower().replace(" ", "_")
+        record[FIELD_ALIASES.get(key, key)] = value
+    return record
+
+
+# --- CSV ---
+
+def iter_csv_records(file: BinaryIO) -> Iterator[dict[str, Any]]:
+    """Yield one record per CSV row, reading the file line by line."""
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        for row in csv.DictReader(text):
+            yield _normalize_record(row)
+    finally:
+        # Don't let the wrapper close the underlying upload
+        text.detach()
+
+
+# --- GeoJSON ---
+
+_FEATURES_START = re.compile(r'"features"\s*:\s*\[')
+# Characters that matter when looking for the end of a feature, outside and inside strings
+_STRUCTURAL = re.compile(r'[{}\[\]"]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+
+
+def _feature_to_record(feature: dict[str, Any]) -> dict[str, Any]:
+    """Convert a GeoJSON Point feature to a record."""
+    record = _normalize_record(feature.get("properties") or {})
+    geometry = feature.get("geometry")
+    if geometry:
+        if geometry.get("type") != "Point":
+            raise ValueError(f"Unsupported geometry type: {geometry.get('type')}")
+        coordinates = geometry.get("coordinates") or []
+        record["gps_e"], record["gps_n"] = coordinates[0], coordinates[1]
+        if len(coordinates) > 2:
+            record.setdefault("asl_m", coordinates[2])
+    return record
+
+
+class FeatureTooLarge(ValueError):
+    """A GeoJSON feature is longer than settings.import_max_feature_size characters."""
+
+
+def iter_geojson_records(file: BinaryIO, max_feature_size: Optional[int] = None) -> Iterator[dict[str, Any]]:
+    """
+    Yield one record per feature of a GeoJSON FeatureCollection.
+
+    Features are read one at a time from a sliding buffer, so the whole
+    collection is never parsed into memory. The end of a feature is found
+    by scanning for its closing brace, resuming where the scan stopped when
+    more of the file is read, and the feature is then decoded once, so
+    reading it takes time linear in its size.
+
+    Raises:
+        FeatureTooLarge: If a feature is longer than max_feature_size
+            characters (default: settings.import_max_feature_size), e.g.
+            because a bracket is never closed
+        ValueError: If the file is not a FeatureCollection or is malformed
+    """
+    max_feature_size = max_feature_size or settings.import_max_feature_size
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    position = 0
+    eof = False
+
+    def fill() -> bool:
+        nonlocal buffer, position, eof
+        data = file.read(_READ_SIZE)
+        if not data:
+            eof = True
+            buffer = buffer[position:] + text_decoder.decode(b"", final=True)
+        else:
+            buffer = buffer[position:] + text_decoder.decode(data)
+        position = 0
+        return not eof
+
+    # Find the start of the features array
+    while True:
+        match = _FEATURES_START.search(buffer, position)
+        if match:
+            position = match.end()
+            break
+        if eof:
+            raise ValueError("GeoJSON file has no 'features' array")
+        # Keep a tail in case the key is split across reads
+        position = max(0, len(buffer) - 32)
+        fill()
+
+    feature_index = 0
+    while True:
+        # Skip separators between features
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position < len(buffer) or not fill():
+                break
+
+        if position >= len(buffer):
+            raise ValueError("Unexpected end of GeoJSON file")
+        if buffer[position] == "]":
+            return
+        if buffer[position] != "{":
+            raise ValueError(f"Feature {feature_index} is not a JSON object")
+
+        # Scan to the closing brace; offsets are relative to position, which fill() moves to 0
+        offset, depth, in_string = 0, 0, False
+        while True:
+            if in_string:
+                match = _STRING_SPECIAL.search(buffer, position + offset)
+                if match is not None and match.group() == '"':
+                    in_string = False
+                    offset = match.end() - position
+                    continue
+                if match is not None and match.end() < len(buffer):
+                    # Skip the escaped character
+                    offset = match.end() + 1 - position
+                    continue
+                offset = (match.start() if match is not None else len(buffer)) - position
+            else:
+                match = _STRUCTURAL.search(buffer, position + offset)
+                if match is not None:
+                    offset = match.end() - position
+                    char = match.group()
+                    if char == '"':
+                        in_string = True
+                    elif char in "{[":
+                        depth += 1
+                    else:
+                        depth -= 1
+                        if depth == 0:
+                            break
+                    continue
+                offset = len(buffer) - position
+
+            # The feature continues past the buffer
+            if offset > max_feature_size:
+                raise FeatureTooLarge(f"Feature {feature_index} is longer than {max_feature_size} characters")
+            if not fill():
+                raise ValueError("Unexpected end of GeoJSON file")
+
+        if offset > max_feature_size:
+            raise FeatureTooLarge(f"Feature {feature_index} is longer than {max_feature_size} characters")
+        feature, position = decoder.raw_decode(buffer, position)
+        feature_index += 1
+        try:
+            yield _feature_to_record(feature)
+        except ValueError as e:
+            yield {"_error": str(e), "name": (feature.get("properties") or {}).get("name")}
+
+
+# --- KML ---
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _placemark_to_record(placemark: ET.Element) -> dict[str, Any]:
+    """Convert a KML Placemark with a Point to a record."""
+    raw: dict[str, Any] = {}
+    placemark_name = None
+    coordinates = None
+
+    for element in placemark.iter():
+        tag = _local_name(element.tag)
+        if tag == "name" and placemark_name is None:
+            placemark_name = (element.text or "").strip()
+        elif tag == "Data":
+            value = next((child.text for child in element if _local_name(child.tag) == "value"), None)
+            raw[element.get("name", "")] = value
+        elif tag == "SimpleData":
+            raw[element.get("name", "")] = element.text
+        elif tag == "coordinates":
+            coordinates = (element.text or "").strip()
+        elif tag in ("LineString", "Polygon", "MultiGeometry"):
+            raise ValueError(f"Unsupported geometry type: {tag}")
+
+    record = _normalize_record(raw)
+    # The placemark name is the entrance name when the cave is given separately
+    if "name" in record:
+        record.setdefault("entrance_name", placemark_name)
+    else:
+        record["name"] = placemark_name
+
+    if coordinates:
+        parts = coordinates.split()[0].split(",")
+        record["gps_e"], record["gps_n"] = parts[0], parts[1]
+        if len(parts) > 2:
+            record.setdefault("asl_m", parts[2])
+    return record
+
+
+def iter_kml_records(file: BinaryIO) -> Iterator[dict[str, Any]]:
+    """
+    Yield one record per KML Placemark.
+
+    The document is parsed with iterparse and every processed placemark is
+    removed from its parent, so memory use does not grow with the file size.
+    """
+    parents: list[ET.Element] = []
+    for event, element in ET.iterparse(file, events=("start", "end")):
+        if event == "start":
+            parents.append(element)
+            continue
+
+        parents.pop()
+        if _local_name(element.tag) != "Placemark":
+            continue
+
+        try:
+            yield _placemark_to_record(element)
+        except ValueError as e:
+            yield {"_error": str(e), "name": None}
+
+        if parents:
+            parents[-1].remove(element)
+
+
+RECORD_READERS = {
+    "csv": iter_csv_records,
+    "geojson": iter_geojson_records,
+    "kml": iter_kml_records,
+}
+
+
+# --- Pipeline ---
+
+def validate_records(
+    batch: list[tuple[int, dict[str, Any]]],
+    result: BulkUploadResult,
+) -> list[tuple[int, CaveImportRow]]:
+    """
+    Validate a batch of records with a single TypeAdapter call.
+
+    Invalid records are reported in result and dropped.
+    """
+    candidates = []
+    for index, record in batch:
+        if "_error" in record:
+            result.errors.append(BulkRowError(index=index, name=record.get("name"), error=record["_error"]))
+        else:
+            candidates.append((index, record))
+
+    try:
+        rows = _row_list_adapter.validate_python([record for _, record in candidates])
+        return [(index, row) for (index, _), row in zip(candidates, rows)]
+    except ValidationError as e:
+        errors: dict[int, list[str]] = {}
+        for error in e.errors():
+            position, *field = error["loc"]
+            errors.setdefault(position, []).append(f"{'.'.join(str(f) for f in field) or 'row'}: {error['msg']}")
+
+    # A failed list validation returns no partial result, so build the
+    # valid rows individually
+    valid = []
+    for position, (index, record) in enumerate(candidates):
+        if position in errors:
+            result.errors.append(BulkRowError(index=index, name=record.get("name"), error="; ".join(errors[position])))
+        else:
+            valid.append((index, CaveImportRow.model_validate(record)))
+    return valid
+
+
+# CaveCreate fields an import row carries besides the name and entrance
+CAVE_ATTRIBUTES = set(CaveCreate.model_fields) - {"name", "entrances"}
+
+
+def _entrance_from_row(row: CaveImportRow) -> Optional[EntranceCreate]:
+    if row.gps_n is None or row.gps_e is None:
+        return None
+    return EntranceCreate(name=row.entrance_name, gps_n=row.gps_n, gps_e=row.gps_e, asl_m=row.asl_m)
+
+
+class CaveGrouper:
+    """Merges consecutive import rows of the same cave into CaveCreate objects."""
+
+    def __init__(self):
+        self._pending: Optional[tuple[int, CaveCreate]] = None
+
+    def add(self, rows: list[tuple[int, CaveImportRow]], result: BulkUploadResult) -> list[tuple[int, CaveCreate]]:
+        """
+        Add validated rows; returns the caves that are complete.
+
+        Cave attributes of later rows of a cave fill in those the earlier
+        rows left empty. A row whose attributes contradict earlier rows is
+        reported in result and dropped with its entrance.
+        """
+        complete = []
+        for index, row in rows:
+            entrance = _entrance_from_row(row)
+            if self._pending is not None and self._pending[1].name == row.name:
+                first_index, cave = self._pending
+                values = row.model_dump(include=CAVE_ATTRIBUTES, exclude_none=True)
+                conflicts = [
+                    field for field, value in values.items()
+                    if getattr(cave, field) is not None and getattr(cave, field) != value
+                ]
+                if conflicts:
+                    result.errors.append(BulkRowError(
+                        index=index,
+                        name=row.name,
+                        error=f"{', '.join(conflicts)}: differs from record {first_index} of the same cave"
+                    ))
+                    continue
+                for field, value in values.items():
+                    setattr(cave, field, value)
+                if entrance is not None:
+                    cave.entrances.append(entrance)
+                continue
+
+            if self._pending is not None:
+                complete.append(self._pending)
+            cave = CaveCreate(
+                **row.model_dump(include=CAVE_ATTRIBUTES | {"name"}),
+                entrances=[entrance] if entrance is not None else [],
+            )
+            self._pending = (index, cave)
+        return complete
+
+    def flush(self) -> list[tuple[int, CaveCreate]]:
+        """Return the last cave, which is complete once the input ends."""
+        pending, self._pending = self._pending, None
+        return [pending] if pending is not None else []
+
+
+# --- Duplicate detection ---
+
+def _record_label(name: Any, entrance_name: Any) -> str:
+    return " ".join(str(value) for value in (name, entrance_name) if value not in (None, ""))
+
+
+def collect_points(
+    file: BinaryIO, file_format: ImportFormat, crs: Optional[CoordinateSystem] = None
+) -> tuple[list[int], list[str], np.ndarray, np.ndarray]:
+    """
+    Read the record indices, labels and WGS84 coordinates of a file's entrances.
+
+    Records without usable coordinates are left out; they are reported by
+    the import pass. The file is rewound afterwards.
+    """
+    indices, labels, north, east = [], [], [], []
+    records = RECORD_READERS[file_format](file)
+    try:
+        for index, record in enumerate(records):
+            if "_error" in record:
+                continue
+            try:
+                gps_n, gps_e = float(record.get("gps_n")), float(record.get("gps_e"))
+            except (TypeError, ValueError):
+                continue
+            indices.append(index)
+            labels.append(_record_label(record.get("name"), record.get("entrance_name")))
+            north.append(gps_n)
+            east.append(gps_e)
+    except (ValueError, csv.Error, ET.ParseError):
+        # Malformed input is reported by the import pass
+        pass
+    finally:
+        records.close()
+    file.seek(0)
+
+    lat, lon = np.asarray(north, dtype=np.float64), np.asarray(east, dtype=np.float64)
+    if crs is not None:
+        lon, lat = crs.to_wgs84(lon, lat)
+    finite = np.isfinite(lat) & np.isfinite(lon)
+    if not finite.all():
+        keep = np.flatnonzero(finite).tolist()
+        indices, labels = [indices[k] for k in keep], [labels[k] for k in keep]
+        lat, lon = lat[finite], lon[finite]
+    return indices, labels, lat, lon
+
+
+async def find_import_duplicates(
+    session: AsyncSession,
+    file: BinaryIO,
+    file_format: ImportFormat,
+    mode: DedupeMode,
+    crs: Optional[CoordinateSystem] = None,
+    radius_m: Optional[float] = None,
+    min_similarity: Optional[float] = None,
+) -> list[DuplicateEntrance]:
+    """
+    Find file records whose entrance duplicates an earlier record or an
+    existing entrance.
+
+    Duplicates are grouped into clusters; each cluster keeps an existing
+    entrance if it has one and otherwise its first record. The other
+    records are reported, and marked as merged in merge mode.
+    """
+    radius_m = radius_m or settings.dedupe_radius_m
+    min_similarity = settings.dedupe_min_similarity if min_similarity is None else min_similarity
+
+    indices, labels, lat, lon = await run_in_threadpool(collect_points, file, file_format, crs)
+    if not indices:
+        return []
+
+    # Existing entrances in the file's bounding box, padded by the radius
+    pad_lat = math.degrees(radius_m / EARTH_RADIUS_M)
+    pad_lon = pad_lat / max(math.cos(math.radians(float(np.max(np.abs(lat))))), 1e-6)
+    result = await session.execute(
+        select(Entrance.entrance_id, Entrance.gps_n, Entrance.gps_e, Entrance.name, Cave.name)
+        .join(Cave, Cave.cave_id == Entrance.cave_id)
+        .where(
+            Entrance.gps_n.between(float(lat.min()) - pad_lat, float(lat.max()) + pad_lat),
+            Entrance.gps_e.between(float(lon.min()) - pad_lon, float(lon.max()) + pad_lon),
+        )
+    )
+    existing = result.all()
+
+    count = len(indices)
+    all_lat = np.concatenate([lat, np.array([row[1] for row in existing], dtype=np.float64)])
+    all_lon = np.concatenate([lon, np.array([row[2] for row in existing], dtype=np.float64)])
+    all_labels = labels + [_record_label(row[4], row[3]) for row in existing]
+    normalized = [normalize_name(label) for label in all_labels]
+    reference = np.arange(len(all_lat)) >= count
+
+    pairs = await run_in_threadpool(
+        find_duplicate_pairs, all_lat, all_lon, normalized, radius_m, min_similarity, reference
+    )
+
+    # Clusters of duplicates; points are ordered file first, so prefer
+    # existing entrances explicitly when choosing what to keep
+    parent = list(range(len(all_lat)))
+
+    def find(point: int) -> int:
+        while parent[point] != point:
+            parent[point] = parent[parent[point]]
+            point = parent[point]
+        return point
+
+    for pair in pairs:
+        parent[find(pair.second)] = find(pair.first)
+
+    keepers: dict[int, int] = {}
+    for point in sorted({p for pair in pairs for p in (pair.first, pair.second)}, key=lambda p: (p < count, p)):
+        keepers.setdefault(find(point), point)
+
+    duplicates = []
+    for point in sorted({p for pair in pairs for p in (pair.first, pair.second) if p < count}):
+        keeper = keepers[find(point)]
+        if keeper == point:
+            continue
+        is_existing = keeper >= count
+        duplicates.append(DuplicateEntrance(
+            index=indices[point],
+            name=all_labels[point],
+            duplicate_of_index=None if is_existing else indices[keeper],
+            duplicate_of_entrance_id=existing[keeper - count][0] if is_existing else None,
+            duplicate_of_name=all_labels[keeper],
+            distance_m=round(float(haversine_m(all_lat[point], all_lon[point], all_lat[keeper], all_lon[keeper])), 2),
+            similarity=round(name_similarity(normalized[point], normalized[keeper]), 3),
+            merged=mode == "merge",
+        ))
+    return duplicates
+
+
+async def import_caves(
+    session: AsyncSession,
+    file: BinaryIO,
+    file_format: ImportFormat,
+    owner_email: str,
+    batch_size: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    upsert: bool = False,
+    prune_entrances: bool = False,
+    crs: Optional[CoordinateSystem] = None,
+    dedupe: Optional[DedupeMode] = None,
+    dedupe_radius_m: Optional[float] = None,
+    on_progress: Optional[Callable[[BulkUploadResult], Awaitable[None]]] = None,
+) -> BulkUploadResult:
+    """
+    Import caves from a CSV, GeoJSON or KML file.
+
+    Parsing and validation run in a worker thread one batch at a time; every
+    batch is handed to the bulk insert path before the next one is read.
+
+    Args:
+        session: Database session
+        file: Binary file object positioned at the start of the data
+        file_format: One of 'csv', 'geojson', 'kml'
+        owner_email: Email of the user the caves are created for
+        batch_size: Records per parse/validate batch (default: settings.import_batch_size)
+        chunk_size: Caves per insert transaction (default: settings.bulk_chunk_size)
+        upsert: Update existing caves by name instead of reporting them as conflicts
+        prune_entrances: With upsert, delete existing entrances missing from the file
+        crs: Coordinate system of the file's coordinates (default: WGS84)
+        dedupe: Report ('flag') or skip ('merge') entrances that duplicate an
+            earlier record or an existing entrance; needs a seekable file
+        dedupe_radius_m: Largest distance between duplicates (default: settings.dedupe_radius_m)
+        on_progress: Awaited with the running result after every batch
+
+    Returns:
+        BulkUploadResult: Created, updated and unchanged counts and per-row errors
+    """
+    result = BulkUploadResult()
+    skipped: set[int] = set()
+    if dedupe is not None:
+        result.duplicates = await find_import_duplicates(
+            session, file, file_format, dedupe, crs=crs, radius_m=dedupe_radius_m
+        )
+        skipped = {duplicate.index for duplicate in result.duplicates if duplicate.merged}
+
+    async def write(caves: list[tuple[int, CaveCreate]]) -> None:
+        if upsert:
+            await bulk_upsert_caves(
+                session, caves, owner_email, result=result, chunk_size=chunk_size, prune_entrances=prune_entrances
+            )
+        else:
+            await bulk_insert_caves(session, caves, owner_email, result=result, chunk_size=chunk_size)
+
+    grouper = CaveGrouper()
+    records = RECORD_READERS[file_format](file)
+    batches = chunked(enumerate(records), batch_size or settings.import_batch_size)
+
+    def next_batch() -> Optional[list[tuple[int, CaveImportRow]]]:
+        batch = next(batches, None)
+        if batch is None:
+            return None
+        if skipped:
+            batch = [(index, record) for index, record in batch if index not in skipped]
+        rows = validate_records(batch, result)
+        if crs is not None:
+            # One array transform per batch
+            entrances_to_wgs84([row for _, row in rows if row.gps_n is not None and row.gps_e is not None], crs)
+        return rows
+
+    try:
+        while True:
+            try:
+                rows = await run_in_threadpool(next_batch)
+            except (ValueError, csv.Error, ET.ParseError) as e:
+                # The file itself is malformed; keep what was imported so far
+                logger.warning(f"Stopping {file_format} import on malformed input: {e}")
+                result.errors.append(BulkRowError(index=-1, error=f"Malformed {file_format} file: {e}"))
+                break
+            if rows is None:
+                break
+
+            caves = grouper.add(rows, result)
+            if caves:
+                await write(caves)
+            if on_progress is not None:
+                await on_progress(result)
+
+        caves = grouper.flush()
+        if caves:
+            await write(caves)
+    finally:
+        # Release the reader before the caller closes the file
+        records.close()
+
+    result.errors.sort(key=lambda e: e.index)
+    return result
@@ -0,0 +1,89 @@
+"""
+Background job handlers of cave-service.
+
+    import_caves        Import a spooled CSV/GeoJSON/KML upload
+    user_deletion       Transfer or delete the caves of a deleted user
+    elevation_backfill  Fill in or validate entrance altitudes from the DEM
+    delete_all_caves    Delete all caves (testing only)
+"""
+import logging
+import os
+from typing import Any
+from src.schemas.cave import BulkUploadResult
+from src.utils.cave_deletion_handler import CaveDeletionHandler
+from src.utils.cave_operations import delete_all_caves
+from src.utils.crs import get_crs
+from src.utils.elevation import backfill_elevations
+from src.utils.importers import import_caves
+from src.utils.jobs import JobContext, JobRunner
+from src.utils.spool import delete_spool, open_spool
+from src.db.connection import async_session
+
+logger = logging.getLogger(__name__)
+
+
+async def import_caves_job(context: JobContext, payload: dict[str, Any]) -> dict[str, Any]:
+    """Import a spooled file; progress is measured in bytes read."""
+    try:
+        async with async_session() as session:
+            with await open_spool(session, payload["spool_id"]) as file:
+                total = file.seek(0, os.SEEK_END)
+                file.seek(0)
+
+                async def on_progress(result: BulkUploadResult) -> None:
+                    await context.progress(
+                        min(file.tell(), total),
+                        total,
+                        f"{result.created} created, {result.updated} updated, {len(result.errors)} errors",
+                    )
+
+                result = await import_caves(
+                    session,
+                    file,
+                    payload["format"],
+                    payload["owner_email"],
+                    chunk_size=payload.get("chunk_size"),
+                    upsert=payload.get("upsert", False),
+                    prune_entrances=payload.get("prune_entrances", False),
+                    crs=get_crs(payload.get("crs")),
+                    dedupe=payload.get("dedupe"),
+                    dedupe_radius_m=payload.get("dedupe_radius_m"),
+                    on_progress=on_progress,
+                )
+        return result.model_dump()
+    finally:
+        async with async_session() as session:
+            await delete_spool(session, payload["spool_id"])
+
+
+async def user_deletion_job(context: JobContext, payload: dict[str, Any]) -> None:
+    """Run the cave ownership cascade for a deleted user."""
+    async def on_progress(handled: int, total: int) -> None:
+        await context.progress(handled, total)
+
+    await CaveDeletionHandler().handle_user_deletion(payload["email"], payload.get("user_id"), on_progress=on_progress)
+
+
+async def elevation_backfill_job(context: JobContext, payload: dict[str, Any]) -> dict[str, Any]:
+    """Fill in missing entrance altitudes, optionally checking the existing ones."""
+    async def on_progress(done: int, total: int) -> None:
+        await context.progress(done, total)
+
+    async with async_session() as session:
+        return await backfill_elevations(session, validate=payload.get("validate", False), on_progress=on_progress)
+
+
+async def delete_all_caves_job(context: JobContext, payload: dict[str, Any]) -> dict[str, Any]:
+    """Delete all caves, reporting progress after every chunk."""
+    async def on_progress(done: int, total: int) -> None:
+        await context.progress(done, total)
+
+    async with async_session() as session:
+        return await delete_all_caves(session, on_progress=on_progress)
+
+
+def register_job_handlers(runner: JobRunner) -> None:
+    runner.register("import_caves", import_caves_job)
+    runner.register("user_deletion", user_deletion_job)
+    runner.register("elevation_backfill", elevation_backfill_job)
+    runner.register("delete_all_caves", delete_all_caves_job)
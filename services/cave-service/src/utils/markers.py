@@ -0,0 +1,100 @@
+"""
+Compact columnar encoding of map markers.
+
+The map only needs a handful of numbers per entrance, so markers are sent as
+parallel arrays instead of nested cave objects. Two encodings are supported:
+
+Binary (application/octet-stream), all values little-endian:
+
+    offset  type        field
+    0       4 bytes     magic b"CMRK"
+    4       uint32      format version (1)
+    8       uint32      marker count n
+    12      uint32      byte length z of the zone table
+    16      z bytes     UTF-8 JSON array of zone names, space-padded to a multiple of 4
+    ...     float32[n]  lat
+    ...     float32[n]  lon
+    ...     float32[n]  depth (NaN when unknown)
+    ...     float32[n]  length (NaN when unknown)
+    ...     uint32[n]   cave_id
+    ...     int16[n]    zone index into the zone table (-1 when unknown)
+
+Every array starts on a 4-byte boundary, so clients can wrap the buffer in
+typed arrays (Float32Array, Uint32Array, Int16Array) without copying.
+
+JSON: an object with the same column names holding plain lists, with null in
+place of NaN.
+"""
+import json
+import struct
+
+import numpy as np
+
+MARKERS_MAGIC = b"CMRK"
+MARKERS_FORMAT_VERSION = 1
+
+
+class MarkerColumns:
+    """Parallel NumPy arrays describing one marker per entrance."""
+
+    def __init__(self, rows: list[tuple]):
+        """
+        Build the columns from (cave_id, lat, lon, depth, length, zone) rows.
+        """
+        count = len(rows)
+        if count:
+            cave_ids, lats, lons, depths, lengths, zones = zip(*rows)
+        else:
+            cave_ids = lats = lons = depths = lengths = zones = ()
+
+        self.cave_id = np.fromiter(cave_ids, dtype="<u4", count=count)
+        self.lat = np.fromiter(lats, dtype="<f4", count=count)
+        self.lon = np.fromiter(lons, dtype="<f4", count=count)
+        self.depth = np.fromiter((np.nan if v is None else v for v in depths), dtype="<f4", count=count)
+        self.length = np.fromiter((np.nan if v is None else v for v in lengths), dtype="<f4", count=count)
+
+        # Dictionary-encode zones, reserving -1 for caves without a zone
+        self.zones = sorted({z for z in zones if z})
+        zone_index = {z: i for i, z in enumerate(self.zones)}
+        self.zone = np.fromiter((zone_index.get(z, -1) for z in zones), dtype="<i2", count=count)
+
+    def __len__(self):
+        return len(self.cave_id)
+
+
+def encode_markers_binary(columns: MarkerColumns) -> bytes:
+    """Pack marker columns into the little-endian binary layout."""
+    zone_table = json.dumps(columns.zones, separators=(",", ":")).encode()
+    zone_table += b" " * (-len(zone_table) % 4)
+
+    header = struct.pack("<4sIII", MARKERS_MAGIC, MARKERS_FORMAT_VERSION, len(columns), len(zone_table))
+    return b"".join([
+        header,
+        zone_table,
+        columns.lat.tobytes(),
+        columns.lon.tobytes(),
+        columns.depth.tobytes(),
+        columns.length.tobytes(),
+        columns.cave_id.tobytes(),
+        columns.zone.tobytes(),
+    ])
+
+
+def _nullable(values: np.ndarray) -> list:
+    """Convert a float array to a list, replacing NaN with None."""
+    return [None if v != v else v for v in np.round(values.astype(np.float64), 2).tolist()]
+
+
+def encode_markers_json(columns: MarkerColumns) -> bytes:
+    """Encode marker columns as a columnar JSON object."""
+    payload = {
+        "count": len(columns),
+        "zones": columns.zones,
+        "cave_id": columns.cave_id.tolist(),
+        "lat": np.round(columns.lat.astype(np.float64), 5).tolist(),
+        "lon": np.round(columns.lon.astype(np.float64), 5).tolist(),
+        "depth": _nullable(columns.depth),
+        "length": _nullable(columns.length),
+        "zone": columns.zone.tolist(),
+    }
+    return json.dumps(payload, separators=(",", ":")).encode()
@@ -0,0 +1,173 @@
+"""
+Nearest entrances to many query points at once.
+
+Entrances are binned into a grid of square latitude/longitude cells
+settings.nearest_cell_m high and sorted by cell, row by row, as in
+src.utils.dedupe. The cells of one grid row that a query circle overlaps
+are adjacent in that order, so the candidates for all query points are
+found with one pair of searchsorted calls per grid row the circle spans.
+Candidates are then filtered with vectorized haversine distances.
+
+The index is built from the whole catalogue once per data version and
+shared by all requests of the process.
+"""
+import asyncio
+import math
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from src.config.settings import settings
+from src.models.cave import Cave, Entrance
+from src.utils.data_version import get_data_version
+from src.utils.distance import EARTH_RADIUS_M, haversine_m
+
+METRES_PER_DEGREE = EARTH_RADIUS_M * math.pi / 180
+_ROW_KEY_SHIFT = 1 << 32
+
+
+@dataclass
+class NearestMatch:
+    point: int
+    entrance: int
+    distance_m: float
+
+
+class EntranceIndex:
+    """Grid index over entrance coordinates."""
+
+    def __init__(self, rows: list[tuple], cell_m: float):
+        """
+        Build the index from (entrance_id, entrance_name, cave_id, cave_name, lat, lon) rows.
+        """
+        count = len(rows)
+        if count:
+            entrance_ids, entrance_names, cave_ids, cave_names, lats, lons = zip(*rows)
+        else:
+            entrance_ids = entrance_names = cave_ids = cave_names = lats = lons = ()
+        self.entrance_id = np.fromiter(entrance_ids, dtype=np.int64, count=count)
+        self.cave_id = np.fromiter(cave_ids, dtype=np.int64, count=count)
+        self.entrance_name = list(entrance_names)
+        self.cave_name = list(cave_names)
+        self.lat = np.fromiter(lats, dtype=np.float64, count=count)
+        self.lon = np.fromiter(lons, dtype=np.float64, count=count)
+
+        self.cell_deg = cell_m / METRES_PER_DEGREE
+        keys = self._keys(*self._cells(self.lat, self.lon))
+        self.order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.order]
+
+    def __len__(self):
+        return len(self.entrance_id)
+
+    def _cells(self, lat: np.ndarray, lon: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        return np.floor(lat / self.cell_deg).astype(np.int64), np.floor(lon / self.cell_deg).astype(np.int64)
+
+    @staticmethod
+    def _keys(row: np.ndarray, column: np.ndarray) -> np.ndarray:
+        # Columns are offset so keys of one row stay contiguous for negative longitudes
+        return row * _ROW_KEY_SHIFT + (column + _ROW_KEY_SHIFT // 2)
+
+    def _candidates(self, lat: np.ndarray, lon: np.ndarray, radius_m: float) -> tuple[np.ndarray, np.ndarray]:
+        """Index arrays (point, entrance) of every entrance in a cell the circle around the point touches."""
+        radius_deg = radius_m / METRES_PER_DEGREE
+        # Degrees of longitude the circle spans, taken at its edge nearest the pole
+        edge_cos = np.cos(np.radians(np.minimum(np.abs(lat) + radius_deg, 90.0)))
+        half_width = np.minimum(radius_deg / np.maximum(edge_cos, 1e-12), 180.0)
+        west, east = lon - half_width, lon + half_width
+        wraps = half_width < 180.0
+
+        # Circles crossing the antimeridian get a second range on the other side
+        point = np.arange(len(lat))
+        west_wrap = wraps & (west < -180.0)
+        east_wrap = wraps & (east > 180.0)
+        point = np.concatenate([point, point[west_wrap], point[east_wrap]])
+        first = np.concatenate([np.where(wraps, west, -180.0), west[west_wrap] + 360.0, np.full(int(east_wrap.sum()), -180.0)])
+        last = np.concatenate([np.where(wraps, east, 180.0), np.full(int(west_wrap.sum()), 180.0), east[east_wrap] - 360.0])
+
+        row = np.floor(lat[point] / self.cell_deg).astype(np.int64)
+        rows = math.ceil(radius_deg / self.cell_deg)
+        first_column = np.floor(first / self.cell_deg).astype(np.int64)
+        last_column = np.floor(last / self.cell_deg).astype(np.int64)
+
+        points, entrances = [], []
+        for dy in range(-rows, rows + 1):
+            start = np.searchsorted(self.sorted_keys, self._keys(row + dy, first_column), side="left")
+            end = np.searchsorted(self.sorted_keys, self._keys(row + dy, last_column), side="right")
+            counts = end - start
+            total = int(counts.sum())
+            if not total:
+                continue
+            points.append(np.repeat(point, counts))
+            # Position of every candidate inside its run of sorted entrances
+            run_offset = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            entrances.append(self.order[np.repeat(start, counts) + run_offset])
+
+        if not points:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(points), np.concatenate(entrances)
+
+    def query(self, lat: np.ndarray, lon: np.ndarray, radius_m: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Entrances within radius_m of each point.
+
+        Returns:
+            tuple: Arrays (point, entrance, distance_m), ordered by point and then by distance
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        i, j = self._candidates(lat, lon, radius_m)
+        distance = haversine_m(lat[i], lon[i], self.lat[j], self.lon[j])
+        close = distance <= radius_m
+        i, j, distance = i[close], j[close], distance[close]
+        order = np.lexsort((distance, i))
+        return i[order], j[order], distance[order]
+
+    def nearest_caves(
+        self,
+        lat: np.ndarray,
+        lon: np.ndarray,
+        radius_m: float,
+        limit: int,
+    ) -> list[list[NearestMatch]]:
+        """
+        Up to limit caves within radius_m of each point, nearest first.
+
+        Each cave is represented by its entrance closest to the point.
+        """
+        matches: list[list[NearestMatch]] = [[] for _ in range(len(lat))]
+        seen: set[tuple[int, int]] = set()
+        points, entrances, distances = self.query(lat, lon, radius_m)
+        for point, entrance, distance in zip(points.tolist(), entrances.tolist(), distances.tolist()):
+            found = matches[point]
+            cave = int(self.cave_id[entrance])
+            if len(found) >= limit or (point, cave) in seen:
+                continue
+            seen.add((point, cave))
+            found.append(NearestMatch(point, entrance, distance))
+        return matches
+
+
+_index: Optional[EntranceIndex] = None
+_index_version: Optional[int] = None
+_index_lock = asyncio.Lock()
+
+
+async def get_entrance_index(session: AsyncSession) -> EntranceIndex:
+    """The index of all entrances, rebuilt when the catalogue data version changes."""
+    global _index, _index_version
+    version = await get_data_version(session)
+    if _index is not None and _index_version == version:
+        return _index
+    async with _index_lock:
+        if _index is None or _index_version != version:
+            result = await session.execute(
+                select(Entrance.entrance_id, Entrance.name, Cave.cave_id, Cave.name, Entrance.gps_n, Entrance.gps_e)
+                .join(Cave, Cave.cave_id == Entrance.cave_id)
+            )
+            _index = EntranceIndex(result.all(), settings.nearest_cell_m)
+            _index_version = version
+    return _index
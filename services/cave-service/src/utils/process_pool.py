@@ -0,0 +1,39 @@
+"""
+Shared process pool for CPU-bound work.
+
+Pure Python parsing and most NumPy work hold the GIL, so large inputs are
+handed to worker processes to keep the event loop and the threadpool
+responsive. The pool is created on first use and shut down with the app.
+"""
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional
+from src.config.settings import settings
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn avoids forking a process that runs an event loop and threads
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.process_pool_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+async def run_in_process(func: Callable[..., Any], *args: Any) -> Any:
+    """Run a picklable function in the process pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), partial(func, *args))
+
+
+def shutdown_process_pool() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
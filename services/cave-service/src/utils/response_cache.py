@@ -0,0 +1,113 @@
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional
+from fastapi import Request, Response
+from src.utils.compression import MINIMUM_SIZE, compress, select_encoding
+
+logger = logging.getLogger(__name__)
+
+
+# An entity tag of an If-None-Match list; the opaque part may contain commas
+_ENTITY_TAG = re.compile(r'(?:W/)?"([^"]*)"')
+
+
+def if_none_match_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Check an If-None-Match precondition; a match is answered with 304.
+
+    The header is a list of entity tags or "*", compared weakly as RFC 9110
+    requires: W/"x" and "x" match each other.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    match = _ENTITY_TAG.fullmatch(etag)
+    opaque = match.group(1) if match else etag
+    return opaque in _ENTITY_TAG.findall(if_none_match)
+
+
+class CachedBody:
+    """
+    A rendered response body together with its media type.
+
+    Compressed variants are produced on first use and kept alongside the
+    body, so each encoding is paid for once per data version.
+    """
+
+    def __init__(self, body: bytes, media_type: str, version: int):
+        self.body = body
+        self.media_type = media_type
+        self.version = version
+        self.variants: dict[str, bytes] = {}
+
+    def encoded(self, encoding: str) -> bytes:
+        """Get the body compressed with the given encoding."""
+        variant = self.variants.get(encoding)
+        if variant is None:
+            variant = compress(self.body, encoding)
+            self.variants[encoding] = variant
+        return variant
+
+    def __repr__(self):
+        return f"CachedBody(media_type={self.media_type}, version={self.version}, size={len(self.body)})"
+
+
+class ResponseCache:
+    """
+    Small in-process LRU cache for rendered response bodies.
+
+    Entries are tagged with the catalogue data version they were rendered
+    from; a lookup with a newer version is a miss, so entries never need to be
+    invalidated explicitly.
+    """
+
+    def __init__(self, max_entries: int = 128):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, CachedBody]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, version: int) -> Optional[CachedBody]:
+        """Return the cached body for key if it was rendered from this version."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: Hashable, body: bytes, media_type: str, version: int) -> CachedBody:
+        """Store a rendered body for key, evicting the least recently used entry if full."""
+        entry = CachedBody(body, media_type, version)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+
+def cached_response(request: Request, cached: CachedBody, headers: Optional[dict] = None) -> Response:
+    """
+    Build a response from a cached body, using a stored compressed variant
+    when the client accepts one.
+
+    Responses that already carry Content-Encoding are passed through by the
+    compression middleware.
+    """
+    headers = dict(headers or {})
+    vary = headers.get("Vary")
+    headers["Vary"] = f"{vary}, Accept-Encoding" if vary else "Accept-Encoding"
+
+    encoding = select_encoding(request.headers.get("accept-encoding"))
+    if encoding is None or len(cached.body) < MINIMUM_SIZE:
+        return Response(content=cached.body, media_type=cached.media_type, headers=headers)
+
+    headers["Content-Encoding"] = encoding
+    return Response(content=cached.encoded(encoding), media_type=cached.media_type, headers=headers)
+
+
+# Global cache instance
+response_cache = ResponseCache()
@@ -0,0 +1,162 @@
+"""
+Visiting order for expedition routes over cave entrances.
+
+Legs are costed as straight-line haversine distance plus a climbing
+penalty of climb_factor metres per metre of ascent (Naismith's rule uses
+about 8-10), so the cost matrix is asymmetric. The whole matrix is one
+NumPy broadcast over the stop coordinates.
+
+The order is built with nearest neighbour from the start and improved by
+2-opt. Each 2-opt step evaluates every segment reversal at once: the cost
+of a reversed segment comes from prefix sums of the tour's forward and
+backward leg costs, so asymmetric costs are handled exactly. Because
+reversing a climb is expensive, 2-opt is combined with Or-opt moves, which
+relocate short runs of stops without reversing them. An open route (not
+returning to the start) is the same problem with free legs back to the
+start.
+"""
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from src.utils.distance import haversine_m
+
+# Smallest gain in metres worth another local search move
+IMPROVEMENT_EPSILON = 1e-6
+# Longest run of stops an Or-opt move relocates
+OR_OPT_SEGMENT = 3
+
+
+@dataclass
+class RouteLegs:
+    """Pairwise leg measures between stops, indexed [from, to]."""
+    distance: np.ndarray
+    ascent: np.ndarray
+    descent: np.ndarray
+    cost: np.ndarray
+
+
+def leg_matrices(lat: np.ndarray, lon: np.ndarray, asl: np.ndarray, climb_factor: float) -> RouteLegs:
+    """
+    Compute distance, ascent, descent and cost between all stops.
+
+    Unknown altitudes (NaN) contribute no climbing.
+    """
+    distance = haversine_m(lat[:, None], lon[:, None], lat[None, :], lon[None, :])
+    delta = np.nan_to_num(asl[None, :] - asl[:, None])
+    ascent = np.maximum(delta, 0.0)
+    descent = np.maximum(-delta, 0.0)
+    return RouteLegs(distance=distance, ascent=ascent, descent=descent, cost=distance + climb_factor * ascent)
+
+
+def nearest_neighbour_tour(cost: np.ndarray) -> np.ndarray:
+    """Greedy order starting at stop 0, as a closed tour ending back at 0."""
+    n = len(cost)
+    tour = np.zeros(n + 1, dtype=np.int64)
+    visited = np.zeros(n, dtype=bool)
+    visited[0] = True
+    current = 0
+    for position in range(1, n):
+        row = np.where(visited, np.inf, cost[current])
+        current = int(np.argmin(row))
+        visited[current] = True
+        tour[position] = current
+    return tour
+
+
+def _two_opt_move(tour: np.ndarray, cost: np.ndarray, invalid: np.ndarray) -> Optional[np.ndarray]:
+    """Best reversal of tour positions i+1..j, or None when no reversal shortens the tour."""
+    n = len(tour) - 1
+    # Costs between tour positions, so every candidate is a plain slice
+    ordered = cost[tour[:, None], tour[None, :]]
+    edges = np.diagonal(ordered, 1)
+    forward = np.concatenate([[0.0], np.cumsum(edges)])
+    backward = np.concatenate([[0.0], np.cumsum(np.diagonal(ordered, -1))])
+    delta = (
+        ordered[:n - 1, :n] + ordered[1:n, 1:n + 1]
+        - edges[:n - 1, None] - edges[None, :n]
+        + (backward[None, :n] - backward[1:n, None])
+        - (forward[None, :n] - forward[1:n, None])
+    )
+    delta[invalid] = np.inf
+    i, j = divmod(int(np.argmin(delta)), n)
+    if delta[i, j] >= -IMPROVEMENT_EPSILON:
+        return None
+    improved = tour.copy()
+    improved[i + 1:j + 1] = tour[i + 1:j + 1][::-1]
+    return improved
+
+
+def _or_opt_move(tour: np.ndarray, cost: np.ndarray) -> Optional[np.ndarray]:
+    """Best move of a run of up to OR_OPT_SEGMENT stops to another place in the tour, unreversed."""
+    n = len(tour) - 1
+    best_delta, best_tour = 0.0, None
+    p = np.arange(n)[None, :]
+    for length in range(1, min(OR_OPT_SEGMENT, n - 2) + 1):
+        s = np.arange(1, n - length + 1)[:, None]
+        e = s + length - 1
+        prev, first, last, after = tour[s - 1], tour[s], tour[e], tour[e + 1]
+        removed = cost[prev, first] + cost[last, after] - cost[prev, after]
+        inserted = cost[tour[p], first] + cost[last, tour[p + 1]] - cost[tour[p], tour[p + 1]]
+        delta = np.where((p < s - 1) | (p > e), inserted - removed, np.inf)
+        flat = int(np.argmin(delta))
+        row, col = divmod(flat, n)
+        if delta[row, col] < best_delta - IMPROVEMENT_EPSILON:
+            seg_start, seg_end, at = int(s[row, 0]), int(e[row, 0]), col
+            segment = tour[seg_start:seg_end + 1]
+            rest = np.concatenate([tour[:seg_start], tour[seg_end + 1:]])
+            # Edge (at, at + 1) moves left by the segment length if it was after it
+            at = at - length if at > seg_end else at
+            best_delta = float(delta[row, col])
+            best_tour = np.concatenate([rest[:at + 1], segment, rest[at + 1:]])
+    return best_tour
+
+
+def improve_tour(tour: np.ndarray, cost: np.ndarray) -> np.ndarray:
+    """
+    Improve a closed tour (tour[0] == tour[-1] == start) by local search.
+
+    Each step applies the best 2-opt reversal over the whole tour or, when
+    there is none, the best Or-opt segment move, until no move shortens it.
+    """
+    n = len(tour) - 1
+    if n < 3:
+        return tour
+
+    i = np.arange(n - 1)[:, None]
+    j = np.arange(n)[None, :]
+    invalid = (j < i + 2) | (j > n - 1)
+
+    while True:
+        # Reversals are cheaper to evaluate, so only look for Or-opt moves once 2-opt is done
+        improved = _two_opt_move(tour, cost, invalid)
+        if improved is None:
+            improved = _or_opt_move(tour, cost)
+        if improved is None:
+            break
+        tour = improved
+    return tour
+
+
+def plan_route(
+    lat: np.ndarray,
+    lon: np.ndarray,
+    asl: np.ndarray,
+    climb_factor: float,
+    return_to_start: bool,
+) -> tuple[np.ndarray, RouteLegs]:
+    """
+    Order stops 1..n-1 for a route starting at stop 0.
+
+    Returns:
+        tuple: Stop indices in visiting order (starting with 0, ending with 0
+            when returning to the start) and the leg matrices
+    """
+    legs = leg_matrices(lat, lon, asl, climb_factor)
+    cost = legs.cost.copy()
+    if not return_to_start:
+        cost[:, 0] = 0.0
+
+    tour = improve_tour(nearest_neighbour_tour(cost), cost)
+    return (tour if return_to_start else tour[:-1]), legs
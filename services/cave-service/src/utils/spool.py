@@ -0,0 +1,79 @@
+"""
+Uploaded files handed to background jobs.
+
+The job that processes an upload may run on any replica, so the file is
+stored in the database as rows of settings.job_spool_chunk_size bytes
+instead of on the disk of the replica that received it. The job copies it
+back into a local temporary file chunk by chunk, so neither side holds the
+whole file in memory.
+"""
+import logging
+import tempfile
+from datetime import datetime, timedelta
+from typing import BinaryIO
+from uuid import uuid4
+
+from fastapi import UploadFile
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from src.config.settings import settings
+from src.models.spool import SpoolChunk
+
+logger = logging.getLogger(__name__)
+
+
+async def spool_upload(session: AsyncSession, file: UploadFile) -> tuple[str, int]:
+    """
+    Store an uploaded file for a job.
+
+    Returns:
+        tuple: The spool id to pass in the job payload, and the file size in bytes
+    """
+    spool_id = uuid4().hex
+    seq = size = 0
+    while chunk := await file.read(settings.job_spool_chunk_size):
+        await session.execute(insert(SpoolChunk).values(spool_id=spool_id, seq=seq, data=chunk))
+        seq += 1
+        size += len(chunk)
+    await session.commit()
+    return spool_id, size
+
+
+async def open_spool(session: AsyncSession, spool_id: str) -> BinaryIO:
+    """
+    Copy a spooled file into a local temporary file, positioned at its start.
+
+    Raises:
+        FileNotFoundError: If nothing was spooled under spool_id
+    """
+    file = tempfile.TemporaryFile()
+    chunks = 0
+    try:
+        result = await session.stream(
+            select(SpoolChunk.data).where(SpoolChunk.spool_id == spool_id).order_by(SpoolChunk.seq)
+        )
+        async for data in result.scalars():
+            await run_in_threadpool(file.write, data)
+            chunks += 1
+    except BaseException:
+        file.close()
+        raise
+    if not chunks:
+        file.close()
+        raise FileNotFoundError(f"Spooled upload {spool_id} not found")
+    file.seek(0)
+    return file
+
+
+async def delete_spool(session: AsyncSession, spool_id: str) -> None:
+    """
+    Delete a spooled file, and spooled files older than settings.job_spool_ttl_hours
+    whose jobs were cancelled before they ran.
+    """
+    stale = datetime.utcnow() - timedelta(hours=settings.job_spool_ttl_hours)
+    await session.execute(
+        delete(SpoolChunk).where((SpoolChunk.spool_id == spool_id) | (SpoolChunk.created_at < stale))
+    )
+    await session.commit()
@@ -0,0 +1,326 @@
+"""
+Survey network reduction, loop closure and cave statistics.
+
+Shots are converted to east/north/up vectors in one vectorized step. Chains
+of stations with exactly two connections are collapsed into traverses
+between junctions (stations with one or three or more connections, and fixed
+points), so the least squares problem has one unknown per junction only:
+
+    minimize  sum_t  w_t * |X[end_t] - X[start_t] - v_t|^2
+
+with traverse vectors v_t and weights w_t = 1 / traverse length, which
+distributes loop misclosure in proportion to length. Fixed stations are held
+at their coordinates and every unconnected part of the network without one
+is anchored at its first station. Stations inside a traverse are then placed
+by spreading the traverse's closure error along it by cumulative length.
+"""
+import io
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from src.utils.survey_parsers import SURVEY_PARSERS, SurveyData, SurveyError
+
+# Traverses shorter than this (e.g. zero-length legs) get this weight length
+MIN_TRAVERSE_LENGTH = 0.001
+
+
+class _UnionFind:
+    def __init__(self):
+        self.parent: dict = {}
+
+    def find(self, item):
+        parent = self.parent.setdefault(item, item)
+        if parent != item:
+            parent = self.parent[item] = self.find(parent)
+        return parent
+
+    def union(self, a, b) -> None:
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[root_b] = root_a
+
+
+@dataclass
+class SurveyNetwork:
+    """Adjusted station positions and the centreline legs between them."""
+    station_names: list[str]
+    positions: np.ndarray      # (n, 3) east, north, up in metres
+    legs: np.ndarray           # (m, 2) station indices
+    leg_length: np.ndarray     # (m,) tape length in metres
+    leg_counted: np.ndarray    # (m,) legs counted towards the cave length
+    entrances: np.ndarray      # station indices of entrances
+    splays: int = 0
+    loops: int = 0
+    components: int = 0
+    max_adjustment: float = 0.0
+    warnings: list[str] = field(default_factory=list)
+    traverses: list[np.ndarray] = field(default_factory=list)  # station indices from junction to junction
+
+    def statistics(self) -> dict[str, float]:
+        """
+        Compute the cave's length, depth, vertical and horizontal extent.
+
+        Depth is measured from the highest entrance when entrances are
+        marked in the survey and equals the vertical extent otherwise.
+        """
+        z = self.positions[:, 2]
+        vertical_extent = float(z.max() - z.min()) if len(z) else 0.0
+        if self.entrances.size:
+            depth = float(z[self.entrances].max() - z.min())
+        else:
+            depth = vertical_extent
+        return {
+            "length": round(float(self.leg_length[self.leg_counted].sum()), 2),
+            "depth": round(depth, 2),
+            "vertical_extent": round(vertical_extent, 2),
+            "horizontal_extent": round(horizontal_extent(self.positions[:, :2]), 2),
+        }
+
+
+def shot_vectors(tape: np.ndarray, compass: np.ndarray, clino: np.ndarray) -> np.ndarray:
+    """Convert shots to (east, north, up) vectors; NaN compass means plumbed."""
+    inclination = np.radians(clino)
+    horizontal = tape * np.cos(inclination)
+    horizontal[np.isnan(compass) | (np.abs(clino) == 90.0)] = 0.0
+    bearing = np.radians(np.nan_to_num(compass))
+    return np.column_stack([horizontal * np.sin(bearing), horizontal * np.cos(bearing), tape * np.sin(inclination)])
+
+
+def _convex_hull(points: np.ndarray) -> np.ndarray:
+    """Andrew's monotone chain over unique 2D points."""
+    points = np.unique(points, axis=0)
+    if len(points) <= 2:
+        return points
+
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    lower: list = []
+    upper: list = []
+    for p in points:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], p) <= 0:
+            lower.pop()
+        lower.append(p)
+    for p in points[::-1]:
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], p) <= 0:
+            upper.pop()
+        upper.append(p)
+    return np.array(lower[:-1] + upper[:-1])
+
+
+def horizontal_extent(points: np.ndarray) -> float:
+    """Largest horizontal distance between two points, via the convex hull."""
+    if len(points) < 2:
+        return 0.0
+    hull = _convex_hull(points)
+    best = 0.0
+    # Pairwise distances over the hull only, in blocks to bound memory
+    for start in range(0, len(hull), 1024):
+        block = hull[start:start + 1024]
+        d2 = ((block[:, None, :] - hull[None, :, :]) ** 2).sum(axis=-1)
+        best = max(best, float(d2.max()))
+    return best ** 0.5
+
+
+def build_network(data: SurveyData) -> SurveyNetwork:
+    """Reduce the survey to junctions, solve the loops and place every station."""
+    warnings = list(data.warnings)
+    stations = _UnionFind()
+    for a, b in data.equates:
+        stations.union(a, b)
+
+    tape = np.asarray(data.tape, dtype=np.float64)
+    vectors = shot_vectors(tape, np.asarray(data.compass, dtype=np.float64), np.asarray(data.clino, dtype=np.float64))
+    splay = np.asarray(data.splay, dtype=bool)
+    counted = ~np.asarray(data.exclude_length, dtype=bool)
+
+    index: dict[str, int] = {}
+    names: list[str] = []
+
+    def station(name: str) -> int:
+        canonical = stations.find(name)
+        i = index.get(canonical)
+        if i is None:
+            i = index[canonical] = len(names)
+            names.append(canonical)
+        return i
+
+    shot_ids, leg_from, leg_to = [], [], []
+    for shot in np.flatnonzero(~splay):
+        a, b = station(data.from_station[shot]), station(data.to_station[shot])
+        if a == b:
+            continue
+        shot_ids.append(shot)
+        leg_from.append(a)
+        leg_to.append(b)
+
+    fixed = {station(name): np.asarray(coords, dtype=np.float64) for name, coords in data.fixes.items()}
+    entrances = np.array(sorted({index[stations.find(e)] for e in data.entrances if stations.find(e) in index}), dtype=np.int64)
+
+    n, m = len(names), len(shot_ids)
+    frm = np.asarray(leg_from, dtype=np.int64)
+    to = np.asarray(leg_to, dtype=np.int64)
+    leg_vectors = vectors[shot_ids] if m else np.zeros((0, 3))
+    leg_length = tape[shot_ids] if m else np.zeros(0)
+
+    # Incident legs of every station in CSR form
+    ends = np.concatenate([frm, to])
+    order = np.argsort(ends, kind="stable")
+    incident = np.concatenate([np.arange(m), np.arange(m)])[order]
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(ends, minlength=n))])
+    degree = np.diff(offsets)
+
+    junction = degree != 2
+    junction[list(fixed)] = True
+
+    # Collapse chains of degree-2 stations into traverses
+    visited = np.zeros(m, dtype=bool)
+    traverses: list[tuple[int, int, list[int], list[int], list[int]]] = []
+
+    def walk(start: int, leg: int) -> None:
+        path_stations, path_legs, signs = [start], [], []
+        current = start
+        while True:
+            visited[leg] = True
+            if frm[leg] == current:
+                following, sign = to[leg], 1
+            else:
+                following, sign = frm[leg], -1
+            path_legs.append(leg)
+            signs.append(sign)
+            path_stations.append(following)
+            if junction[following]:
+                break
+            first, second = incident[offsets[following]:offsets[following + 1]]
+            leg = second if first == leg else first
+            current = following
+        traverses.append((start, following, path_stations, path_legs, signs))
+
+    for j in np.flatnonzero(junction):
+        for leg in incident[offsets[j]:offsets[j + 1]]:
+            if not visited[leg]:
+                walk(j, leg)
+    # Closed rings without any junction
+    for leg in range(m):
+        if not visited[leg]:
+            junction[frm[leg]] = True
+            walk(frm[leg], leg)
+
+    # Connected parts of the junction graph
+    parts = _UnionFind()
+    for j in np.flatnonzero(junction):
+        parts.find(j)
+    for start, end, *_ in traverses:
+        parts.union(start, end)
+    roots: dict[int, list[int]] = {}
+    for j in np.flatnonzero(junction):
+        roots.setdefault(parts.find(j), []).append(int(j))
+
+    positions = np.zeros((n, 3))
+    known = np.zeros(n, dtype=bool)
+    for j, coords in fixed.items():
+        positions[j] = coords
+        known[j] = True
+    for members in roots.values():
+        if not any(known[j] for j in members):
+            known[members[0]] = True
+    if len(roots) > 1 and sum(1 for members in roots.values() if not any(j in fixed for j in members)) > 1:
+        warnings.append(f"Survey has {len(roots)} unconnected parts; each is placed at its own origin")
+
+    _solve_junctions(traverses, leg_vectors, leg_length, positions, known, junction)
+    max_adjustment = _place_traverse_stations(traverses, leg_vectors, leg_length, positions)
+
+    return SurveyNetwork(
+        station_names=names,
+        positions=positions,
+        legs=np.column_stack([frm, to]) if m else np.zeros((0, 2), dtype=np.int64),
+        leg_length=leg_length,
+        leg_counted=counted[shot_ids] if m else np.zeros(0, dtype=bool),
+        entrances=entrances,
+        splays=int(splay.sum()),
+        loops=len(traverses) - int(junction.sum()) + len(roots),
+        components=len(roots),
+        max_adjustment=round(max_adjustment, 3),
+        warnings=warnings,
+        traverses=[np.asarray(t[2], dtype=np.int64) for t in traverses],
+    )
+
+
+def _solve_junctions(traverses, leg_vectors, leg_length, positions, known, junction) -> None:
+    """
+    Weighted least squares for the junction positions via the normal
+    equations N x = r, built directly from the traverse list.
+    """
+    unknown = np.flatnonzero(junction & ~known)
+    if not len(unknown) or not traverses:
+        return
+    column = np.full(len(positions), -1)
+    column[unknown] = np.arange(len(unknown))
+
+    starts = np.array([t[0] for t in traverses])
+    ends = np.array([t[1] for t in traverses])
+    vectors = np.array([(leg_vectors[t[3]] * np.asarray(t[4])[:, None]).sum(axis=0) for t in traverses])
+    lengths = np.array([leg_length[t[3]].sum() for t in traverses])
+    weights = 1.0 / np.maximum(lengths, MIN_TRAVERSE_LENGTH)
+
+    # Move known endpoints to the right-hand side: X_end - X_start = v
+    s_col, e_col = column[starts], column[ends]
+    rhs_vectors = vectors.copy()
+    rhs_vectors[s_col < 0] += positions[starts[s_col < 0]]
+    rhs_vectors[e_col < 0] -= positions[ends[e_col < 0]]
+
+    size = len(unknown)
+    normal = np.zeros((size, size))
+    rhs = np.zeros((size, 3))
+    both = (s_col >= 0) & (e_col >= 0)
+    np.add.at(normal, (s_col[s_col >= 0], s_col[s_col >= 0]), weights[s_col >= 0])
+    np.add.at(normal, (e_col[e_col >= 0], e_col[e_col >= 0]), weights[e_col >= 0])
+    np.add.at(normal, (s_col[both], e_col[both]), -weights[both])
+    np.add.at(normal, (e_col[both], s_col[both]), -weights[both])
+    weighted = rhs_vectors * weights[:, None]
+    np.add.at(rhs, e_col[e_col >= 0], weighted[e_col >= 0])
+    np.add.at(rhs, s_col[s_col >= 0], -weighted[s_col >= 0])
+
+    try:
+        solution = np.linalg.solve(normal, rhs)
+    except np.linalg.LinAlgError:
+        solution = np.linalg.lstsq(normal, rhs, rcond=None)[0]
+    positions[unknown] = solution
+
+
+def _place_traverse_stations(traverses, leg_vectors, leg_length, positions) -> float:
+    """Place the stations inside each traverse; returns the largest closure correction."""
+    max_adjustment = 0.0
+    for start, end, path_stations, path_legs, signs in traverses:
+        steps = leg_vectors[path_legs] * np.asarray(signs)[:, None]
+        cumulative = np.cumsum(steps, axis=0)
+        error = positions[end] - positions[start] - cumulative[-1]
+        max_adjustment = max(max_adjustment, float(np.linalg.norm(error)))
+        if len(path_stations) <= 2:
+            continue
+        distance = np.cumsum(leg_length[path_legs])
+        if distance[-1] > 0:
+            fraction = distance / distance[-1]
+        else:
+            fraction = np.arange(1, len(path_legs) + 1) / len(path_legs)
+        inner = path_stations[1:-1]
+        positions[inner] = positions[start] + cumulative[:-1] + fraction[:-1, None] * error
+    return max_adjustment
+
+
+def process_survey(content: bytes, survey_format: str) -> SurveyNetwork:
+    """
+    Parse survey file content and solve its network.
+
+    Runs in a worker process for large files, so it only takes and returns
+    picklable values.
+    """
+    text = io.TextIOWrapper(io.BytesIO(content), encoding="utf-8", errors="replace")
+    data = SURVEY_PARSERS[survey_format](text)
+    if not len(data):
+        raise SurveyError("No survey shots found")
+    network = build_network(data)
+    if not len(network.legs):
+        raise SurveyError("No centreline legs found, only splays")
+    return network
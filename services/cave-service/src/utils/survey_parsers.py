@@ -0,0 +1,594 @@
+"""
+Streaming parsers for cave survey data.
+
+Survex (.svx), Therion (.th) and Compass (.dat) files are read line by line
+into a SurveyData: parallel lists of shots in metres and degrees, station
+equates, fixed points and entrance stations. Only the centreline is read;
+passage dimensions, team, dates and drawing data are skipped.
+
+Shots use one convention regardless of the source format: compass is the
+bearing in degrees clockwise from north with the declination applied (NaN
+for plumbed shots) and clino is the inclination in degrees, positive up.
+"""
+import math
+import os
+from dataclasses import dataclass, field
+from typing import Iterable, Literal, Optional
+
+SurveyFormat = Literal["survex", "therion", "compass"]
+
+SURVEY_FORMAT_EXTENSIONS = {
+    ".svx": "survex",
+    ".th": "therion",
+    ".dat": "compass",
+}
+
+# Anonymous stations used for splay shots
+SPLAY_STATIONS = {"-", ".", "..", "..."}
+
+LENGTH_UNITS = {
+    "metres": 1.0, "meters": 1.0, "metric": 1.0, "metre": 1.0, "meter": 1.0, "m": 1.0,
+    "centimetres": 0.01, "centimeters": 0.01, "cm": 0.01,
+    "feet": 0.3048, "foot": 0.3048, "ft": 0.3048,
+    "yards": 0.9144, "yard": 0.9144, "yd": 0.9144, "yds": 0.9144,
+    "inches": 0.0254, "inch": 0.0254, "in": 0.0254,
+}
+
+ANGLE_UNITS = {
+    "degrees": 1.0, "degree": 1.0, "degs": 1.0, "deg": 1.0,
+    "grads": 0.9, "grad": 0.9, "gons": 0.9, "gon": 0.9, "mils": 0.9,
+    "minutes": 1 / 60,
+}
+
+PERCENT_UNITS = {"percent", "percentage"}
+
+FEET = 0.3048
+
+# Names used for the same reading by Survex and Therion
+QUANTITY_ALIASES = {
+    "tape": "tape", "length": "tape",
+    "compass": "compass", "bearing": "compass",
+    "clino": "clino", "gradient": "clino",
+    "backcompass": "backcompass", "backbearing": "backcompass",
+    "backclino": "backclino", "backgradient": "backclino",
+    "fromdepth": "fromdepth", "todepth": "todepth",
+    "from": "from", "to": "to",
+    "ignore": "ignore", "ignoreall": "ignoreall",
+}
+
+DEFAULT_ORDERS = {
+    "normal": ["from", "to", "tape", "compass", "clino"],
+    "diving": ["from", "to", "tape", "compass", "fromdepth", "todepth"],
+}
+
+STYLE_ALIASES = {"normal": "normal", "topofil": "normal", "diving": "diving"}
+
+PLUMB_UP = {"up", "u", "+v", "v"}
+PLUMB_DOWN = {"down", "d", "-v"}
+
+
+class SurveyError(ValueError):
+    """Raised for survey data that cannot be parsed."""
+
+    def __init__(self, message: str, line_number: Optional[int] = None):
+        super().__init__(f"Line {line_number}: {message}" if line_number else message)
+
+
+@dataclass
+class SurveyData:
+    """Shots and station information read from a survey file."""
+    from_station: list[str] = field(default_factory=list)
+    to_station: list[str] = field(default_factory=list)
+    tape: list[float] = field(default_factory=list)
+    compass: list[float] = field(default_factory=list)
+    clino: list[float] = field(default_factory=list)
+    splay: list[bool] = field(default_factory=list)
+    exclude_length: list[bool] = field(default_factory=list)
+    equates: list[tuple[str, str]] = field(default_factory=list)
+    fixes: dict[str, tuple[float, float, float]] = field(default_factory=dict)
+    entrances: set[str] = field(default_factory=set)
+    warnings: list[str] = field(default_factory=list)
+
+    def add_shot(
+        self,
+        from_station: str,
+        to_station: str,
+        tape: float,
+        compass: float,
+        clino: float,
+        splay: bool = False,
+        exclude_length: bool = False,
+    ) -> None:
+        self.from_station.append(from_station)
+        self.to_station.append(to_station)
+        self.tape.append(tape)
+        self.compass.append(compass)
+        self.clino.append(clino)
+        self.splay.append(splay)
+        self.exclude_length.append(exclude_length)
+
+    def __len__(self) -> int:
+        return len(self.tape)
+
+
+def detect_survey_format(filename: Optional[str]) -> Optional[str]:
+    """Guess the survey format from a file name."""
+    if not filename:
+        return None
+    return SURVEY_FORMAT_EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+
+
+def _number(token: str, what: str, line_number: int) -> float:
+    try:
+        return float(token)
+    except ValueError:
+        raise SurveyError(f"Invalid {what} '{token}'", line_number)
+
+
+def _circular_mean(a: float, b: float) -> float:
+    """Average two bearings in degrees."""
+    x = math.cos(math.radians(a)) + math.cos(math.radians(b))
+    y = math.sin(math.radians(a)) + math.sin(math.radians(b))
+    return math.degrees(math.atan2(y, x)) % 360
+
+
+class _Readings:
+    """
+    Data format, units and calibration state shared by Survex and Therion.
+
+    Both formats scope these settings by block, so the parsers copy the
+    state on block entry and restore it on exit.
+    """
+
+    def __init__(self):
+        self.style: Optional[str] = "normal"
+        self.order = DEFAULT_ORDERS["normal"]
+        self.factors = {"tape": 1.0, "compass": 1.0, "clino": 1.0, "backcompass": 1.0, "backclino": 1.0, "depth": 1.0}
+        self.percent: set[str] = set()
+        self.zero_errors: dict[str, float] = {}
+        self.scales: dict[str, float] = {}
+        self.declination = 0.0
+
+    def copy(self) -> "_Readings":
+        other = _Readings.__new__(_Readings)
+        other.__dict__ = {
+            key: value.copy() if isinstance(value, (dict, set)) else value
+            for key, value in self.__dict__.items()
+        }
+        return other
+
+    def set_data(self, args: list[str], line_number: int) -> Optional[str]:
+        """Handle a data command; returns a warning for unsupported styles."""
+        if not args:
+            raise SurveyError("Data command without a style", line_number)
+        style = STYLE_ALIASES.get(args[0].lower())
+        if style is None:
+            self.style = None
+            return f"Line {line_number}: '{args[0]}' data style is not supported, its shots are skipped"
+
+        order = []
+        for token in args[1:]:
+            quantity = QUANTITY_ALIASES.get(token.lower())
+            if quantity is None:
+                if token.lower() in ("newline", "station"):
+                    self.style = None
+                    return f"Line {line_number}: multi-line data is not supported, its shots are skipped"
+                raise SurveyError(f"Unknown reading '{token}'", line_number)
+            order.append(quantity)
+
+        self.style = style
+        self.order = order or DEFAULT_ORDERS[style]
+        return None
+
+    def set_units(self, args: list[str], line_number: int) -> None:
+        """Handle 'units <quantities> [factor] <unit>'."""
+        if len(args) < 2:
+            raise SurveyError("Units command needs quantities and a unit", line_number)
+        unit = args[-1].lower()
+        factor = 1.0
+        quantities = args[:-1]
+        try:
+            factor = float(quantities[-1])
+            quantities = quantities[:-1]
+        except ValueError:
+            pass
+
+        for name in quantities:
+            quantity = QUANTITY_ALIASES.get(name.lower(), name.lower())
+            if quantity in ("fromdepth", "todepth", "depth"):
+                quantity = "depth"
+            if quantity not in self.factors:
+                continue
+            self.percent.discard(quantity)
+            if unit in LENGTH_UNITS and quantity in ("tape", "depth"):
+                self.factors[quantity] = factor * LENGTH_UNITS[unit]
+            elif unit in ANGLE_UNITS and quantity not in ("tape", "depth"):
+                self.factors[quantity] = factor * ANGLE_UNITS[unit]
+            elif unit in PERCENT_UNITS and quantity in ("clino", "backclino"):
+                self.factors[quantity] = factor
+                self.percent.add(quantity)
+            else:
+                raise SurveyError(f"Unsupported unit '{args[-1]}' for {name}", line_number)
+
+    def set_calibration(self, args: list[str], line_number: int) -> None:
+        """Handle 'calibrate <quantities> <zero error> [scale]'."""
+        numbers = []
+        while args and len(numbers) < 2:
+            try:
+                numbers.insert(0, float(args[-1]))
+                args = args[:-1]
+            except ValueError:
+                break
+        if not numbers or not args:
+            raise SurveyError("Calibrate command needs quantities and a zero error", line_number)
+
+        for name in args:
+            quantity = QUANTITY_ALIASES.get(name.lower(), name.lower())
+            if quantity == "declination":
+                self.declination = -numbers[0]
+                continue
+            self.zero_errors[quantity] = numbers[0]
+            if len(numbers) > 1:
+                self.scales[quantity] = numbers[1]
+
+    def _value(self, quantity: str, token: str, line_number: int) -> float:
+        reading = _number(token, quantity, line_number)
+        reading = (reading - self.zero_errors.get(quantity, 0.0)) * self.scales.get(quantity, 1.0)
+        if quantity in self.percent:
+            return math.degrees(math.atan(reading * self.factors[quantity] / 100))
+        return reading * self.factors[quantity]
+
+    def _compass(self, quantity: str, token: str, line_number: int) -> float:
+        if token == "-":
+            return math.nan
+        return self._value(quantity, token, line_number)
+
+    def _clino(self, quantity: str, token: str, line_number: int) -> Optional[float]:
+        lowered = token.lower()
+        if lowered in PLUMB_UP:
+            return 90.0
+        if lowered in PLUMB_DOWN:
+            return -90.0
+        if lowered in ("-", "level", "h"):
+            return 0.0
+        return self._value(quantity, token, line_number)
+
+    def parse_shot(self, tokens: list[str], line_number: int) -> tuple[str, str, float, float, float]:
+        """Turn a data line into (from, to, tape, compass, clino)."""
+        values: dict[str, str] = {}
+        position = 0
+        for quantity in self.order:
+            if quantity == "ignoreall":
+                position = len(tokens)
+                break
+            if position >= len(tokens):
+                raise SurveyError(f"Expected {len(self.order)} readings, got {len(tokens)}", line_number)
+            if quantity != "ignore":
+                values[quantity] = tokens[position]
+            position += 1
+
+        tape = self._value("tape", values["tape"], line_number)
+        compass = self._compass("compass", values["compass"], line_number) if "compass" in values else math.nan
+        if "backcompass" in values:
+            back = self._compass("backcompass", values["backcompass"], line_number)
+            if not math.isnan(back):
+                back = (back + 180) % 360
+                compass = back if math.isnan(compass) else _circular_mean(compass, back)
+
+        if self.style == "diving":
+            from_depth = _number(values["fromdepth"], "depth", line_number) * self.factors["depth"]
+            to_depth = _number(values["todepth"], "depth", line_number) * self.factors["depth"]
+            rise = from_depth - to_depth
+            clino = math.degrees(math.asin(max(-1.0, min(1.0, rise / tape)))) if tape else 0.0
+        else:
+            clino = self._clino("clino", values["clino"], line_number) if "clino" in values else None
+            if "backclino" in values:
+                back = self._clino("backclino", values["backclino"], line_number)
+                clino = -back if clino is None else (clino - back) / 2
+            if clino is None:
+                clino = 0.0
+
+        if math.isnan(compass) and abs(clino) != 90.0 and tape != 0:
+            raise SurveyError("Missing compass reading on a shot that is not plumbed", line_number)
+        if not math.isnan(compass):
+            compass = (compass + self.declination) % 360
+        return values["from"], values["to"], tape, compass, clino
+
+
+# --- Survex ---
+
+def parse_survex(lines: Iterable[str]) -> SurveyData:
+    """Parse Survex .svx data."""
+    data = SurveyData()
+    prefix: list[str] = []
+    readings = _Readings()
+    flags: set[str] = set()
+    stack: list[tuple[list[str], _Readings, set[str]]] = []
+
+    def qualify(station: str) -> str:
+        if station.startswith("\\"):
+            return station[1:]
+        return ".".join(prefix + [station])
+
+    for line_number, raw in enumerate(lines, 1):
+        line = raw.split(";", 1)[0].strip()
+        if not line:
+            continue
+
+        if line.startswith("*"):
+            command, *args = line[1:].split()
+            command = command.lower()
+            if command == "begin":
+                stack.append((prefix, readings, flags))
+                prefix, readings, flags = list(prefix), readings.copy(), set(flags)
+                if args:
+                    prefix.extend(args[0].split("."))
+            elif command == "end":
+                if not stack:
+                    raise SurveyError("*end without *begin", line_number)
+                prefix, readings, flags = stack.pop()
+            elif command == "data":
+                warning = readings.set_data(args, line_number)
+                if warning:
+                    data.warnings.append(warning)
+            elif command == "units":
+                readings.set_units(args, line_number)
+            elif command == "calibrate":
+                readings.set_calibration(args, line_number)
+            elif command == "declination":
+                if args and args[0].lower() == "auto":
+                    data.warnings.append(f"Line {line_number}: automatic declination is not supported, using 0")
+                    readings.declination = 0.0
+                elif args:
+                    unit = ANGLE_UNITS.get(args[1].lower(), 1.0) if len(args) > 1 else 1.0
+                    readings.declination = _number(args[0], "declination", line_number) * unit
+            elif command == "fix":
+                if not args:
+                    raise SurveyError("*fix without a station", line_number)
+                coordinates = [a for a in args[1:] if a.lower() != "reference"][:3]
+                if len(coordinates) == 3:
+                    data.fixes[qualify(args[0])] = tuple(_number(c, "coordinate", line_number) for c in coordinates)
+                else:
+                    data.fixes[qualify(args[0])] = (0.0, 0.0, 0.0)
+            elif command == "equate":
+                names = [qualify(a) for a in args]
+                data.equates.extend((names[0], other) for other in names[1:])
+            elif command == "entrance":
+                data.entrances.update(qualify(a) for a in args)
+            elif command == "flags":
+                negate = False
+                for flag in (a.lower() for a in args):
+                    if flag == "not":
+                        negate = True
+                        continue
+                    (flags.discard if negate else flags.add)(flag)
+                    negate = False
+            elif command == "include":
+                data.warnings.append(f"Line {line_number}: included file {' '.join(args)} was not processed")
+            continue
+
+        if readings.style is None:
+            continue
+
+        from_station, to_station, tape, compass, clino = readings.parse_shot(line.split(), line_number)
+        splay = "splay" in flags or from_station in SPLAY_STATIONS or to_station in SPLAY_STATIONS
+        data.add_shot(
+            qualify(from_station) if from_station not in SPLAY_STATIONS else from_station,
+            qualify(to_station) if to_station not in SPLAY_STATIONS else to_station,
+            tape, compass, clino,
+            splay=splay,
+            exclude_length=bool(flags & {"duplicate", "surface"}),
+        )
+
+    if stack:
+        data.warnings.append(f"{len(stack)} *begin block(s) not closed with *end")
+    return data
+
+
+# --- Therion ---
+
+THERION_SKIPPED_BLOCKS = {
+    "scrap": "endscrap", "map": "endmap", "surface": "endsurface",
+    "layout": "endlayout", "lookup": "endlookup",
+}
+
+# Centreline metadata commands that carry no shot data
+THERION_COMMANDS = {
+    "team", "date", "explo-date", "explo-team", "instrument", "infer", "grade",
+    "sd", "mark", "break", "walls", "vthreshold", "cs", "copyright", "title",
+    "extend", "station-names", "author", "id", "endcentreline", "endcenterline",
+}
+
+
+def parse_therion(lines: Iterable[str]) -> SurveyData:
+    """Parse Therion .th data."""
+    data = SurveyData()
+    prefix: list[str] = []
+    readings = _Readings()
+    flags: set[str] = set()
+    in_centreline = False
+    skip_until: Optional[str] = None
+    groups: list[tuple[_Readings, set[str]]] = []
+
+    def qualify(station: str) -> str:
+        name, _, path = station.partition("@")
+        surveys = list(reversed(path.split("."))) if path else []
+        return ".".join(prefix + surveys + [name])
+
+    for line_number, raw in enumerate(lines, 1):
+        line = raw.split("#", 1)[0].strip()
+        if not line:
+            continue
+        tokens = line.split()
+        command = tokens[0].lower()
+        args = tokens[1:]
+
+        if skip_until is not None:
+            if command == skip_until:
+                skip_until = None
+            continue
+
+        if not in_centreline:
+            if command == "survey":
+                if not args:
+                    raise SurveyError("Survey without a name", line_number)
+                prefix.append(args[0])
+            elif command == "endsurvey":
+                if not prefix:
+                    raise SurveyError("endsurvey without survey", line_number)
+                prefix.pop()
+            elif command in ("centreline", "centerline"):
+                in_centreline = True
+                readings, flags = _Readings(), set()
+            elif command == "equate":
+                names = [qualify(a) for a in args]
+                data.equates.extend((names[0], other) for other in names[1:])
+            elif command in THERION_SKIPPED_BLOCKS:
+                skip_until = THERION_SKIPPED_BLOCKS[command]
+            elif command == "input":
+                data.warnings.append(f"Line {line_number}: input file {' '.join(args)} was not processed")
+            continue
+
+        if command in ("endcentreline", "endcenterline"):
+            in_centreline = False
+        elif command == "data":
+            warning = readings.set_data(args, line_number)
+            if warning:
+                data.warnings.append(warning)
+        elif command == "units":
+            readings.set_units(args, line_number)
+        elif command == "calibrate":
+            readings.set_calibration(args, line_number)
+        elif command == "declination":
+            if args and args[0] != "-":
+                unit = ANGLE_UNITS.get(args[1].lower(), 1.0) if len(args) > 1 else 1.0
+                readings.declination = _number(args[0], "declination", line_number) * unit
+        elif command == "fix":
+            if len(args) < 4:
+                raise SurveyError("fix needs a station and three coordinates", line_number)
+            data.fixes[qualify(args[0])] = tuple(_number(c, "coordinate", line_number) for c in args[1:4])
+        elif command == "equate":
+            names = [qualify(a) for a in args]
+            data.equates.extend((names[0], other) for other in names[1:])
+        elif command == "station":
+            if args and "entrance" in (a.lower() for a in args[1:]):
+                data.entrances.add(qualify(args[0]))
+        elif command == "flags":
+            negate = False
+            for flag in (a.lower() for a in args):
+                if flag == "not":
+                    negate = True
+                    continue
+                (flags.discard if negate else flags.add)(flag)
+                negate = False
+        elif command == "group":
+            groups.append((readings.copy(), set(flags)))
+        elif command == "endgroup":
+            if groups:
+                readings, flags = groups.pop()
+        elif command in THERION_COMMANDS:
+            continue
+        elif readings.style is not None:
+            try:
+                from_station, to_station, tape, compass, clino = readings.parse_shot(tokens, line_number)
+            except SurveyError:
+                if command.replace("-", "").isalpha() and len(tokens) < len(readings.order):
+                    data.warnings.append(f"Line {line_number}: unknown command '{tokens[0]}' skipped")
+                    continue
+                raise
+            splay = "splay" in flags or from_station in SPLAY_STATIONS or to_station in SPLAY_STATIONS
+            data.add_shot(
+                qualify(from_station) if from_station not in SPLAY_STATIONS else from_station,
+                qualify(to_station) if to_station not in SPLAY_STATIONS else to_station,
+                tape, compass, clino,
+                splay=splay,
+                exclude_length=bool(flags & {"duplicate", "surface"}),
+            )
+
+    if in_centreline:
+        data.warnings.append("centreline block not closed with endcentreline")
+    return data
+
+
+
+# --- Compass ---
+
+COMPASS_MISSING = -900.0
+
+
+def parse_compass(lines: Iterable[str]) -> SurveyData:
+    """
+    Parse Compass .dat data.
+
+    Compass always stores lengths in decimal feet and angles in degrees,
+    whatever the display format; surveys are separated by form feeds.
+    """
+    data = SurveyData()
+    columns: Optional[list[str]] = None
+    declination = 0.0
+
+    for line_number, raw in enumerate(lines, 1):
+        line = raw.replace("\x1a", "")
+        if "\x0c" in line:
+            columns = None
+            line = line.replace("\x0c", "")
+        stripped = line.strip()
+        if not stripped:
+            continue
+
+        if columns is None:
+            upper = stripped.upper()
+            if upper.startswith("DECLINATION:"):
+                declination = _number(upper.split()[1], "declination", line_number)
+            elif upper.startswith("FROM") and " TO " in f" {upper} ":
+                columns = upper.split()
+            continue
+
+        tokens = stripped.split()
+        if len(tokens) < 5:
+            raise SurveyError("Expected at least FROM TO LENGTH BEARING INC", line_number)
+
+        shot_flags = ""
+        for token in tokens[5:]:
+            if token.startswith("#|"):
+                shot_flags = token[2:].rstrip("#").upper()
+                break
+        if "X" in shot_flags:
+            continue
+
+        tape = _number(tokens[2], "length", line_number) * FEET
+        bearing = _number(tokens[3], "bearing", line_number)
+        inc = _number(tokens[4], "inclination", line_number)
+        bearing = math.nan if bearing < COMPASS_MISSING else bearing
+        inc = math.nan if inc < COMPASS_MISSING else inc
+
+        if "AZM2" in columns:
+            index = columns.index("AZM2")
+            if index + 1 < len(tokens) and not tokens[index].startswith("#"):
+                back_bearing = _number(tokens[index], "backsight bearing", line_number)
+                back_inc = _number(tokens[index + 1], "backsight inclination", line_number)
+                if back_bearing > COMPASS_MISSING:
+                    back_bearing = (back_bearing + 180) % 360
+                    bearing = back_bearing if math.isnan(bearing) else _circular_mean(bearing, back_bearing)
+                if back_inc > COMPASS_MISSING:
+                    inc = -back_inc if math.isnan(inc) else (inc - back_inc) / 2
+
+        inc = 0.0 if math.isnan(inc) else inc
+        if abs(inc) == 90.0:
+            bearing = math.nan
+        elif math.isnan(bearing):
+            if tape != 0:
+                raise SurveyError("Missing bearing on a shot that is not vertical", line_number)
+        else:
+            bearing = (bearing + declination) % 360
+
+        data.add_shot(tokens[0], tokens[1], tape, bearing, inc, exclude_length="L" in shot_flags)
+
+    return data
+
+
+SURVEY_PARSERS = {
+    "survex": parse_survex,
+    "therion": parse_therion,
+    "compass": parse_compass,
+}
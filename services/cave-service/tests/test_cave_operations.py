@@ -0,0 +1,64 @@
+"""Deleting a cave keeps the media files other caves still link to."""
+import asyncio
+import os
+
+os.environ.setdefault("DB_URL", "sqlite+aiosqlite://")
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.future import select
+
+from src.models.base import Base
+from src.models.cave import Cave, CaveMedia
+from src.utils import cave_operations
+
+
+class RecordingPublisher:
+    def __init__(self):
+        self.deleted = []
+
+    async def publish_cave_deleted(self, cave_id, cave_name, owner_email, media_file_ids=None):
+        self.deleted.append((cave_id, sorted(media_file_ids or [])))
+
+
+async def _no_bump():
+    pass
+
+
+async def _delete_one_of_two_caves(monkeypatch):
+    publisher = RecordingPublisher()
+    monkeypatch.setattr(cave_operations, "publisher", publisher)
+    # The catalogue version upsert is PostgreSQL-specific
+    monkeypatch.setattr(cave_operations, "bump_data_version", _no_bump)
+
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+    async with session_factory() as session:
+        session.add_all([
+            Cave(cave_id=1, name="Upload cave", owner_email="a@b.c"),
+            Cave(cave_id=2, name="Nearest cave", owner_email="a@b.c"),
+        ])
+        await session.flush()
+        session.add_all([
+            # Photo 10 was uploaded to cave 1 and linked to cave 2 from its GPS position
+            CaveMedia(cave_id=1, media_file_id=10, added_by="a@b.c"),
+            CaveMedia(cave_id=2, media_file_id=10, added_by="media-service"),
+            CaveMedia(cave_id=1, media_file_id=11, added_by="a@b.c"),
+        ])
+        await session.commit()
+
+        assert await cave_operations.delete_cave_by_id(session, 1)
+        remaining = (await session.execute(select(CaveMedia.cave_id, CaveMedia.media_file_id))).all()
+
+    await engine.dispose()
+    return publisher.deleted, remaining
+
+
+def test_deleting_one_cave_keeps_photo_linked_to_another(monkeypatch):
+    deleted, remaining = asyncio.run(_delete_one_of_two_caves(monkeypatch))
+
+    # Only the photo no other cave links to is handed to media-service for deletion
+    assert deleted == [(1, [11])]
+    assert remaining == [(2, 10)]
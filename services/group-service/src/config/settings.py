@@ -5,6 +5,12 @@ class Settings(BaseSettings):
     db_url: Optional[str] = None
     rabbitmq_url: Optional[str] = None
 
+    # Background jobs: durable RabbitMQ queue and number of jobs run at once per replica
+    job_queue: str = "group-service.jobs"
+    job_concurrency: int = 2
+    # Jobs still queued or running this long after they were created or started are queued again at startup
+    job_stale_minutes: int = 120
+
     class Config:
         env_file = ".env"
         extra = "ignore"
@@ -1,8 +1,11 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from src.routes import groups, members, invitations, applications, caves
+from src.routes import groups, members, invitations, applications, caves, jobs
 from src.db.connection import init_db
+from src.utils.compression import CompressionMiddleware
 from src.utils.rabbitmq_consumer import start_rabbitmq_consumer, stop_rabbitmq_consumer
+from src.utils.jobs import job_runner
+from src.utils.job_handlers import register_job_handlers
 import asyncio
 
 from contextlib import asynccontextmanager
@@ -32,6 +35,18 @@ async def init_db_with_retry():
 async def lifespan(app: FastAPI):
     await init_db_with_retry()
 
+    # Start the background job runner; without RabbitMQ jobs run in-process
+    register_job_handlers(job_runner)
+    try:
+        await job_runner.start()
+        print("✓ Job runner started successfully")
+    except Exception as e:
+        print(f"⚠ Failed to start job runner, running jobs in-process: {str(e)[:100]}")
+    try:
+        await job_runner.requeue_stale()
+    except Exception as e:
+        print(f"⚠ Failed to requeue stale jobs: {str(e)[:100]}")
+
     # Start RabbitMQ consumer
     try:
         await start_rabbitmq_consumer()
@@ -49,6 +64,9 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         print(f"⚠ Error stopping RabbitMQ consumer: {str(e)[:100]}")
 
+    await job_runner.stop()
+    print("✓ Job runner stopped")
+
 app = FastAPI(
     title="Group Service API", 
     lifespan=lifespan,
@@ -64,6 +82,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress responses according to Accept-Encoding (br, gzip)
+app.add_middleware(CompressionMiddleware, minimum_size=500)
+
 # Root health check for debugging
 @app.get("/health")
 def root_health():
@@ -72,6 +93,7 @@ def root_health():
 # Group management routes
 # IMPORTANT: Register routers with specific paths BEFORE catch-all {group_id} routes
 # to avoid path conflicts (e.g., /invitations/me vs /{group_id})
+app.include_router(jobs.router, prefix="/groups/jobs", tags=["Jobs"])
 app.include_router(invitations.router, prefix="/groups", tags=["Invitations"])
 app.include_router(applications.router, prefix="/groups", tags=["Applications"])
 app.include_router(members.router, prefix="/groups", tags=["Members"])
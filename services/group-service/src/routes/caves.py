@@ -1,6 +1,6 @@
 from sqlalchemy import delete
 from src.models.group import Group, GroupMember, GroupCave
-from src.schemas.group import CaveAssign, CaveAssignmentRead, CaveGroupInfo, MemberRole
+from src.schemas.group import CaveAssign, CaveAssignmentRead, CaveGroupInfo, CaveGroupsBatchRequest, MemberRole
 from src.auth import User, require_auth, require_internal_service
 from src.routes.groups import get_group_or_404, get_user_membership, require_group_admin, fetch_usernames
 
@@ -205,6 +205,41 @@ async def check_cave_permissions(
     return {"can_edit": False}
 
 
+# --- Get groups for several caves (called by cave service) ---
+@router.post("/caves/groups/batch", response_model=dict[int, list[CaveGroupInfo]])
+async def get_cave_groups_batch(
+    request: CaveGroupsBatchRequest,
+    session: AsyncSession = Depends(get_session),
+    user: User = Depends(require_internal_service)
+):
+    """Get the active groups of several caves in one query. Requires service authentication."""
+    if not request.cave_ids:
+        return {}
+
+    result = await session.execute(
+        select(GroupCave, Group)
+        .join(Group, GroupCave.group_id == Group.group_id)
+        .where(GroupCave.cave_id.in_(request.cave_ids), Group.is_active == True)
+        .order_by(GroupCave.assigned_at.desc())
+    )
+    assignments = result.all()
+
+    emails = list({gc.assigned_by for gc, _ in assignments})
+    usernames_map = await fetch_usernames(emails)
+
+    groups_by_cave: dict[int, list[CaveGroupInfo]] = {cave_id: [] for cave_id in request.cave_ids}
+    for group_cave, group in assignments:
+        groups_by_cave[group_cave.cave_id].append(CaveGroupInfo(
+            group_id=group.group_id,
+            group_name=group.name,
+            group_description=group.description,
+            assigned_at=group_cave.assigned_at,
+            assigned_by=usernames_map.get(group_cave.assigned_by, group_cave.assigned_by.split('@')[0])
+        ))
+
+    return groups_by_cave
+
+
 # --- Delete all assignments for a cave (called by cave service) ---
 @router.delete("/caves/{cave_id}/assignments")
 async def delete_cave_assignments(
@@ -192,6 +192,11 @@ class CaveGroupInfo(BaseModel):
         from_attributes = True
 
 
+class CaveGroupsBatchRequest(BaseModel):
+    """Request for the groups of several caves at once."""
+    cave_ids: list[int]
+
+
 # ============ Application Schemas ============
 
 class ApplicationCreate(BaseModel):
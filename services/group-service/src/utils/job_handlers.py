@@ -0,0 +1,20 @@
+"""
+Background job handlers of group-service.
+
+    user_deletion  Transfer or delete the groups of a deleted user
+"""
+from typing import Any
+from src.utils.user_deletion_handler import UserDeletionHandler
+from src.utils.jobs import JobContext, JobRunner
+
+
+async def user_deletion_job(context: JobContext, payload: dict[str, Any]) -> None:
+    """Run the group ownership cascade for a deleted user."""
+    async def on_progress(handled: int, total: int) -> None:
+        await context.progress(handled, total)
+
+    await UserDeletionHandler().handle_user_deletion(payload["email"], payload.get("user_id"), on_progress=on_progress)
+
+
+def register_job_handlers(runner: JobRunner) -> None:
+    runner.register("user_deletion", user_deletion_job)
@@ -5,7 +5,7 @@ from typing import Optional, Dict, Any, Callable, Awaitable
 import aio_pika
 from aio_pika import connect_robust, ExchangeType
 from src.config.settings import settings
-from src.utils.user_deletion_handler import UserDeletionHandler
+from src.utils.jobs import job_runner
 from src.utils.cave_deletion_handler import CaveDeletionHandler
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
@@ -22,18 +22,16 @@ class MessageHandler:
 class UserDeletionMessageHandler(MessageHandler):
     """Handler for user deletion events"""
 
-    def __init__(self):
-        self.deletion_handler = UserDeletionHandler()
-
     async def handle(self, event_data: Dict[str, Any]) -> None:
-        """Handle user deletion event"""
+        """Queue a job transferring or deleting the deleted user's groups"""
         user_email = event_data.get('email')
         user_id = event_data.get('userId')
 
         if not user_email:
             raise ValueError("User deletion event missing email field")
 
-        await self.deletion_handler.handle_user_deletion(user_email, user_id)
+        job = await job_runner.submit("user_deletion", {"email": user_email, "user_id": user_id})
+        logger.info(f"Queued user deletion job {job.job_id} for {user_email}")
 
 
 class CaveDeletionMessageHandler(MessageHandler):
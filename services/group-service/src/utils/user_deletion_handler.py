@@ -1,3 +1,4 @@
+from typing import Awaitable, Callable, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import and_, select
 from src.models.group import Group, GroupMember, GroupCave, MemberRole
@@ -8,13 +9,19 @@ logger = logging.getLogger(__name__)
 
 class UserDeletionHandler:
 
-    async def handle_user_deletion(self, user_email: str, user_id: str = None):
+    async def handle_user_deletion(
+        self,
+        user_email: str,
+        user_id: str = None,
+        on_progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+    ):
         """
         Handle user deletion by managing group ownership transfers and deletions.
 
         Args:
             user_email: Email of the deleted user
             user_id: ID of the deleted user (optional, for future use)
+            on_progress: Awaited with (handled, total) after every owned group
         """
         async with async_session() as db:
             try:
@@ -33,8 +40,10 @@ class UserDeletionHandler:
 
                 logger.info(f"Found {len(owned_groups)} groups owned by {user_email}")
 
-                for group in owned_groups:
+                for handled, group in enumerate(owned_groups, start=1):
                     await self._handle_group_ownership_transfer(db, group, user_email)
+                    if on_progress is not None:
+                        await on_progress(handled, len(owned_groups))
 
                 # Remove the user from all group memberships (including ones where they weren't owner)
                 stmt = select(GroupMember).where(GroupMember.user_email == user_email)
@@ -21,7 +21,8 @@ if config.config_file_name is not None:
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from src.models.base import Base
-from src.models.media import MediaFile, MediaMetadata
+from src.models.media import MediaFile, MediaMetadata, MediaDerivative, TilePyramid, UploadSession
+from src.models.job import Job
 target_metadata = Base.metadata
 
 
@@ -0,0 +1,47 @@
+"""Add resumable upload sessions table
+
+Revision ID: 003_upload_sessions
+Revises: 002_jobs
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '003_upload_sessions'
+down_revision: Union[str, Sequence[str], None] = '002_jobs'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('upload_sessions',
+        sa.Column('upload_id', sa.String(), nullable=False),
+        sa.Column('blob_name', sa.String(), nullable=False),
+        sa.Column('original_filename', sa.String(), nullable=False),
+        sa.Column('content_type', sa.String(), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('received_bytes', sa.BigInteger(), nullable=False),
+        sa.Column('block_count', sa.Integer(), nullable=False),
+        sa.Column('cave_id', sa.Integer(), nullable=False),
+        sa.Column('owner_email', sa.String(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('media_file_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['media_file_id'], ['media_files.id'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('upload_id'),
+        sa.UniqueConstraint('blob_name')
+    )
+    op.create_index(op.f('ix_upload_sessions_owner_email'), 'upload_sessions', ['owner_email'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_upload_sessions_owner_email'), table_name='upload_sessions')
+    op.drop_table('upload_sessions')
@@ -0,0 +1,30 @@
+"""Add direct-to-storage mode to upload sessions
+
+Revision ID: 004_direct_uploads
+Revises: 003_upload_sessions
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '004_direct_uploads'
+down_revision: Union[str, Sequence[str], None] = '003_upload_sessions'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('upload_sessions', sa.Column('mode', sa.String(), nullable=False, server_default='resumable'))
+    op.add_column('upload_sessions', sa.Column('sha256', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('upload_sessions', 'sha256')
+    op.drop_column('upload_sessions', 'mode')
@@ -0,0 +1,47 @@
+"""Add image derivatives table
+
+Revision ID: 005_media_derivatives
+Revises: 004_direct_uploads
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '005_media_derivatives'
+down_revision: Union[str, Sequence[str], None] = '004_direct_uploads'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('media_derivatives',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('media_file_id', sa.Integer(), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=False),
+        sa.Column('format', sa.String(), nullable=False),
+        sa.Column('blob_name', sa.String(), nullable=False),
+        sa.Column('content_type', sa.String(), nullable=False),
+        sa.Column('width', sa.Integer(), nullable=False),
+        sa.Column('height', sa.Integer(), nullable=False),
+        sa.Column('file_size', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['media_file_id'], ['media_files.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('blob_name'),
+        sa.UniqueConstraint('media_file_id', 'size', 'format')
+    )
+    op.create_index(op.f('ix_media_derivatives_id'), 'media_derivatives', ['id'], unique=False)
+    op.create_index(op.f('ix_media_derivatives_media_file_id'), 'media_derivatives', ['media_file_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_media_derivatives_media_file_id'), table_name='media_derivatives')
+    op.drop_index(op.f('ix_media_derivatives_id'), table_name='media_derivatives')
+    op.drop_table('media_derivatives')
@@ -0,0 +1,46 @@
+"""Add tile pyramids table
+
+Revision ID: 006_tile_pyramids
+Revises: 005_media_derivatives
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '006_tile_pyramids'
+down_revision: Union[str, Sequence[str], None] = '005_media_derivatives'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('media_tile_pyramids',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('media_file_id', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('width', sa.Integer(), nullable=True),
+        sa.Column('height', sa.Integer(), nullable=True),
+        sa.Column('tile_size', sa.Integer(), nullable=False),
+        sa.Column('max_zoom', sa.Integer(), nullable=True),
+        sa.Column('format', sa.String(), nullable=True),
+        sa.Column('tile_count', sa.Integer(), nullable=False),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('completed_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['media_file_id'], ['media_files.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('media_file_id')
+    )
+    op.create_index(op.f('ix_media_tile_pyramids_id'), 'media_tile_pyramids', ['id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_media_tile_pyramids_id'), table_name='media_tile_pyramids')
+    op.drop_table('media_tile_pyramids')
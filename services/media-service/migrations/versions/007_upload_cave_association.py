@@ -0,0 +1,28 @@
+"""Add nearest-cave association radius to upload sessions
+
+Revision ID: 007_upload_cave_association
+Revises: 006_tile_pyramids
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '007_upload_cave_association'
+down_revision: Union[str, Sequence[str], None] = '006_tile_pyramids'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('upload_sessions', sa.Column('associate_within_m', sa.Float(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('upload_sessions', 'associate_within_m')
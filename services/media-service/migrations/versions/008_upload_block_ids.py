@@ -0,0 +1,28 @@
+"""Record the staged block ids of resumable uploads
+
+Revision ID: 008_upload_block_ids
+Revises: 007_upload_cave_association
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '008_upload_block_ids'
+down_revision: Union[str, Sequence[str], None] = '007_upload_cave_association'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('upload_sessions', sa.Column('block_ids', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('upload_sessions', 'block_ids')
@@ -0,0 +1,30 @@
+"""Widen job progress counters
+
+Revision ID: 009_job_progress_bigint
+Revises: 008_upload_block_ids
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '009_job_progress_bigint'
+down_revision: Union[str, Sequence[str], None] = '008_upload_block_ids'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.alter_column('jobs', 'progress_done', type_=sa.BigInteger(), existing_type=sa.Integer(), existing_nullable=False)
+    op.alter_column('jobs', 'progress_total', type_=sa.BigInteger(), existing_type=sa.Integer(), existing_nullable=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.alter_column('jobs', 'progress_total', type_=sa.Integer(), existing_type=sa.BigInteger(), existing_nullable=True)
+    op.alter_column('jobs', 'progress_done', type_=sa.Integer(), existing_type=sa.BigInteger(), existing_nullable=False)
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Literal, Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -14,6 +14,67 @@ class Settings(BaseSettings):
     # Service settings
     service_token: Optional[str] = None
 
+    # Background jobs: durable RabbitMQ queue and number of jobs run at once per replica
+    job_queue: str = "media-service.jobs"
+    job_concurrency: int = 2
+    # Jobs still queued or running this long after they were created or started are queued again at startup
+    job_stale_minutes: int = 120
+
+    # How /image and /download deliver files unless the request asks otherwise:
+    # "redirect" to a signed blob URL or "proxy" the bytes through the service
+    media_delivery: Literal["redirect", "proxy"] = "redirect"
+    # Signed delivery URLs stay the same for windows of this many hours, so browsers can cache them
+    delivery_sas_hours: int = 24
+
+    # Blob downloads are fetched and forwarded in pieces of this size
+    download_chunk_size: int = 4 * 1024 * 1024
+
+    # Worker processes for CPU-bound image processing
+    process_pool_workers: int = 2
+
+    # Longest edge in pixels of the downscaled copies made of uploaded images
+    image_derivative_sizes: list[int] = [256, 1024, 2048]
+    image_jpeg_quality: int = 82
+    # Formats also offered to clients whose Accept header lists them, most preferred first
+    image_formats: list[Literal["avif", "webp"]] = ["avif", "webp"]
+    image_webp_quality: int = 80
+    image_avif_quality: int = 60
+    # Images with more pixels than this are not decoded
+    image_max_pixels: int = 250_000_000
+
+    # Metadata is read from stored files in ranged requests of this size; the backfill reads this many files at once
+    metadata_read_block_size: int = 64 * 1024
+    metadata_concurrency: int = 8
+
+    # Caves are suggested for photos within this many metres of their GPS position; cave-service
+    # is asked about this many photos per request
+    cave_suggestion_radius_m: float = 500.0
+    # Largest radius clients may ask for; keep in line with cave-service's nearest_max_radius_m
+    cave_suggestion_max_radius_m: float = 10000.0
+    cave_suggestion_batch_size: int = 1000
+
+    # Images whose longest edge exceeds this many pixels, and PDFs, get a zoomable tile pyramid
+    tile_min_size: int = 4096
+    tile_size: int = 256
+    # Resolution PDF sheets are rasterized at, reduced to stay within tile_max_pixels
+    tile_pdf_dpi: int = 300
+    tile_max_pixels: int = 1_000_000_000
+    # Scratch space for the uncompressed rasters pyramids are built from
+    tile_work_dir: str = "/tmp/media-service-tiles"
+    # A failed pyramid is built again when its tiles are requested this many minutes after the failure
+    tile_retry_minutes: int = 5
+
+    # Uploads are staged as blocks of this size, with at most this many blocks in flight per upload
+    upload_chunk_size: int = 4 * 1024 * 1024
+    upload_max_concurrency: int = 4
+    # Resumable chunks other than the last must be at least this large, which keeps blobs far below Azure's 50,000 blocks
+    upload_min_chunk_size: int = 1024 * 1024
+
+    # Resumable upload sessions expire after this many hours; uncommitted blocks only live for 7 days
+    upload_session_ttl_hours: int = 72
+    # Lifetime of the write URLs issued for direct-to-storage uploads
+    upload_sas_minutes: int = 30
+
     class Config:
         env_file = ".env"
         extra = "ignore"
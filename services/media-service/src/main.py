@@ -1,9 +1,13 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from src.routes import media
+from src.routes import media, jobs
 from src.db.connection import init_db
+from src.utils.compression import CompressionMiddleware
 from src.utils.azure_storage import azure_storage
 from src.utils.rabbitmq_consumer import start_rabbitmq_consumer, stop_rabbitmq_consumer
+from src.utils.jobs import job_runner
+from src.utils.job_handlers import register_job_handlers
+from src.utils.process_pool import shutdown_process_pool
 import asyncio
 
 from contextlib import asynccontextmanager
@@ -43,6 +47,18 @@ async def lifespan(app: FastAPI):
     await init_db_with_retry()
     await init_azure_storage()
 
+    # Start the background job runner; without RabbitMQ jobs run in-process
+    register_job_handlers(job_runner)
+    try:
+        await job_runner.start()
+        print("✓ Job runner started successfully")
+    except Exception as e:
+        print(f"⚠ Failed to start job runner, running jobs in-process: {str(e)[:100]}")
+    try:
+        await job_runner.requeue_stale()
+    except Exception as e:
+        print(f"⚠ Failed to requeue stale jobs: {str(e)[:100]}")
+
     # Start RabbitMQ consumer
     try:
         await start_rabbitmq_consumer()
@@ -60,6 +76,11 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         print(f"⚠ Error stopping RabbitMQ consumer: {str(e)[:100]}")
 
+    await job_runner.stop()
+    print("✓ Job runner stopped")
+
+    shutdown_process_pool()
+
     print("✓ Application shutdown complete")
 
 app = FastAPI(
@@ -77,6 +98,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress responses according to Accept-Encoding (br, gzip)
+app.add_middleware(CompressionMiddleware, minimum_size=500)
+
+# Registered before the media router so /media/jobs is not taken for a media id
+app.include_router(jobs.router, prefix="/media/jobs", tags=["Jobs"])
 app.include_router(media.router, prefix="/media", tags=["Media"])
 
 
@@ -1,8 +1,10 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text
+from sqlalchemy import BigInteger, JSON, Column, Integer, String, Float, DateTime, ForeignKey, Text, UniqueConstraint
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from src.models.base import Base
 from typing import Optional
 from datetime import datetime
+from uuid import uuid4
+import enum
 
 class MediaFile(Base):
     __tablename__ = "media_files"
@@ -19,6 +21,12 @@ class MediaFile(Base):
 
     # Relationships
     file_metadata = relationship("MediaMetadata", back_populates="media_file", cascade="all, delete-orphan")
+    derivatives = relationship(
+        "MediaDerivative", back_populates="media_file", cascade="all, delete-orphan", passive_deletes=True
+    )
+    tile_pyramid = relationship(
+        "TilePyramid", back_populates="media_file", uselist=False, cascade="all, delete-orphan", passive_deletes=True
+    )
 
 
 class MediaMetadata(Base):
@@ -37,3 +45,108 @@ class MediaMetadata(Base):
 
     # Relationships
     media_file = relationship("MediaFile", back_populates="file_metadata")
+
+
+class MediaDerivative(Base):
+    """Downscaled copy of an image, stored as its own blob."""
+    __tablename__ = "media_derivatives"
+    __table_args__ = (UniqueConstraint("media_file_id", "size", "format"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    media_file_id = Column(
+        Integer,
+        ForeignKey("media_files.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True
+    )
+    size: Mapped[int] = mapped_column(Integer, nullable=False)  # Bounding box of the longest edge
+    format = Column(String, nullable=False)  # e.g. "jpeg", "png"
+    blob_name = Column(String, nullable=False, unique=True)
+    content_type = Column(String, nullable=False)
+    width: Mapped[int] = mapped_column(Integer, nullable=False)
+    height: Mapped[int] = mapped_column(Integer, nullable=False)
+    file_size: Mapped[int] = mapped_column(Integer, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    media_file = relationship("MediaFile", back_populates="derivatives")
+
+
+class TilePyramidStatus(str, enum.Enum):
+    PROCESSING = "processing"
+    READY = "ready"
+    FAILED = "failed"
+
+
+class TilePyramid(Base):
+    """
+    Zoomable tiles of a large image or PDF sheet.
+
+    Tiles are stored as blobs under tiles/<filename>/<z>/<x>/<y>.<ext>;
+    level max_zoom is the full resolution of width x height pixels.
+    """
+    __tablename__ = "media_tile_pyramids"
+
+    id = Column(Integer, primary_key=True, index=True)
+    media_file_id = Column(
+        Integer,
+        ForeignKey("media_files.id", ondelete="CASCADE"),
+        nullable=False,
+        unique=True
+    )
+    status = Column(String, nullable=False, default=TilePyramidStatus.PROCESSING)
+    width: Mapped[Optional[int]] = mapped_column(Integer)
+    height: Mapped[Optional[int]] = mapped_column(Integer)
+    tile_size: Mapped[int] = mapped_column(Integer, nullable=False)
+    max_zoom: Mapped[Optional[int]] = mapped_column(Integer)
+    format = Column(String)  # "jpeg" or "png"
+    tile_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    error = Column(Text)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    completed_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+
+    media_file = relationship("MediaFile", back_populates="tile_pyramid")
+
+
+class UploadStatus(str, enum.Enum):
+    """Lifecycle of an upload session."""
+    OPEN = "open"
+    FINALIZING = "finalizing"
+    COMPLETED = "completed"
+    ABORTED = "aborted"
+
+
+class UploadMode(str, enum.Enum):
+    """How the content of an upload session reaches blob storage."""
+    RESUMABLE = "resumable"  # chunks sent to media-service and staged as blocks
+    DIRECT = "direct"  # written by the client to the blob with a signed URL
+
+
+class UploadSession(Base):
+    """
+    Upload that arrives in several requests.
+
+    In resumable mode chunks are staged as blocks of the reserved blob as
+    they arrive; received_bytes and block_ids describe the contiguous
+    content staged so far, and finalizing commits the blocks. In direct mode
+    the client writes the blob itself and completing the session verifies
+    it. Either way the MediaFile is only created at the end.
+    """
+    __tablename__ = "upload_sessions"
+
+    upload_id = Column(String, primary_key=True, default=lambda: uuid4().hex)
+    blob_name = Column(String, nullable=False, unique=True)
+    original_filename = Column(String, nullable=False)
+    content_type = Column(String, nullable=False)
+    size: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    received_bytes: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    block_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    block_ids = Column(JSON)  # Ids of the staged blocks in order; None for uploads started before they were recorded
+    cave_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    owner_email = Column(String, nullable=False, index=True)
+    mode = Column(String, nullable=False, default=UploadMode.RESUMABLE)
+    sha256 = Column(String)  # Expected hash of a direct upload, checked on completion
+    associate_within_m = Column(Float)  # Also link the file to the nearest cave within this distance of its GPS position
+    status = Column(String, nullable=False, default=UploadStatus.OPEN)
+    media_file_id = Column(Integer, ForeignKey("media_files.id", ondelete="SET NULL"))
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
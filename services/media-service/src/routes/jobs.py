@@ -0,0 +1,66 @@
+# Identical in every service with background jobs; see src.utils.jobs
+from src.models.job import Job
+from src.schemas.job import JobRead
+from src.auth import User, require_auth
+from src.utils.jobs import cancel_job
+
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from src.db.connection import get_session
+
+router = APIRouter()
+
+
+async def _get_own_job(session: AsyncSession, job_id: str, user: User) -> Job:
+    """Get a job of the current user or raise 404."""
+    job = await session.get(Job, job_id)
+    if job is None or job.owner_email != user.email:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job
+
+
+# --- List jobs endpoint ---
+# Protected - requires authentication
+@router.get("/", response_model=list[JobRead])
+async def list_jobs(
+    limit: int = Query(50, ge=1, le=200),
+    session: AsyncSession = Depends(get_session),
+    user: User = Depends(require_auth)
+):
+    """List the current user's most recent jobs."""
+    result = await session.execute(
+        select(Job).where(Job.owner_email == user.email).order_by(Job.created_at.desc()).limit(limit)
+    )
+    return result.scalars().all()
+
+
+# --- Get job endpoint ---
+# Protected - requires authentication
+@router.get("/{job_id}", response_model=JobRead)
+async def get_job(
+    job_id: str,
+    session: AsyncSession = Depends(get_session),
+    user: User = Depends(require_auth)
+):
+    """Get the status, progress and result of a job."""
+    return await _get_own_job(session, job_id, user)
+
+
+# --- Cancel job endpoint ---
+# Protected - requires authentication
+@router.delete("/{job_id}", response_model=JobRead)
+async def delete_job(
+    job_id: str,
+    session: AsyncSession = Depends(get_session),
+    user: User = Depends(require_auth)
+):
+    """
+    Cancel a job.
+
+    Queued jobs are cancelled right away; running jobs stop at their next
+    progress update. Finished jobs are returned unchanged.
+    """
+    job = await _get_own_job(session, job_id, user)
+    await cancel_job(session, job)
+    return job
@@ -1,111 +1,66 @@
 import logging
 import uuid
-from typing import List, Optional
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Query, Response, Form
+from typing import AsyncIterator, List, Literal, Optional
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Query, Request, Response, Form
 from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update
 from sqlalchemy.orm import selectinload
-import io
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
 import httpx
+from azure.core.exceptions import ResourceModifiedError, ResourceNotFoundError
 import os
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
 from src.db.connection import get_session
-from src.models.media import MediaFile, MediaMetadata
+from src.models.media import MediaFile, MediaMetadata, TilePyramidStatus, UploadMode, UploadSession, UploadStatus
 from src.schemas.media import (
     MediaFile as MediaFileSchema,
     MediaFileList,
     MediaFileCreate,
     MediaFileUpdate,
     UploadResponse,
-    MediaMetadataCreate
+    UploadSessionCreate,
+    UploadSessionRead,
+    MediaMetadataCreate,
+    TilePyramidRead,
+    CaveSuggestion,
+    CaveSuggestionsRequest,
+    CaveSuggestions
 )
+from src.schemas.job import JobRead
 from src.auth import User, require_auth
 from pydantic import BaseModel
 
 
 class BatchMediaRequest(BaseModel):
     media_file_ids: List[int]
-from src.utils.azure_storage import azure_storage
+from src.utils.azure_storage import MAX_BLOCKS, azure_storage, make_block_id, new_block_token
+from src.utils.cave_service import check_cave_permissions_with_retry, notify_cave_service_with_retry
+from src.utils.cave_suggestions import suggest_caves
+from src.utils.streams import rechunk
+from src.utils.http_range import RangeNotSatisfiable, if_none_match_matches, if_range_matches, parse_range
+from src.utils.derivatives import derivative_prefix, get_derivative
+from src.utils.images import CONTENT_TYPES
+from src.utils.jobs import job_runner
+from src.utils.media_metadata import has_extractor
+from src.utils.tiles import (
+    get_tile_pyramid,
+    is_tileable,
+    request_tile_pyramid,
+    tile_blob_name,
+    tile_prefix,
+)
 from src.config.settings import settings
 
-# Group service URL
-GROUP_SERVICE_URL = os.getenv("GROUP_SERVICE_URL", "http://group-service.default.svc.cluster.local")
-
-# Cave service URL
-CAVE_SERVICE_URL = os.getenv("CAVE_SERVICE_URL", "http://cave-service.default.svc.cluster.local")
-
 # User service URL
 USER_SERVICE_URL = os.getenv("USER_SERVICE_URL", "http://user-service.default.svc.cluster.local")
 
-# Service authentication token for internal service-to-service communication
-SERVICE_TOKEN = os.getenv("SERVICE_TOKEN", "dev-service-token-123")
-
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=1, max=10),
-    retry=retry_if_exception_type((httpx.TimeoutException, httpx.ConnectError, httpx.NetworkError)),
-)
-async def _check_cave_permissions_with_retry(cave_id: int, user_email: str) -> bool:
-    """Check cave edit permissions with cave ownership and group permissions with retries."""
-
-    # First check if user is the cave owner
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"{CAVE_SERVICE_URL}/caves/{cave_id}/permissions/{user_email}",
-            headers={"X-Service-Token": SERVICE_TOKEN},
-            timeout=5.0
-        )
-
-        if response.status_code == 200:
-            try:
-                data = response.json()
-                if data.get("can_edit", False):
-                    return True  # User is the cave owner
-            except Exception as e:
-                logger.warning(f"Failed to parse cave service response: {e}")
-
-    # If not the owner, check group permissions
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"{GROUP_SERVICE_URL}/groups/{cave_id}/permissions/{user_email}",
-            headers={"X-Service-Token": SERVICE_TOKEN},
-            timeout=5.0
-        )
-
-        if response.status_code == 200:
-            try:
-                data = response.json()
-                return data.get("can_edit", False)
-            except Exception as e:
-                logger.warning(f"Failed to parse group service response: {e}")
-                return False
-
-        logger.warning(f"Group service returned status {response.status_code} for cave {cave_id}, user {user_email}")
-        return False
-
-
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=1, max=10),
-    retry=retry_if_exception_type((httpx.TimeoutException, httpx.ConnectError, httpx.NetworkError)),
-)
-async def _notify_cave_service_with_retry(cave_id: int, media_file_id: int):
-    """Notify cave service that media was added with retries."""
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{CAVE_SERVICE_URL}/caves/{cave_id}/media/{media_file_id}/internal",
-            headers={"X-Service-Token": SERVICE_TOKEN},
-            timeout=5.0
-        )
-        print(f"Cave service response: {response.json()}")
-        response.raise_for_status()
-        
 @retry(
     stop=stop_after_attempt(3),
     wait=wait_exponential(multiplier=1, min=1, max=10),
@@ -137,10 +92,161 @@ async def fetch_usernames(emails: list[str]) -> dict[str, str]:
         return {}
 
 
+async def _read_chunks(file: UploadFile, chunk_size: int) -> AsyncIterator[bytes]:
+    """Read an uploaded file in chunks of chunk_size bytes."""
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def _require_cave_edit(cave_id: int, user: User) -> None:
+    """Raise 403 unless the user may add files to the cave."""
+    try:
+        can_edit = await check_cave_permissions_with_retry(cave_id, user.email)
+        logger.info(f"Permission check result for cave {cave_id}, user {user.email}: {can_edit}")
+    except Exception as e:
+        logger.error(f"Error checking cave permissions: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail="Failed to verify cave permissions"
+        )
+    if not can_edit:
+        raise HTTPException(
+            status_code=403,
+            detail="You do not have permission to upload files to this cave"
+        )
+
+
+def _unique_blob_name(filename: str) -> str:
+    """Blob name for an upload, keeping the extension of the original filename."""
+    file_extension = filename.split('.')[-1] if '.' in filename else ''
+    return f"{uuid.uuid4()}.{file_extension}" if file_extension else str(uuid.uuid4())
+
+
+async def _register_upload(
+    session: AsyncSession,
+    user: User,
+    cave_id: int,
+    blob_name: str,
+    original_filename: str,
+    blob_url: str,
+    size: int,
+    content_type: str,
+    sha256: Optional[str] = None,
+    associate_within_m: Optional[float] = None
+) -> MediaFile:
+    """
+    Create the MediaFile and its metadata for a stored blob and tell cave-service about it.
+
+    With associate_within_m, the file is also linked to the nearest cave
+    within that distance of its GPS position once its metadata is extracted.
+    """
+    usernames_map = await fetch_usernames([user.email])
+
+    # Create database record
+    media_file = MediaFile(
+        filename=blob_name,
+        original_filename=original_filename,
+        file_path=blob_url,
+        file_size=size,
+        content_type=content_type,
+        uploaded_by=usernames_map.get(user.email, user.email.split('@')[0]),
+        container_name=settings.azure_storage_container_name
+    )
+
+    session.add(media_file)
+    await session.commit()
+    await session.refresh(media_file)
+
+    # Extract and store basic metadata
+    metadata_entries = []
+
+    # Add file size metadata
+    metadata_entries.append(MediaMetadata(
+        media_file_id=media_file.id,
+        key="file_size_bytes",
+        value=str(size),
+        metadata_type="number"
+    ))
+
+    # Add content hash metadata
+    if sha256 is not None:
+        metadata_entries.append(MediaMetadata(
+            media_file_id=media_file.id,
+            key="sha256",
+            value=sha256,
+            metadata_type="string"
+        ))
+
+    # Add content type metadata
+    metadata_entries.append(MediaMetadata(
+        media_file_id=media_file.id,
+        key="content_type",
+        value=content_type,
+        metadata_type="string"
+    ))
+
+    # Add original filename metadata
+    metadata_entries.append(MediaMetadata(
+        media_file_id=media_file.id,
+        key="original_filename",
+        value=original_filename,
+        metadata_type="string"
+    ))
+
+    for metadata in metadata_entries:
+        session.add(metadata)
+
+    await session.commit()
+
+    # Notify cave service that file was added
+    try:
+        await notify_cave_service_with_retry(cave_id, media_file.id)
+        print(f"Successfully notified cave service about media file {media_file.id} for cave {cave_id}")
+    except Exception as e:
+        print(f"Failed to notify cave service about media file {media_file.id} for cave {cave_id}: {e}")
+        # Don't fail the upload if cave service notification fails
+        # The file is still uploaded and stored, just not associated with the cave yet
+
+    if has_extractor(media_file.content_type):
+        # The job queues derivatives and tiles once the image size is known
+        try:
+            payload = {"media_file_id": media_file.id}
+            if associate_within_m:
+                payload.update(associate_within_m=associate_within_m, owner_email=user.email, cave_id=cave_id)
+            await job_runner.submit("media_metadata", payload)
+        except Exception as e:
+            # Derivatives and tiles are generated on first request instead
+            logger.warning(f"Failed to queue metadata extraction of media file {media_file.id}: {e}")
+
+    return media_file
+
+
+async def _upload_response(session: AsyncSession, media_file_id: int) -> UploadResponse:
+    """Load a media file with its metadata and a download URL."""
+    # Reload with eager loading to access relationship
+    query = select(MediaFile).where(MediaFile.id == media_file_id).options(selectinload(MediaFile.file_metadata))
+    result = await session.execute(query)
+    media_file = result.scalar_one()
+
+    # Generate download URL
+    download_url = await azure_storage.get_file_url(media_file.filename)
+
+    return UploadResponse(
+        media_file=MediaFileSchema.from_orm(media_file),
+        download_url=download_url
+    )
+
+
 @router.post("/upload", response_model=UploadResponse)
 async def upload_file(
     file: UploadFile = File(...),
     cave_id: int = Form(..., description="ID of the cave to associate the file with"),
+    associate_within_m: Optional[float] = Form(
+        None, gt=0, description="Also link the file to the nearest cave within this many metres of its GPS position"
+    ),
     user: User = Depends(require_auth),
     session: AsyncSession = Depends(get_session)
 ):
@@ -149,114 +255,371 @@ async def upload_file(
         print(f"Upload request: cave_id={cave_id}, file={file.filename}")
 
         # Check if user has permission to edit the cave
-        try:
-            can_edit = await _check_cave_permissions_with_retry(cave_id, user.email)
-            logger.info(f"Permission check result for cave {cave_id}, user {user.email}: {can_edit}")
-            if not can_edit:
-                raise HTTPException(
-                    status_code=403,
-                    detail="You do not have permission to upload files to this cave"
-                )
-        except Exception as e:
-            logger.error(f"Error checking cave permissions: {e}")
-            raise HTTPException(
-                status_code=500,
-                detail="Failed to verify cave permissions"
-            )
+        await _require_cave_edit(cave_id, user)
 
         # Generate unique filename
-        file_extension = file.filename.split('.')[-1] if '.' in file.filename else ''
-        unique_filename = f"{uuid.uuid4()}.{file_extension}" if file_extension else str(uuid.uuid4())
+        unique_filename = _unique_blob_name(file.filename)
 
-        # Read file content
-        file_content = await file.read()
-
-        # Upload to Azure Blob Storage
-        blob_url = await azure_storage.upload_file(
-            file_data=io.BytesIO(file_content),
+        # Stream to Azure Blob Storage in staged blocks
+        uploaded = await azure_storage.upload_stream(
+            _read_chunks(file, settings.upload_chunk_size),
             blob_name=unique_filename,
             content_type=file.content_type
         )
-        
-        usernames_map = await fetch_usernames([user.email])
-        
-
-        # Create database record
-        media_file = MediaFile(
-            filename=unique_filename,
-            original_filename=file.filename,
-            file_path=blob_url,
-            file_size=len(file_content),
-            content_type=file.content_type,
-            uploaded_by=usernames_map.get(user.email, user.email.split('@')[0]),
-            container_name=settings.azure_storage_container_name
+
+        media_file = await _register_upload(
+            session, user, cave_id, unique_filename, file.filename,
+            uploaded.url, uploaded.size, file.content_type, uploaded.sha256, associate_within_m
         )
+        return await _upload_response(session, media_file.id)
 
-        session.add(media_file)
-        await session.commit()
-        await session.refresh(media_file)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error uploading file: {e}")
+        await session.rollback()
+        raise HTTPException(status_code=500, detail=f"Failed to upload file: {str(e)}")
 
-        # Generate download URL
-        download_url = await azure_storage.get_file_url(unique_filename)
 
-        # Extract and store basic metadata
-        metadata_entries = []
+# --- Resumable upload sessions ---
+# Create a session, PUT chunks at the current offset, then finalize. Chunks
+# are staged straight to blob storage, so an interrupted upload resumes
+# from the last chunk that was stored.
 
-        # Add file size metadata
-        metadata_entries.append(MediaMetadata(
-            media_file_id=media_file.id,
-            key="file_size_bytes",
-            value=str(len(file_content)),
-            metadata_type="number"
-        ))
+async def _get_upload_session(session: AsyncSession, upload_id: str, user: User) -> UploadSession:
+    """Get an upload session of the current user or raise 404."""
+    upload = await session.get(UploadSession, upload_id)
+    if upload is None or upload.owner_email != user.email:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return upload
 
-        # Add content type metadata
-        metadata_entries.append(MediaMetadata(
-            media_file_id=media_file.id,
-            key="content_type",
-            value=file.content_type,
-            metadata_type="string"
-        ))
 
-        # Add original filename metadata
-        metadata_entries.append(MediaMetadata(
-            media_file_id=media_file.id,
-            key="original_filename",
-            value=file.filename,
-            metadata_type="string"
-        ))
+def _require_open(upload: UploadSession, mode: UploadMode) -> None:
+    """Raise unless the upload is an open upload of the given mode."""
+    if upload.status == UploadStatus.ABORTED or upload.expires_at < datetime.utcnow():
+        raise HTTPException(status_code=410, detail="Upload has been aborted or has expired")
+    if upload.status != UploadStatus.OPEN:
+        raise HTTPException(status_code=409, detail=f"Upload is {upload.status}")
+    if upload.mode != mode:
+        raise HTTPException(status_code=409, detail=f"Not available for {upload.mode} uploads")
 
-        for metadata in metadata_entries:
-            session.add(metadata)
 
-        await session.commit()
+async def _claim_upload(session: AsyncSession, upload_id: str) -> None:
+    """Mark an open upload as finalizing so concurrent calls don't create two media files."""
+    result = await session.execute(
+        update(UploadSession)
+        .where(UploadSession.upload_id == upload_id, UploadSession.status == UploadStatus.OPEN)
+        .values(status=UploadStatus.FINALIZING)
+    )
+    await session.commit()
+    if result.rowcount == 0:
+        raise HTTPException(status_code=409, detail="Upload is already being finalized")
+
+
+def _staged_block_ids(upload: UploadSession) -> list[str]:
+    """Ids of the blocks that make up the content received so far, in order."""
+    if upload.block_ids is not None:
+        return list(upload.block_ids)
+    # Uploads started before block ids were recorded used index-only ids
+    return [make_block_id(i) for i in range(upload.block_count)]
+
+
+async def _set_upload_status(
+    session: AsyncSession,
+    upload_id: str,
+    status: UploadStatus,
+    media_file_id: Optional[int] = None
+) -> None:
+    await session.execute(
+        update(UploadSession)
+        .where(UploadSession.upload_id == upload_id)
+        .values(status=status, media_file_id=media_file_id)
+    )
+    await session.commit()
 
-        # Reload with eager loading to access relationship
-        query = select(MediaFile).where(MediaFile.id == media_file.id).options(selectinload(MediaFile.file_metadata))
-        result = await session.execute(query)
-        media_file = result.scalar_one()
 
-        # Generate download URL
-        download_url = await azure_storage.get_file_url(unique_filename)
+async def _issue_upload_url(upload: UploadSession, result: UploadSessionRead) -> None:
+    """Set a fresh write URL for a direct upload, and the headers to send with it, on result."""
+    result.upload_url = await azure_storage.get_upload_url(upload.blob_name, settings.upload_sas_minutes)
+    result.upload_headers = {"x-ms-blob-type": "BlockBlob", "x-ms-blob-content-type": upload.content_type}
+    result.upload_url_expires_at = datetime.utcnow() + timedelta(minutes=settings.upload_sas_minutes)
 
-        # Notify cave service that file was added
-        try:
-            await _notify_cave_service_with_retry(cave_id, media_file.id)
-            print(f"Successfully notified cave service about media file {media_file.id} for cave {cave_id}")
-        except Exception as e:
-            print(f"Failed to notify cave service about media file {media_file.id} for cave {cave_id}: {e}")
-            # Don't fail the upload if cave service notification fails
-            # The file is still uploaded and stored, just not associated with the cave yet
 
-        return UploadResponse(
-            media_file=MediaFileSchema.from_orm(media_file),
-            download_url=download_url
+@router.post("/uploads", response_model=UploadSessionRead, status_code=201)
+async def create_upload_session(
+    payload: UploadSessionCreate,
+    response: Response,
+    user: User = Depends(require_auth),
+    session: AsyncSession = Depends(get_session)
+):
+    """
+    Start an upload of a file to a cave.
+
+    Resumable uploads send the content with PUT /media/uploads/{upload_id}?offset=N,
+    in order, then call /media/uploads/{upload_id}/finalize.
+
+    Direct uploads PUT the file to the returned upload_url with the returned
+    headers, straight to blob storage, then call
+    /media/uploads/{upload_id}/complete. The URL is valid for
+    settings.upload_sas_minutes minutes; POST
+    /media/uploads/{upload_id}/upload-url issues a new one.
+    """
+    await _require_cave_edit(payload.cave_id, user)
+
+    upload = UploadSession(
+        blob_name=_unique_blob_name(payload.filename),
+        original_filename=payload.filename,
+        content_type=payload.content_type,
+        size=payload.size,
+        received_bytes=0,
+        block_count=0,
+        cave_id=payload.cave_id,
+        owner_email=user.email,
+        mode=payload.mode,
+        sha256=payload.sha256.lower() if payload.sha256 else None,
+        associate_within_m=payload.associate_within_m,
+        status=UploadStatus.OPEN,
+        expires_at=datetime.utcnow() + timedelta(hours=settings.upload_session_ttl_hours)
+    )
+    session.add(upload)
+    await session.commit()
+
+    result = UploadSessionRead.model_validate(upload)
+    if upload.mode == UploadMode.DIRECT:
+        await _issue_upload_url(upload, result)
+
+    response.headers["Location"] = f"/media/uploads/{upload.upload_id}"
+    return result
+
+
+@router.get("/uploads/{upload_id}", response_model=UploadSessionRead)
+async def get_upload_session(
+    upload_id: str,
+    user: User = Depends(require_auth),
+    session: AsyncSession = Depends(get_session)
+):
+    """Get the progress of an upload; received_bytes is where the next chunk starts."""
+    return await _get_upload_session(session, upload_id, user)
+
+
+@router.post("/uploads/{upload_id}/upload-url", response_model=UploadSessionRead)
+async def reissue_upload_url(
+    upload_id: str,
+    user: User = Depends(require_auth),
+    session: AsyncSession = Depends(get_session)
+):
+    """Issue a new write URL for an open direct upload, e.g. after the previous one expired."""
+    upload = await _get_upload_session(session, upload_id, user)
+    _require_open(upload, UploadMode.DIRECT)
+    result = UploadSessionRead.model_validate(upload)
+    await _issue_upload_url(upload, result)
+    return result
+
+
+@router.put("/uploads/{upload_id}", response_model=UploadSessionRead)
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0, description="Position of the chunk in the file"),
+    user: User = Depends(require_auth),
+    session: AsyncSession = Depends(get_session)
+):
+    """
+    Append the request body to an upload.
+
+    The offset must equal the upload's received_bytes; otherwise 409 is
+    returned and the client should resume from the current offset. A chunk
+    interrupted midway is discarded as a whole, so chunks of a few to a few
+    tens of MB work best on unreliable connections. Every chunk but the last
+    must be at least settings.upload_min_chunk_size bytes.
+
+    Each request stages its blocks under ids of its own, and only the
+    request that advances received_bytes records them, so of concurrent
+    requests for the same offset exactly one chunk ends up in the file.
+    """
+    upload = await _get_upload_session(session, upload_id, user)
+    _require_open(upload, UploadMode.RESUMABLE)
+    if offset != upload.received_bytes:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Chunk must start at offset {upload.received_bytes}"
+        )
+    remaining = upload.size - offset
+    min_chunk_size = min(settings.upload_min_chunk_size, remaining)
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length.isdigit() and int(content_length) < min_chunk_size:
+        raise HTTPException(status_code=400, detail=f"Chunks other than the last must be at least {min_chunk_size} bytes")
+    staged_ids = _staged_block_ids(upload)
+    # Don't hold a transaction open while the body arrives
+    await session.commit()
+
+    async def body() -> AsyncIterator[bytes]:
+        received = 0
+        async for piece in request.stream():
+            received += len(piece)
+            if received > remaining:
+                raise HTTPException(status_code=413, detail="Chunk extends past the declared file size")
+            yield piece
+
+    block_ids, size = await azure_storage.stage_blocks(
+        rechunk(body(), settings.upload_chunk_size),
+        upload.blob_name,
+        first_block=len(staged_ids),
+        token=new_block_token()
+    )
+    if size < min_chunk_size:
+        raise HTTPException(status_code=400, detail=f"Chunks other than the last must be at least {min_chunk_size} bytes")
+    if len(staged_ids) + len(block_ids) > MAX_BLOCKS:
+        raise HTTPException(status_code=400, detail=f"Upload would exceed {MAX_BLOCKS} blocks; send larger chunks")
+
+    # Only advance from the offset this chunk started at, in case of concurrent requests
+    result = await session.execute(
+        update(UploadSession)
+        .where(UploadSession.upload_id == upload_id, UploadSession.received_bytes == offset)
+        .values(
+            received_bytes=offset + size,
+            block_count=len(staged_ids) + len(block_ids),
+            block_ids=staged_ids + block_ids
         )
+    )
+    await session.commit()
+    if result.rowcount == 0:
+        raise HTTPException(status_code=409, detail="Upload was modified by another request")
 
+    await session.refresh(upload)
+    return upload
+
+
+@router.post("/uploads/{upload_id}/finalize", response_model=UploadResponse)
+async def finalize_upload(
+    upload_id: str,
+    user: User = Depends(require_auth),
+    session: AsyncSession = Depends(get_session)
+):
+    """
+    Commit an upload whose content has fully arrived and create the media file.
+
+    Finalizing a completed upload again returns the same media file.
+    """
+    upload = await _get_upload_session(session, upload_id, user)
+    if upload.status == UploadStatus.COMPLETED and upload.media_file_id is not None:
+        return await _upload_response(session, upload.media_file_id)
+    _require_open(upload, UploadMode.RESUMABLE)
+    if upload.received_bytes != upload.size:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Only {upload.received_bytes} of {upload.size} bytes have been received"
+        )
+
+    await _claim_upload(session, upload_id)
+    try:
+        blob_url = await azure_storage.commit_blocks(
+            upload.blob_name,
+            _staged_block_ids(upload),
+            content_type=upload.content_type
+        )
+        sha256 = await azure_storage.compute_sha256(upload.blob_name)
+        if upload.sha256 and sha256 != upload.sha256:
+            # The committed content is wrong, so the upload cannot be resumed
+            await azure_storage.delete_file(upload.blob_name)
+            await _set_upload_status(session, upload_id, UploadStatus.ABORTED)
+            raise HTTPException(status_code=422, detail="SHA-256 of the uploaded file does not match")
+        media_file = await _register_upload(
+            session, user, upload.cave_id, upload.blob_name, upload.original_filename,
+            blob_url, upload.size, upload.content_type, sha256, upload.associate_within_m
+        )
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error uploading file: {e}")
+        logger.error(f"Error finalizing upload {upload_id}: {e}")
         await session.rollback()
-        raise HTTPException(status_code=500, detail=f"Failed to upload file: {str(e)}")
+        await _set_upload_status(session, upload_id, UploadStatus.OPEN)
+        raise HTTPException(status_code=500, detail=f"Failed to finalize upload: {str(e)}")
+
+    await _set_upload_status(session, upload_id, UploadStatus.COMPLETED, media_file.id)
+    return await _upload_response(session, media_file.id)
+
+
+@router.post("/uploads/{upload_id}/complete", response_model=UploadResponse)
+async def complete_direct_upload(
+    upload_id: str,
+    user: User = Depends(require_auth),
+    session: AsyncSession = Depends(get_session)
+):
+    """
+    Verify a file the client uploaded directly to blob storage and create the media file.
+
+    The blob must have the declared size and content type and, when a hash
+    was declared, the declared SHA-256. The verified version is then copied
+    to a blob the upload URL cannot write, so the client cannot replace the
+    file after it was checked. A blob that fails verification is deleted
+    so it can be uploaded again, with a new URL from
+    /media/uploads/{upload_id}/upload-url if needed. Completing a completed
+    upload again returns the same media file.
+    """
+    upload = await _get_upload_session(session, upload_id, user)
+    if upload.status == UploadStatus.COMPLETED and upload.media_file_id is not None:
+        return await _upload_response(session, upload.media_file_id)
+    _require_open(upload, UploadMode.DIRECT)
+
+    properties = await azure_storage.get_properties(upload.blob_name)
+    if properties is None:
+        raise HTTPException(status_code=409, detail="The file has not been uploaded yet")
+
+    await _claim_upload(session, upload_id)
+    try:
+        problem = None
+        content_type = properties.content_settings.content_type
+        if properties.size != upload.size:
+            problem = f"Uploaded {properties.size} bytes, expected {upload.size}"
+        elif content_type != upload.content_type:
+            problem = f"Uploaded content type {content_type}, expected {upload.content_type}"
+        elif upload.sha256 and await azure_storage.compute_sha256(upload.blob_name, properties.etag) != upload.sha256:
+            problem = "SHA-256 of the uploaded file does not match"
+
+        if problem is not None:
+            await azure_storage.delete_file(upload.blob_name)
+            await _set_upload_status(session, upload_id, UploadStatus.OPEN)
+            raise HTTPException(status_code=422, detail=problem)
+
+        # The upload URL may still be valid, so the checked version moves out of its reach
+        blob_name = _unique_blob_name(upload.original_filename)
+        await azure_storage.copy_file(upload.blob_name, blob_name, properties.etag)
+        await azure_storage.delete_file(upload.blob_name)
+
+        media_file = await _register_upload(
+            session, user, upload.cave_id, blob_name, upload.original_filename,
+            azure_storage.get_blob_url(blob_name), upload.size, upload.content_type, upload.sha256,
+            upload.associate_within_m
+        )
+    except HTTPException:
+        raise
+    except (ResourceModifiedError, ResourceNotFoundError, FileNotFoundError):
+        await _set_upload_status(session, upload_id, UploadStatus.OPEN)
+        raise HTTPException(status_code=409, detail="The file was replaced while it was being checked")
+    except Exception as e:
+        logger.error(f"Error completing upload {upload_id}: {e}")
+        await session.rollback()
+        await _set_upload_status(session, upload_id, UploadStatus.OPEN)
+        raise HTTPException(status_code=500, detail=f"Failed to complete upload: {str(e)}")
+
+    await _set_upload_status(session, upload_id, UploadStatus.COMPLETED, media_file.id)
+    return await _upload_response(session, media_file.id)
+
+
+@router.delete("/uploads/{upload_id}", status_code=204)
+async def abort_upload(
+    upload_id: str,
+    user: User = Depends(require_auth),
+    session: AsyncSession = Depends(get_session)
+):
+    """Abort an upload; its staged blocks are discarded by blob storage."""
+    upload = await _get_upload_session(session, upload_id, user)
+    if upload.status in (UploadStatus.COMPLETED, UploadStatus.FINALIZING):
+        raise HTTPException(status_code=409, detail=f"Upload is {upload.status}")
+    upload.status = UploadStatus.ABORTED
+    await session.commit()
+
 
 @router.get("/{file_id}", response_model=MediaFileSchema)
 async def get_file(
@@ -280,12 +643,85 @@ async def get_file(
         logger.error(f"Error getting file {file_id}: {e}")
         raise HTTPException(status_code=500, detail="Failed to get file information")
 
+async def _blob_response(request: Request, blob_name: str, content_type: str, headers: dict[str, str]) -> Response:
+    """
+    Stream a stored file to the client, honouring Range, If-Range and If-None-Match.
+
+    Blob chunks are forwarded as they arrive. A satisfiable single-range
+    request gets 206 Partial Content with only that range read from storage.
+    """
+    properties = await azure_storage.get_properties(blob_name)
+    if properties is None:
+        raise HTTPException(status_code=404, detail="File not found in storage")
+
+    size = properties.size
+    etag = properties.etag
+    last_modified = format_datetime(properties.last_modified.astimezone(timezone.utc), usegmt=True)
+    headers = {**headers, "Accept-Ranges": "bytes", "ETag": etag, "Last-Modified": last_modified}
+
+    if if_none_match_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    if if_range_matches(request.headers.get("if-range"), etag, last_modified):
+        try:
+            byte_range = parse_range(request.headers.get("range"), size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    if byte_range is None:
+        status_code, offset, length = 200, 0, size
+    else:
+        start, end = byte_range
+        status_code, offset, length = 206, start, end - start + 1
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(length)
+
+    if length == 0:
+        return Response(status_code=status_code, media_type=content_type, headers=headers)
+
+    chunks = await azure_storage.stream_file(blob_name, offset, length, etag=etag)
+    return StreamingResponse(chunks, status_code=status_code, media_type=content_type, headers=headers)
+
+
+async def _redirect_response(
+    blob_name: str,
+    content_disposition: Optional[str],
+    cache_control: Optional[str],
+    headers: dict[str, str]
+) -> Optional[Response]:
+    """
+    Redirect to a signed blob URL, or None when no URL can be signed.
+
+    The redirect may be cached for as long as the URL is reused, so repeated
+    views are answered by the browser cache instead of this service.
+    """
+    try:
+        url, max_age = await azure_storage.get_delivery_url(blob_name, content_disposition, cache_control)
+    except Exception as e:
+        logger.warning(f"Falling back to proxying {blob_name}: {e}")
+        return None
+    return Response(
+        status_code=302,
+        headers={**headers, "Location": url, "Cache-Control": f"public, max-age={max_age}"}
+    )
+
+
+DeliveryMode = Literal["redirect", "proxy"]
+DELIVERY_DESCRIPTION = (
+    "redirect: 302 to a signed blob URL; proxy: stream through the service, "
+    "for clients that need same-origin responses. Defaults to the service setting."
+)
+
+
 @router.get("/{file_id}/download")
 async def download_file(
     file_id: int,
+    request: Request,
+    delivery: Optional[DeliveryMode] = Query(None, description=DELIVERY_DESCRIPTION),
     session: AsyncSession = Depends(get_session)
 ):
-    """Download a file from Azure Blob Storage."""
+    """Download a file from Azure Blob Storage; supports Range requests."""
     try:
         # Get file metadata
         query = select(MediaFile).where(MediaFile.id == file_id)
@@ -295,14 +731,15 @@ async def download_file(
         if not file:
             raise HTTPException(status_code=404, detail="File not found")
 
-        # Download from Azure
-        file_content = await azure_storage.download_file(file.filename)
+        content_disposition = f"attachment; filename={file.original_filename}"
+        if (delivery or settings.media_delivery) == "redirect":
+            redirect = await _redirect_response(file.filename, content_disposition, None, {})
+            if redirect is not None:
+                return redirect
 
-        # Return as streaming response
-        return StreamingResponse(
-            io.BytesIO(file_content),
-            media_type=file.content_type,
-            headers={"Content-Disposition": f"attachment; filename={file.original_filename}"}
+        # Stream from Azure
+        return await _blob_response(
+            request, file.filename, file.content_type, {"Content-Disposition": content_disposition}
         )
 
     except HTTPException:
@@ -328,6 +765,8 @@ async def delete_file(
 
         # Delete from Azure Blob Storage
         await azure_storage.delete_file(file.filename)
+        await azure_storage.delete_prefix(derivative_prefix(file.filename))
+        await azure_storage.delete_prefix(tile_prefix(file.filename))
 
         # Delete from database (cascade will handle metadata)
         await session.delete(file)
@@ -400,12 +839,82 @@ async def get_media_batch(
     return media_files
 
 
+# --- Backfill technical metadata ---
+# Protected - requires authentication
+@router.post("/metadata/backfill", response_model=JobRead, status_code=202)
+async def backfill_media_metadata(
+    response: Response,
+    user: User = Depends(require_auth)
+):
+    """
+    Extract dimensions, EXIF data and page counts in the background for
+    files uploaded before extraction existed or before its current version.
+    """
+    job = await job_runner.submit("metadata_backfill", {}, owner_email=user.email)
+    response.headers["Location"] = f"/media/jobs/{job.job_id}"
+    return job
+
+
+async def _suggest_caves(
+    session: AsyncSession,
+    media_file_ids: list[int],
+    radius_m: Optional[float],
+    limit: int
+) -> dict[int, list[CaveSuggestion]]:
+    try:
+        return await suggest_caves(session, media_file_ids, radius_m or settings.cave_suggestion_radius_m, limit)
+    except httpx.HTTPError as e:
+        logger.error(f"Error looking up caves near media files: {e}")
+        raise HTTPException(status_code=502, detail="Failed to look up nearby caves")
+
+
+# --- Cave suggestions from photo GPS ---
+@router.post("/cave-suggestions", response_model=CaveSuggestions)
+async def suggest_caves_for_files(
+    request: CaveSuggestionsRequest,
+    session: AsyncSession = Depends(get_session)
+):
+    """
+    Suggest caves for many photos at once from the GPS positions in their EXIF data.
+
+    Each file gets the caves with an entrance within radius_m of its
+    position, nearest first; files without a position get none.
+    """
+    media_file_ids = list(dict.fromkeys(request.media_file_ids))
+    suggestions = await _suggest_caves(session, media_file_ids, request.radius_m, request.limit)
+    return CaveSuggestions(suggestions=suggestions)
+
+
+@router.get("/{file_id}/cave-suggestions", response_model=List[CaveSuggestion])
+async def suggest_caves_for_file(
+    file_id: int,
+    radius_m: Optional[float] = Query(
+        None, gt=0, le=settings.cave_suggestion_max_radius_m,
+        description="Largest distance to a cave entrance (default from settings)"
+    ),
+    limit: int = Query(5, ge=1, le=50),
+    session: AsyncSession = Depends(get_session)
+):
+    """Suggest caves for a photo from its GPS position, nearest first."""
+    if await session.get(MediaFile, file_id) is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    return (await _suggest_caves(session, [file_id], radius_m, limit))[file_id]
+
+
 @router.get("/{file_id}/image")
 async def get_image(
     file_id: int,
+    request: Request,
+    size: Optional[int] = Query(
+        None,
+        ge=1,
+        description="Longest edge wanted in pixels; the smallest stored copy at least this large is served, "
+                    "as AVIF or WebP when the Accept header lists them, or the original when there is none"
+    ),
+    delivery: Optional[DeliveryMode] = Query(None, description=DELIVERY_DESCRIPTION),
     session: AsyncSession = Depends(get_session)
 ):
-    """Serve an image file directly with proper CORS headers."""
+    """Serve an image file, or a downscaled copy of it, with proper CORS headers; supports Range requests."""
     try:
         # Get file metadata
         query = select(MediaFile).where(MediaFile.id == file_id)
@@ -418,19 +927,33 @@ async def get_image(
         if not file.content_type or not file.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="File is not an image")
 
+        blob_name, content_type = file.filename, file.content_type
+        vary = {}
+        if size is not None:
+            derivative = await get_derivative(session, file, size, request.headers.get("accept"))
+            if derivative is not None:
+                blob_name, content_type = derivative.blob_name, derivative.content_type
+            # The format depends on the Accept header
+            vary = {"Vary": "Accept"}
+
+        content_disposition = f"inline; filename={file.original_filename}"
+        cache_control = "public, max-age=86400"  # Cache for 24 hours
+        cors_headers = {
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Headers": "*",
+            "Access-Control-Allow-Methods": "GET, OPTIONS"
+        }
+        if (delivery or settings.media_delivery) == "redirect":
+            redirect = await _redirect_response(blob_name, content_disposition, cache_control, {**cors_headers, **vary})
+            if redirect is not None:
+                return redirect
+
         # Stream the file from Azure
-        file_data = await azure_storage.download_file(file.filename)
-
-        return StreamingResponse(
-            io.BytesIO(file_data),
-            media_type=file.content_type,
-            headers={
-                "Content-Disposition": f"inline; filename={file.original_filename}",
-                "Cache-Control": "public, max-age=86400",  # Cache for 24 hours
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Headers": "*",
-                "Access-Control-Allow-Methods": "GET, OPTIONS"
-            }
+        return await _blob_response(
+            request,
+            blob_name,
+            content_type,
+            {"Content-Disposition": content_disposition, "Cache-Control": cache_control, **cors_headers, **vary}
         )
 
     except HTTPException:
@@ -438,3 +961,105 @@ async def get_image(
     except Exception as e:
         logger.error(f"Error serving image {file_id}: {e}")
         raise HTTPException(status_code=500, detail="Failed to serve image")
+
+
+@router.get("/{file_id}/tiles", response_model=TilePyramidRead)
+async def get_tiles(
+    file_id: int,
+    response: Response,
+    session: AsyncSession = Depends(get_session)
+):
+    """
+    Describe the zoom tiles of an image or PDF, starting to build them if needed.
+
+    Answers 202 while the tiles are being built; poll until the status is ready.
+    """
+    query = select(MediaFile).where(MediaFile.id == file_id)
+    result = await session.execute(query)
+    file = result.scalar_one_or_none()
+
+    if not file:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    if not is_tileable(file):
+        raise HTTPException(status_code=400, detail="File is not an image or PDF")
+
+    try:
+        tile_pyramid = await get_tile_pyramid(session, file.id)
+        if tile_pyramid is None or tile_pyramid.status != TilePyramidStatus.READY:
+            tile_pyramid = await request_tile_pyramid(session, file)
+    except Exception as e:
+        logger.error(f"Error requesting tiles of file {file_id}: {e}")
+        await session.rollback()
+        raise HTTPException(status_code=500, detail="Failed to build tiles")
+
+    if tile_pyramid.status == TilePyramidStatus.PROCESSING:
+        response.status_code = 202
+    return TilePyramidRead(
+        status=tile_pyramid.status,
+        width=tile_pyramid.width,
+        height=tile_pyramid.height,
+        tile_size=tile_pyramid.tile_size,
+        max_zoom=tile_pyramid.max_zoom,
+        format=tile_pyramid.format,
+        tile_count=tile_pyramid.tile_count,
+        tile_url=f"/media/{file.id}/tiles/{{z}}/{{x}}/{{y}}",
+        error=tile_pyramid.error
+    )
+
+
+@router.get("/{file_id}/tiles/{z}/{x}/{y}")
+async def get_tile(
+    file_id: int,
+    z: int,
+    x: int,
+    y: int,
+    request: Request,
+    delivery: Optional[DeliveryMode] = Query(None, description=DELIVERY_DESCRIPTION),
+    session: AsyncSession = Depends(get_session)
+):
+    """Serve one tile of a ready tile pyramid; level 0 is the whole file in a single tile."""
+    query = (
+        select(MediaFile)
+        .where(MediaFile.id == file_id)
+        .options(selectinload(MediaFile.tile_pyramid))
+    )
+    result = await session.execute(query)
+    file = result.scalar_one_or_none()
+
+    tile_pyramid = file.tile_pyramid if file else None
+    if tile_pyramid is None or tile_pyramid.status != TilePyramidStatus.READY:
+        raise HTTPException(status_code=404, detail="Tiles not found")
+
+    scale = 2 ** (tile_pyramid.max_zoom - z) if 0 <= z <= tile_pyramid.max_zoom else None
+    if scale is None or not (
+        0 <= x * tile_pyramid.tile_size * scale < tile_pyramid.width
+        and 0 <= y * tile_pyramid.tile_size * scale < tile_pyramid.height
+    ):
+        raise HTTPException(status_code=404, detail="Tile not found")
+
+    try:
+        blob_name = tile_blob_name(file.filename, z, x, y, tile_pyramid.format)
+        cache_control = "public, max-age=86400"  # Cache for 24 hours
+        cors_headers = {
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Headers": "*",
+            "Access-Control-Allow-Methods": "GET, OPTIONS"
+        }
+        if (delivery or settings.media_delivery) == "redirect":
+            redirect = await _redirect_response(blob_name, None, cache_control, cors_headers)
+            if redirect is not None:
+                return redirect
+
+        return await _blob_response(
+            request,
+            blob_name,
+            CONTENT_TYPES[tile_pyramid.format],
+            {"Cache-Control": cache_control, **cors_headers}
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error serving tile {z}/{x}/{y} of file {file_id}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to serve tile")
@@ -1,6 +1,8 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 from datetime import datetime
+from src.config.settings import settings
+from src.models.media import TilePyramidStatus, UploadMode, UploadStatus
 
 class MediaMetadataBase(BaseModel):
     key: str
@@ -59,3 +61,77 @@ class UploadResponse(BaseModel):
 class MediaFileUpdate(BaseModel):
     original_filename: Optional[str] = None
     metadata: Optional[List[MediaMetadataCreate]] = None
+
+
+class UploadSessionCreate(BaseModel):
+    filename: str
+    content_type: str = "application/octet-stream"
+    # media_files.file_size is a 32-bit integer
+    size: int = Field(..., ge=0, le=2**31 - 1, description="Total size of the file in bytes")
+    cave_id: int
+    mode: UploadMode = UploadMode.RESUMABLE
+    sha256: Optional[str] = Field(
+        None,
+        pattern="^[0-9a-fA-F]{64}$",
+        description="Hex SHA-256 of the file, checked when the upload is completed or finalized"
+    )
+    associate_within_m: Optional[float] = Field(
+        None,
+        gt=0,
+        description="Also link the file to the nearest cave within this many metres of its GPS position"
+    )
+
+class UploadSessionRead(BaseModel):
+    upload_id: str
+    original_filename: str
+    content_type: str
+    size: int
+    received_bytes: int = Field(..., description="Offset at which the next chunk must start")
+    mode: UploadMode
+    status: UploadStatus
+    media_file_id: Optional[int] = None
+    created_at: datetime
+    expires_at: datetime
+    # Only returned when a direct upload is created
+    upload_url: Optional[str] = Field(None, description="Signed URL to PUT the file to")
+    upload_headers: Optional[Dict[str, str]] = Field(None, description="Headers to send with the PUT")
+    upload_url_expires_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
+class TilePyramidRead(BaseModel):
+    """Zoomable tiles of an image or PDF; fields other than status are set once it is ready."""
+    status: TilePyramidStatus
+    width: Optional[int] = Field(None, description="Width of the full-resolution level in pixels")
+    height: Optional[int] = None
+    tile_size: int
+    max_zoom: Optional[int] = Field(None, description="Level at full resolution; level 0 is a single tile")
+    format: Optional[str] = None
+    tile_count: int = 0
+    tile_url: str = Field(..., description="Template of the tile URLs with {z}, {x} and {y}")
+    error: Optional[str] = None
+
+
+class CaveSuggestion(BaseModel):
+    """A cave near the GPS position of a photo, through its closest entrance."""
+    cave_id: int
+    cave_name: str
+    entrance_id: int
+    entrance_name: Optional[str] = None
+    distance_m: float
+
+
+class CaveSuggestionsRequest(BaseModel):
+    media_file_ids: List[int]
+    radius_m: Optional[float] = Field(
+        None, gt=0, le=settings.cave_suggestion_max_radius_m,
+        description="Largest distance to a cave entrance (default from settings)"
+    )
+    limit: int = Field(5, ge=1, le=50, description="Most caves suggested per file")
+
+
+class CaveSuggestions(BaseModel):
+    """Caves near each requested file, nearest first; empty for files without a GPS position."""
+    suggestions: Dict[int, List[CaveSuggestion]]
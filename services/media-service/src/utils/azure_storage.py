@@ -1,12 +1,140 @@
+import io
 import logging
-from typing import Optional, BinaryIO
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache, partial
+from typing import AsyncIterable, AsyncIterator, Optional, BinaryIO
 import asyncio
-from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient
+import base64
+import hashlib
+import os
+import time
+from azure.storage.blob import BlobSasPermissions, BlobServiceClient, BlobClient, ContainerClient, ContentSettings, generate_blob_sas
+from azure.core import MatchConditions
 from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
 from src.config.settings import settings
 
 logger = logging.getLogger(__name__)
 
+
+# Azure commits at most this many blocks into one blob
+MAX_BLOCKS = 50_000
+
+
+def make_block_id(index: int, token: Optional[bytes] = None) -> str:
+    """Block id of the index-th block; ids of one blob must all have the same length.
+
+    With a token from new_block_token, blocks staged by different requests
+    get different ids, so concurrent requests never overwrite each other's
+    blocks. Both forms are 10 bytes long before encoding.
+    """
+    if token is None:
+        return base64.b64encode(f"{index:010d}".encode()).decode()
+    return base64.b64encode(token + index.to_bytes(4, "big")).decode()
+
+
+def new_block_token() -> bytes:
+    """Random prefix of the block ids of one request; the high bit keeps them apart from index-only ids."""
+    token = bytearray(os.urandom(6))
+    token[0] |= 0x80
+    return bytes(token)
+
+
+@lru_cache(maxsize=4096)
+def _read_sas(
+    container_name: str,
+    blob_name: str,
+    expiry: int,
+    content_disposition: Optional[str],
+    cache_control: Optional[str]
+) -> str:
+    """Read SAS token; the same arguments always give the same token."""
+    from datetime import datetime, timezone
+
+    return generate_blob_sas(
+        account_name=settings.azure_storage_account_name,
+        container_name=container_name,
+        blob_name=blob_name,
+        account_key=settings.azure_storage_account_key,
+        permission=BlobSasPermissions(read=True),
+        expiry=datetime.fromtimestamp(expiry, tz=timezone.utc),
+        content_disposition=content_disposition,
+        cache_control=cache_control
+    )
+
+
+class BlobReader(io.RawIOBase):
+    """Seekable read-only file over a blob that downloads only the ranges read.
+
+    Ranges are fetched in blocks of block_size, and the most recent blocks
+    are kept, so parsers reading a header in small pieces cause one request
+    per block. Every request is pinned to the etag the blob had when it was
+    opened. Reads block, so use it from a worker thread.
+    """
+
+    def __init__(self, blob_client: BlobClient, size: int, etag: str, block_size: int, cached_blocks: int = 16):
+        super().__init__()
+        self.blob_client = blob_client
+        self.size = size
+        self.etag = etag
+        self.block_size = block_size
+        self.cached_blocks = cached_blocks
+        self.bytes_fetched = 0
+        self._position = 0
+        self._blocks: OrderedDict[int, bytes] = OrderedDict()
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: self.size}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def _block(self, index: int) -> bytes:
+        block = self._blocks.get(index)
+        if block is None:
+            offset = index * self.block_size
+            block = self.blob_client.download_blob(
+                offset=offset,
+                length=min(self.block_size, self.size - offset),
+                etag=self.etag,
+                match_condition=MatchConditions.IfNotModified
+            ).readall()
+            self.bytes_fetched += len(block)
+            self._blocks[index] = block
+            if len(self._blocks) > self.cached_blocks:
+                self._blocks.popitem(last=False)
+        else:
+            self._blocks.move_to_end(index)
+        return block
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer).cast("B")
+        written = 0
+        while written < len(view) and self._position < self.size:
+            index, start = divmod(self._position, self.block_size)
+            block = self._block(index)
+            count = min(len(block) - start, len(view) - written)
+            view[written:written + count] = block[start:start + count]
+            written += count
+            self._position += count
+        return written
+
+
+@dataclass
+class UploadedBlob:
+    url: str
+    size: int
+    sha256: str
+
+
 class AzureBlobStorage:
     def __init__(self):
         self.blob_service_client = None
@@ -16,7 +144,9 @@ class AzureBlobStorage:
         if settings.azure_storage_connection_string:
             try:
                 self.blob_service_client = BlobServiceClient.from_connection_string(
-                    settings.azure_storage_connection_string
+                    settings.azure_storage_connection_string,
+                    max_single_get_size=settings.download_chunk_size,
+                    max_chunk_get_size=settings.download_chunk_size
                 )
                 logger.info("Initialized Azure Blob Storage with connection string")
             except Exception as e:
@@ -27,7 +157,9 @@ class AzureBlobStorage:
             try:
                 self.blob_service_client = BlobServiceClient(
                     account_url=account_url,
-                    credential=settings.azure_storage_account_key
+                    credential=settings.azure_storage_account_key,
+                    max_single_get_size=settings.download_chunk_size,
+                    max_chunk_get_size=settings.download_chunk_size
                 )
                 logger.info(f"Initialized Azure Blob Storage with account key for {settings.azure_storage_account_name}")
             except Exception as e:
@@ -73,7 +205,7 @@ class AzureBlobStorage:
                 blob_client.upload_blob(
                     file_data,
                     overwrite=True,
-                    content_type=content_type
+                    content_settings=ContentSettings(content_type=content_type)
                 )
                 return blob_client.url
             
@@ -85,6 +217,122 @@ class AzureBlobStorage:
             logger.error(f"Error uploading file {blob_name}: {e}")
             raise
 
+    async def stage_blocks(
+        self,
+        chunks: AsyncIterable[bytes],
+        blob_name: str,
+        first_block: int = 0,
+        digest=None,
+        token: Optional[bytes] = None
+    ) -> tuple[list[str], int]:
+        """Stage chunks as consecutive blocks of a blob without committing them.
+
+        Each chunk becomes one block that is staged while the next chunk is
+        read. At most settings.upload_max_concurrency blocks are in flight,
+        so memory is bounded by the chunk size times the concurrency.
+
+        Args:
+            chunks: Content in chunks
+            blob_name: Name of the blob in storage
+            first_block: Index of the first block, for content appended to earlier blocks
+            digest: hashlib object updated with the content as it passes through
+            token: Block id prefix of this request (see make_block_id)
+
+        Returns:
+            The ids of the staged blocks and the number of bytes staged
+        """
+        loop = asyncio.get_event_loop()
+        blob_client = self.blob_service_client.get_blob_client(
+            container=self.container_name,
+            blob=blob_name
+        )
+        size = 0
+        block_ids: list[str] = []
+        in_flight: set[asyncio.Future] = set()
+
+        try:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                if digest is not None:
+                    digest.update(chunk)
+                size += len(chunk)
+                block_id = make_block_id(first_block + len(block_ids), token)
+                block_ids.append(block_id)
+
+                if len(in_flight) >= settings.upload_max_concurrency:
+                    done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                in_flight.add(loop.run_in_executor(None, blob_client.stage_block, block_id, chunk))
+
+            if in_flight:
+                await asyncio.gather(*in_flight)
+            return block_ids, size
+
+        except Exception as e:
+            # Staged blocks that are never committed are discarded by the service
+            for future in in_flight:
+                future.cancel()
+            logger.error(f"Error staging blocks of {blob_name}: {e}")
+            raise
+
+    async def commit_blocks(
+        self,
+        blob_name: str,
+        block_ids: list[str],
+        content_type: str = None,
+        metadata: Optional[dict[str, str]] = None
+    ) -> str:
+        """Commit staged blocks, in order, as the content of a blob.
+
+        Returns:
+            The blob URL
+        """
+        try:
+            loop = asyncio.get_event_loop()
+            blob_client = self.blob_service_client.get_blob_client(
+                container=self.container_name,
+                blob=blob_name
+            )
+            await loop.run_in_executor(None, partial(
+                blob_client.commit_block_list,
+                block_ids,
+                content_settings=ContentSettings(content_type=content_type),
+                metadata=metadata
+            ))
+            logger.info(f"Successfully committed {len(block_ids)} blocks of {blob_name}")
+            return blob_client.url
+
+        except Exception as e:
+            logger.error(f"Error committing blocks of {blob_name}: {e}")
+            raise
+
+    async def upload_stream(
+        self,
+        chunks: AsyncIterable[bytes],
+        blob_name: str,
+        content_type: str = None
+    ) -> UploadedBlob:
+        """Upload a file chunk by chunk as staged blocks.
+
+        Size and SHA-256 are computed as the chunks pass through; the hash is
+        also stored as blob metadata.
+
+        Args:
+            chunks: File content in chunks
+            blob_name: Name of the blob in storage
+            content_type: MIME type of the file
+
+        Returns:
+            The blob URL, size and hex SHA-256 of the content
+        """
+        digest = hashlib.sha256()
+        block_ids, size = await self.stage_blocks(chunks, blob_name, digest=digest)
+        sha256 = digest.hexdigest()
+        url = await self.commit_blocks(blob_name, block_ids, content_type, metadata={"sha256": sha256})
+        return UploadedBlob(url=url, size=size, sha256=sha256)
+
     async def download_file(self, blob_name: str) -> bytes:
         """Download a file from Azure Blob Storage.
 
@@ -116,6 +364,69 @@ class AzureBlobStorage:
             logger.error(f"Error downloading file {blob_name}: {e}")
             raise
 
+    async def stream_file(
+        self,
+        blob_name: str,
+        offset: int = 0,
+        length: Optional[int] = None,
+        etag: Optional[str] = None
+    ) -> AsyncIterator[bytes]:
+        """Download a file, or a byte range of it, chunk by chunk.
+
+        The first request is made before this returns, so a missing blob or a
+        changed etag raises here rather than in the middle of a response.
+        Chunks of settings.download_chunk_size are then fetched one at a time
+        as the returned iterator is consumed, so memory stays constant.
+
+        Args:
+            blob_name: Name of the blob to download
+            offset: First byte to download
+            length: Number of bytes to download; the rest of the blob when None
+            etag: Only download if the blob still has this etag
+
+        Returns:
+            Async iterator over the content
+        """
+        try:
+            loop = asyncio.get_event_loop()
+            blob_client = self.blob_service_client.get_blob_client(
+                container=self.container_name,
+                blob=blob_name
+            )
+            conditions = {"etag": etag, "match_condition": MatchConditions.IfNotModified} if etag else {}
+            downloader = await loop.run_in_executor(None, partial(
+                blob_client.download_blob, offset=offset, length=length, **conditions
+            ))
+
+        except ResourceNotFoundError:
+            logger.error(f"Blob not found: {blob_name}")
+            raise FileNotFoundError(f"File {blob_name} not found in storage")
+        except Exception as e:
+            logger.error(f"Error downloading file {blob_name}: {e}")
+            raise
+
+        async def _chunks():
+            chunks = downloader.chunks()
+            while True:
+                chunk = await loop.run_in_executor(None, next, chunks, None)
+                if chunk is None:
+                    break
+                yield chunk
+
+        return _chunks()
+
+    async def download_to_path(self, blob_name: str, path: str) -> None:
+        """Copy a file to a local path chunk by chunk, without holding it in memory.
+
+        Args:
+            blob_name: Name of the blob to download
+            path: Local file to write
+        """
+        loop = asyncio.get_event_loop()
+        with open(path, "wb") as f:
+            async for chunk in await self.stream_file(blob_name):
+                await loop.run_in_executor(None, f.write, chunk)
+
     async def delete_file(self, blob_name: str) -> bool:
         """Delete a file from Azure Blob Storage.
 
@@ -147,6 +458,40 @@ class AzureBlobStorage:
             logger.error(f"Error deleting file {blob_name}: {e}")
             raise
 
+    async def delete_prefix(self, prefix: str) -> int:
+        """Delete all blobs whose name starts with prefix.
+
+        Args:
+            prefix: Name prefix of the blobs to delete
+
+        Returns:
+            Number of blobs deleted
+        """
+        try:
+            loop = asyncio.get_event_loop()
+
+            def _delete():
+                container_client = self.blob_service_client.get_container_client(self.container_name)
+                deleted = 0
+                for blob in container_client.list_blobs(name_starts_with=prefix):
+                    try:
+                        self.blob_service_client.get_blob_client(
+                            container=self.container_name,
+                            blob=blob.name
+                        ).delete_blob()
+                        deleted += 1
+                    except ResourceNotFoundError:
+                        pass
+                return deleted
+
+            deleted = await loop.run_in_executor(None, _delete)
+            logger.info(f"Deleted {deleted} blobs under {prefix}")
+            return deleted
+
+        except Exception as e:
+            logger.error(f"Error deleting blobs under {prefix}: {e}")
+            raise
+
     async def get_file_url(self, blob_name: str, expiry_hours: int = 24) -> str:
         """Get a signed URL for accessing the file.
 
@@ -183,6 +528,180 @@ class AzureBlobStorage:
             logger.error(f"Error generating signed URL for {blob_name}: {e}")
             raise
 
+    def get_blob_url(self, blob_name: str) -> str:
+        """Unsigned URL of a blob, as stored in MediaFile.file_path."""
+        return self.blob_service_client.get_blob_client(
+            container=self.container_name,
+            blob=blob_name
+        ).url
+
+    async def get_delivery_url(
+        self,
+        blob_name: str,
+        content_disposition: Optional[str] = None,
+        cache_control: Optional[str] = None
+    ) -> tuple[str, int]:
+        """Get a signed read URL to redirect clients to.
+
+        Time is split into windows of settings.delivery_sas_hours. Within a
+        window every replica returns the same URL, valid until the end of the
+        next window, so browsers and CDNs can cache both the redirect and the
+        blob. The Content-Disposition and Cache-Control headers the blob is
+        served with can be overridden through the URL.
+
+        Args:
+            blob_name: Name of the blob
+            content_disposition: Content-Disposition to serve the blob with
+            cache_control: Cache-Control to serve the blob with
+
+        Returns:
+            The signed URL and the number of seconds it may be cached for
+        """
+        try:
+            window = settings.delivery_sas_hours * 3600
+            now = time.time()
+            window_start = int(now // window) * window
+            sas_token = _read_sas(
+                self.container_name, blob_name, window_start + 2 * window, content_disposition, cache_control
+            )
+            return f"{self.get_blob_url(blob_name)}?{sas_token}", max(int(window_start + window - now), 0)
+
+        except Exception as e:
+            logger.error(f"Error generating delivery URL for {blob_name}: {e}")
+            raise
+
+    async def get_upload_url(self, blob_name: str, expiry_minutes: int) -> str:
+        """Get a signed URL that allows creating and writing one blob.
+
+        Args:
+            blob_name: Name of the blob to be uploaded
+            expiry_minutes: How many minutes the URL should be valid
+
+        Returns:
+            Signed URL for uploading the file
+        """
+        try:
+            from datetime import datetime, timedelta
+            from azure.storage.blob import BlobSasPermissions, generate_blob_sas
+
+            blob_client = self.blob_service_client.get_blob_client(
+                container=self.container_name,
+                blob=blob_name
+            )
+
+            sas_token = generate_blob_sas(
+                account_name=settings.azure_storage_account_name,
+                container_name=self.container_name,
+                blob_name=blob_name,
+                account_key=settings.azure_storage_account_key,
+                permission=BlobSasPermissions(create=True, write=True),
+                expiry=datetime.utcnow() + timedelta(minutes=expiry_minutes)
+            )
+
+            return f"{blob_client.url}?{sas_token}"
+
+        except Exception as e:
+            logger.error(f"Error generating upload URL for {blob_name}: {e}")
+            raise
+
+    async def get_properties(self, blob_name: str):
+        """Get the properties (size, content settings, metadata) of a blob.
+
+        Returns:
+            The blob properties, or None if the blob does not exist
+        """
+        try:
+            loop = asyncio.get_event_loop()
+            blob_client = self.blob_service_client.get_blob_client(
+                container=self.container_name,
+                blob=blob_name
+            )
+            return await loop.run_in_executor(None, blob_client.get_blob_properties)
+
+        except ResourceNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Error getting properties of {blob_name}: {e}")
+            raise
+
+    async def open_reader(self, blob_name: str, block_size: int) -> BlobReader:
+        """Open a blob as a seekable file that downloads only the ranges read.
+
+        Returns:
+            BlobReader: File object whose reads block; use it from a worker thread
+        """
+        properties = await self.get_properties(blob_name)
+        if properties is None:
+            raise FileNotFoundError(f"File {blob_name} not found in storage")
+        blob_client = self.blob_service_client.get_blob_client(
+            container=self.container_name,
+            blob=blob_name
+        )
+        return BlobReader(blob_client, properties.size, properties.etag, block_size)
+
+    async def compute_sha256(self, blob_name: str, etag: Optional[str] = None) -> str:
+        """Hash a blob while streaming it chunk by chunk, in constant memory.
+
+        Args:
+            blob_name: Name of the blob
+            etag: When given, fail unless the blob still has this etag
+
+        Returns:
+            Hex SHA-256 of the blob content
+        """
+        try:
+            loop = asyncio.get_event_loop()
+            conditions = {"etag": etag, "match_condition": MatchConditions.IfNotModified} if etag else {}
+
+            def _hash():
+                blob_client = self.blob_service_client.get_blob_client(
+                    container=self.container_name,
+                    blob=blob_name
+                )
+                digest = hashlib.sha256()
+                for chunk in blob_client.download_blob(**conditions).chunks():
+                    digest.update(chunk)
+                return digest.hexdigest()
+
+            return await loop.run_in_executor(None, _hash)
+
+        except ResourceNotFoundError:
+            logger.error(f"Blob not found: {blob_name}")
+            raise FileNotFoundError(f"File {blob_name} not found in storage")
+        except Exception as e:
+            logger.error(f"Error hashing file {blob_name}: {e}")
+            raise
+
+    async def copy_file(self, source_name: str, destination_name: str, source_etag: str) -> None:
+        """Copy a blob to a new blob within the container, server side.
+
+        The copy completes before this returns, and fails unless the source
+        still has source_etag, so exactly the version that was checked is
+        copied. The content type is copied along; metadata is not.
+        """
+        try:
+            loop = asyncio.get_event_loop()
+            source_url = await self.get_file_url(source_name, expiry_hours=1)
+
+            def _copy():
+                blob_client = self.blob_service_client.get_blob_client(
+                    container=self.container_name,
+                    blob=destination_name
+                )
+                blob_client.upload_blob_from_url(
+                    source_url,
+                    overwrite=False,
+                    source_etag=source_etag,
+                    source_match_condition=MatchConditions.IfNotModified
+                )
+
+            await loop.run_in_executor(None, _copy)
+            logger.info(f"Copied {source_name} to {destination_name}")
+
+        except Exception as e:
+            logger.error(f"Error copying {source_name} to {destination_name}: {e}")
+            raise
+
     async def file_exists(self, blob_name: str) -> bool:
         """Check if a file exists in blob storage.
 
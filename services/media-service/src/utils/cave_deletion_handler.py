@@ -1,11 +1,13 @@
 import logging
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Awaitable, Callable, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy import delete
 from src.db.connection import async_session
 from src.models.media import MediaFile
 from src.utils.azure_storage import azure_storage
+from src.utils.derivatives import derivative_prefix
+from src.utils.tiles import tile_prefix
 
 logger = logging.getLogger(__name__)
 
@@ -13,7 +15,14 @@ logger = logging.getLogger(__name__)
 class CaveDeletionHandler:
     """Handles cave deletion events by cleaning up associated media files"""
 
-    async def handle_cave_deletion(self, cave_id: int, cave_name: str, owner_email: str, media_file_ids: List[int]) -> None:
+    async def handle_cave_deletion(
+        self,
+        cave_id: int,
+        cave_name: str,
+        owner_email: str,
+        media_file_ids: List[int],
+        on_progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+    ) -> None:
         """
         Handle cave deletion by removing all associated media files.
 
@@ -22,6 +31,7 @@ class CaveDeletionHandler:
             cave_name: Name of the deleted cave
             owner_email: Email of the cave owner
             media_file_ids: List of media file IDs associated with the cave
+            on_progress: Awaited with (handled, total) after every media file
         """
         logger.info(f"Processing cave deletion for cave {cave_id} ({cave_name}) owned by {owner_email}")
         print(f"Processing cave deletion for cave {cave_id} ({cave_name}) owned by {owner_email}")
@@ -37,7 +47,11 @@ class CaveDeletionHandler:
                 deleted_files = 0
                 deleted_blobs = 0
 
-                for media_file_id in media_file_ids:
+                for handled, media_file_id in enumerate(media_file_ids):
+                    if on_progress is not None:
+                        # Keep the files deleted so far; a cancelled job stops here
+                        await session.commit()
+                        await on_progress(handled, len(media_file_ids))
                     try:
                         # Get the media file
                         result = await session.execute(
@@ -60,6 +74,11 @@ class CaveDeletionHandler:
                         except Exception as e:
                             logger.error(f"Failed to delete blob for media file {media_file.filename}: {e}")
                             # Continue with database deletion even if blob deletion fails
+                        try:
+                            await azure_storage.delete_prefix(derivative_prefix(media_file.filename))
+                            await azure_storage.delete_prefix(tile_prefix(media_file.filename))
+                        except Exception as e:
+                            logger.error(f"Failed to delete derivatives of media file {media_file.filename}: {e}")
 
                         # Delete from database (this will cascade delete metadata)
                         await session.delete(media_file)
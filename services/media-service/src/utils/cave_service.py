@@ -0,0 +1,111 @@
+"""
+Calls to cave-service and group-service, authenticated with the service token.
+"""
+import logging
+import os
+
+import httpx
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+
+# Group service URL
+GROUP_SERVICE_URL = os.getenv("GROUP_SERVICE_URL", "http://group-service.default.svc.cluster.local")
+
+# Cave service URL
+CAVE_SERVICE_URL = os.getenv("CAVE_SERVICE_URL", "http://cave-service.default.svc.cluster.local")
+
+# Service authentication token for internal service-to-service communication
+SERVICE_TOKEN = os.getenv("SERVICE_TOKEN", "dev-service-token-123")
+
+logger = logging.getLogger(__name__)
+
+
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=1, min=1, max=10),
+    retry=retry_if_exception_type((httpx.TimeoutException, httpx.ConnectError, httpx.NetworkError)),
+)
+async def check_cave_permissions_with_retry(cave_id: int, user_email: str) -> bool:
+    """Check cave edit permissions with cave ownership and group permissions with retries."""
+
+    # First check if user is the cave owner
+    async with httpx.AsyncClient() as client:
+        response = await client.get(
+            f"{CAVE_SERVICE_URL}/caves/{cave_id}/permissions/{user_email}",
+            headers={"X-Service-Token": SERVICE_TOKEN},
+            timeout=5.0
+        )
+
+        if response.status_code == 200:
+            try:
+                data = response.json()
+                if data.get("can_edit", False):
+                    return True  # User is the cave owner
+            except Exception as e:
+                logger.warning(f"Failed to parse cave service response: {e}")
+
+    # If not the owner, check group permissions
+    async with httpx.AsyncClient() as client:
+        response = await client.get(
+            f"{GROUP_SERVICE_URL}/groups/{cave_id}/permissions/{user_email}",
+            headers={"X-Service-Token": SERVICE_TOKEN},
+            timeout=5.0
+        )
+
+        if response.status_code == 200:
+            try:
+                data = response.json()
+                return data.get("can_edit", False)
+            except Exception as e:
+                logger.warning(f"Failed to parse group service response: {e}")
+                return False
+
+        logger.warning(f"Group service returned status {response.status_code} for cave {cave_id}, user {user_email}")
+        return False
+
+
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=1, min=1, max=10),
+    retry=retry_if_exception_type((httpx.TimeoutException, httpx.ConnectError, httpx.NetworkError)),
+)
+async def notify_cave_service_with_retry(cave_id: int, media_file_id: int):
+    """Notify cave service that media was added with retries."""
+    async with httpx.AsyncClient() as client:
+        response = await client.post(
+            f"{CAVE_SERVICE_URL}/caves/{cave_id}/media/{media_file_id}/internal",
+            headers={"X-Service-Token": SERVICE_TOKEN},
+            timeout=5.0
+        )
+        print(f"Cave service response: {response.json()}")
+        response.raise_for_status()
+
+
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=1, min=1, max=10),
+    retry=retry_if_exception_type((httpx.TimeoutException, httpx.ConnectError, httpx.NetworkError)),
+)
+async def find_nearest_caves_with_retry(
+    points: list[tuple[float, float]],
+    radius_m: float,
+    limit: int
+) -> list[list[dict]]:
+    """
+    Caves within radius_m of each (latitude, longitude) point, nearest first, with retries.
+
+    Returns:
+        list: One list of cave-service NearestCave objects per point, in the order of the points
+    """
+    async with httpx.AsyncClient() as client:
+        response = await client.post(
+            f"{CAVE_SERVICE_URL}/caves/entrances/nearest",
+            json={
+                "points": [{"gps_n": lat, "gps_e": lon} for lat, lon in points],
+                "radius_m": radius_m,
+                "limit": limit,
+            },
+            headers={"X-Service-Token": SERVICE_TOKEN},
+            timeout=30.0
+        )
+        response.raise_for_status()
+        return response.json()["matches"]
@@ -0,0 +1,109 @@
+"""
+Caves suggested for photos from their GPS position.
+
+Positions come from the gps_latitude and gps_longitude metadata recorded by
+src.utils.media_metadata. The caves near them are looked up in cave-service,
+settings.cave_suggestion_batch_size photos per request, so suggesting caves
+for thousands of photos takes a handful of round trips.
+"""
+import logging
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.config.settings import settings
+from src.models.media import MediaMetadata
+from src.schemas.media import CaveSuggestion
+from src.utils.cave_service import (
+    check_cave_permissions_with_retry,
+    find_nearest_caves_with_retry,
+    notify_cave_service_with_retry,
+)
+
+logger = logging.getLogger(__name__)
+
+GPS_KEYS = ("gps_latitude", "gps_longitude")
+
+
+async def photo_positions(session: AsyncSession, media_file_ids: list[int]) -> dict[int, tuple[float, float]]:
+    """(latitude, longitude) of the files that have a recorded GPS position."""
+    result = await session.execute(
+        select(MediaMetadata.media_file_id, MediaMetadata.key, MediaMetadata.value)
+        .where(MediaMetadata.media_file_id.in_(media_file_ids), MediaMetadata.key.in_(GPS_KEYS))
+    )
+    values: dict[int, dict[str, float]] = {}
+    for media_file_id, key, value in result.all():
+        values.setdefault(media_file_id, {})[key] = float(value)
+    return {
+        media_file_id: (position["gps_latitude"], position["gps_longitude"])
+        for media_file_id, position in values.items()
+        if len(position) == len(GPS_KEYS)
+    }
+
+
+async def nearest_caves(
+    positions: dict[int, tuple[float, float]],
+    radius_m: float,
+    limit: int
+) -> dict[int, list[CaveSuggestion]]:
+    """Caves within radius_m of each position, nearest first, keyed like positions."""
+    ids = list(positions)
+    suggestions: dict[int, list[CaveSuggestion]] = {}
+    batch_size = settings.cave_suggestion_batch_size
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        matches = await find_nearest_caves_with_retry([positions[i] for i in batch], radius_m, limit)
+        for media_file_id, caves in zip(batch, matches):
+            suggestions[media_file_id] = [CaveSuggestion.model_validate(cave) for cave in caves]
+    return suggestions
+
+
+async def suggest_caves(
+    session: AsyncSession,
+    media_file_ids: list[int],
+    radius_m: float,
+    limit: int
+) -> dict[int, list[CaveSuggestion]]:
+    """
+    Caves near each photo, nearest first.
+
+    Files without a GPS position get an empty list.
+    """
+    positions = await photo_positions(session, media_file_ids)
+    suggestions = await nearest_caves(positions, radius_m, limit) if positions else {}
+    return {media_file_id: suggestions.get(media_file_id, []) for media_file_id in media_file_ids}
+
+
+async def associate_nearest_cave(
+    session: AsyncSession,
+    media_file_id: int,
+    owner_email: str,
+    radius_m: float,
+    upload_cave_id: Optional[int] = None
+) -> Optional[int]:
+    """
+    Link a photo to the nearest cave within radius_m of its GPS position.
+
+    The photo stays linked to the cave it was uploaded to; cave-service
+    only deletes it with the last cave that links to it. Nothing is linked
+    when the photo has no position, no cave is close enough, the nearest
+    cave is the upload's cave, or the uploader may not edit the nearest cave.
+
+    Returns:
+        Optional[int]: The cave the photo was linked to
+    """
+    positions = await photo_positions(session, [media_file_id])
+    if not positions:
+        return None
+    suggestions = (await nearest_caves(positions, radius_m, 1))[media_file_id]
+    if not suggestions or suggestions[0].cave_id == upload_cave_id:
+        return None
+
+    cave_id = suggestions[0].cave_id
+    if not await check_cave_permissions_with_retry(cave_id, owner_email):
+        logger.info(f"Not linking media file {media_file_id} to nearest cave {cave_id}: {owner_email} may not edit it")
+        return None
+    await notify_cave_service_with_retry(cave_id, media_file_id)
+    logger.info(f"Linked media file {media_file_id} to cave {cave_id}, {suggestions[0].distance_m} m from its GPS position")
+    return cave_id
@@ -0,0 +1,356 @@
+"""
+Downscaled copies of uploaded images.
+
+Every image gets a derivative for each of settings.image_derivative_sizes
+that is smaller than the image itself. They are generated by a background
+job right after upload. When a size is requested before the job has run,
+e.g. for an image uploaded before derivatives existed, only that size is
+generated, in the base and the requested format, and the job is queued for
+the rest. The original is streamed to a temporary file, which the process
+pool decodes and encodes from; the derivatives are stored as blobs under
+derivatives/<filename>/ and recorded as MediaDerivative rows.
+
+Whether an image has been processed is recorded in its metadata under
+DERIVATIVES_KEY, so images that are already small enough, or that cannot
+be decoded, are not downloaded again on every request.
+
+Each size is stored as JPEG or PNG and in settings.image_formats (AVIF,
+WebP), and the format is picked from the Accept header of the request.
+A missing modern format, e.g. of an image processed before the format was
+configured, is transcoded from the stored JPEG or PNG on first request.
+"""
+import asyncio
+import io
+import logging
+import os
+import tempfile
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from PIL import UnidentifiedImageError
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.config.settings import settings
+from src.models.media import MediaDerivative, MediaFile, MediaMetadata
+from src.utils.azure_storage import azure_storage
+from src.utils.images import CONTENT_TYPES, ImageTooLarge, RenderedImage, render_derivatives, transcode
+from src.utils.jobs import job_runner
+from src.utils.process_pool import run_in_process
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVES_KEY = "derivatives"
+DERIVATIVES_READY = "ready"
+DERIVATIVES_UNSUPPORTED = "unsupported"
+
+# Formats every derivative size is stored in and served when no other is accepted
+BASE_FORMATS = ("jpeg", "png")
+
+# One generation per image at a time within this process; a lock lives while it is held or awaited
+_locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def _lock(media_file_id: int) -> asyncio.Lock:
+    lock = _locks.get(media_file_id)
+    if lock is None:
+        lock = _locks[media_file_id] = asyncio.Lock()
+    return lock
+
+
+def derivative_prefix(filename: str) -> str:
+    """Blob name prefix of all derivatives of a media file."""
+    return f"derivatives/{filename}/"
+
+
+def derivative_blob_name(filename: str, size: int, format: str) -> str:
+    extension = "jpg" if format == "jpeg" else format
+    return f"{derivative_prefix(filename)}{size}.{extension}"
+
+
+def format_qualities() -> dict[str, int]:
+    """Encoding quality of each format in settings.image_formats."""
+    qualities = {"webp": settings.image_webp_quality, "avif": settings.image_avif_quality}
+    return {format: qualities[format] for format in settings.image_formats}
+
+
+def preferred_format(accept: Optional[str], formats: list[str]) -> Optional[str]:
+    """
+    The first of formats whose media type the Accept header lists explicitly.
+
+    Wildcards are ignored because browsers send image/* and */* whether or
+    not they can decode a format; a q=0 entry refuses the type.
+    """
+    if not accept:
+        return None
+    accepted = set()
+    for entry in accept.split(","):
+        media_type, *params = [part.strip() for part in entry.split(";")]
+        quality = next((p[2:] for p in params if p.lower().startswith("q=")), "1")
+        try:
+            if float(quality) > 0:
+                accepted.add(media_type.lower())
+        except ValueError:
+            continue
+    return next((format for format in formats if CONTENT_TYPES[format] in accepted), None)
+
+
+def is_derivable(media_file: MediaFile) -> bool:
+    """Whether derivatives are made for this file."""
+    return bool(media_file.content_type) and media_file.content_type.startswith("image/") \
+        and media_file.content_type != "image/svg+xml"
+
+
+async def _derivatives_status(session: AsyncSession, media_file_id: int) -> Optional[str]:
+    result = await session.execute(
+        select(MediaMetadata.value)
+        .where(MediaMetadata.media_file_id == media_file_id, MediaMetadata.key == DERIVATIVES_KEY)
+        .limit(1)
+    )
+    return result.scalar_one_or_none()
+
+
+async def _load_derivatives(session: AsyncSession, media_file_id: int) -> list[MediaDerivative]:
+    result = await session.execute(
+        select(MediaDerivative)
+        .where(MediaDerivative.media_file_id == media_file_id)
+        .order_by(MediaDerivative.size)
+    )
+    return list(result.scalars().all())
+
+
+async def ensure_derivatives(session: AsyncSession, media_file: MediaFile) -> list[MediaDerivative]:
+    """
+    Generate the derivatives of an image unless that has been done already.
+
+    Returns:
+        list[MediaDerivative]: The derivatives, smallest first; empty when
+            the image is not larger than any configured size or cannot be decoded
+    """
+    async with _lock(media_file.id):
+        if await _derivatives_status(session, media_file.id) is None:
+            await _generate(session, media_file)
+        return await _load_derivatives(session, media_file.id)
+
+
+@asynccontextmanager
+async def _original_file(media_file: MediaFile) -> AsyncIterator[str]:
+    """Path of a temporary local copy of the original, removed afterwards."""
+    fd, path = tempfile.mkstemp(prefix="derivative-")
+    os.close(fd)
+    try:
+        await azure_storage.download_to_path(media_file.filename, path)
+        yield path
+    finally:
+        os.remove(path)
+
+
+async def _mark_unsupported(session: AsyncSession, media_file: MediaFile, error: Exception) -> None:
+    logger.warning(f"Not generating derivatives of media file {media_file.id}: {error}")
+    session.add(MediaMetadata(
+        media_file_id=media_file.id,
+        key=DERIVATIVES_KEY,
+        value=DERIVATIVES_UNSUPPORTED,
+        metadata_type="string"
+    ))
+    await session.commit()
+
+
+async def _store(session: AsyncSession, media_file: MediaFile, images: list[RenderedImage]) -> None:
+    """Upload rendered derivatives and record them; the caller commits."""
+    blob_names = [derivative_blob_name(media_file.filename, image.size, image.format) for image in images]
+    await asyncio.gather(*(
+        azure_storage.upload_file(io.BytesIO(image.content), blob_name, image.content_type)
+        for image, blob_name in zip(images, blob_names)
+    ))
+
+    if images:
+        # Another replica may have generated the same derivatives meanwhile
+        await session.execute(
+            insert(MediaDerivative)
+            .values([
+                {
+                    "media_file_id": media_file.id,
+                    "size": image.size,
+                    "format": image.format,
+                    "blob_name": blob_name,
+                    "content_type": image.content_type,
+                    "width": image.width,
+                    "height": image.height,
+                    "file_size": len(image.content),
+                }
+                for image, blob_name in zip(images, blob_names)
+            ])
+            .on_conflict_do_nothing()
+        )
+
+
+async def _generate(session: AsyncSession, media_file: MediaFile) -> None:
+    async with _original_file(media_file) as path:
+        try:
+            rendered = await run_in_process(
+                render_derivatives,
+                path,
+                settings.image_derivative_sizes,
+                settings.image_jpeg_quality,
+                settings.image_max_pixels,
+                format_qualities(),
+            )
+        except (UnidentifiedImageError, ImageTooLarge, OSError) as e:
+            await _mark_unsupported(session, media_file, e)
+            return
+
+    await _store(session, media_file, rendered.images)
+    # Width and height are recorded by src.utils.media_metadata
+    session.add(MediaMetadata(
+        media_file_id=media_file.id,
+        key=DERIVATIVES_KEY,
+        value=DERIVATIVES_READY,
+        metadata_type="string"
+    ))
+    await session.commit()
+    logger.info(f"Generated {len(rendered.images)} derivatives of media file {media_file.id}")
+
+
+def _pick(derivatives: list[MediaDerivative], size: int, format: Optional[str]) -> Optional[MediaDerivative]:
+    """The derivative of exactly size pixels in format, or in its base format without one."""
+    same_size = [d for d in derivatives if d.size == size]
+    return next((d for d in same_size if d.format == format), None) \
+        or next((d for d in same_size if d.format in BASE_FORMATS and format is None), None)
+
+
+async def _generate_requested(
+    session: AsyncSession,
+    media_file: MediaFile,
+    size: int,
+    format: Optional[str]
+) -> Optional[MediaDerivative]:
+    """
+    Generate only the derivative a request needs, and queue the job for the others.
+
+    The derivative is the smallest configured size of at least size pixels,
+    in the base format and, when given, in format.
+
+    Returns:
+        Optional[MediaDerivative]: The derivative in format, or in the base
+            format without one; None when the original should be served
+    """
+    target = min((s for s in settings.image_derivative_sizes if s >= size), default=None)
+    if target is None:
+        return None
+
+    async with _lock(media_file.id):
+        # Generated by a concurrent request
+        derivative = _pick(await _load_derivatives(session, media_file.id), target, format)
+        if derivative is not None:
+            return derivative
+
+        async with _original_file(media_file) as path:
+            try:
+                rendered = await run_in_process(
+                    render_derivatives,
+                    path,
+                    [target],
+                    settings.image_jpeg_quality,
+                    settings.image_max_pixels,
+                    {format: format_qualities()[format]} if format else None,
+                )
+            except (UnidentifiedImageError, ImageTooLarge, OSError) as e:
+                await _mark_unsupported(session, media_file, e)
+                return None
+
+        await _store(session, media_file, rendered.images)
+        await session.commit()
+        derivatives = await _load_derivatives(session, media_file.id)
+
+    try:
+        await job_runner.submit("image_derivatives", {"media_file_id": media_file.id})
+        logger.info(f"Generated the {target} px derivative of media file {media_file.id}, queued the others")
+    except Exception as e:
+        # The next request of another size tries again
+        logger.warning(f"Failed to queue derivatives of media file {media_file.id}: {e}")
+    # An image not larger than target has no derivative of that size
+    return _pick(derivatives, target, format) if rendered.images else None
+
+
+async def _transcode(
+    session: AsyncSession,
+    media_file: MediaFile,
+    base: MediaDerivative,
+    format: str
+) -> MediaDerivative:
+    """Store a derivative in another format, converted from the JPEG or PNG of the same size."""
+    blob_name = derivative_blob_name(media_file.filename, base.size, format)
+    result = await session.execute(select(MediaDerivative).where(MediaDerivative.blob_name == blob_name))
+    existing = result.scalar_one_or_none()
+    if existing is not None:
+        # Converted by a concurrent request
+        return existing
+
+    data = await azure_storage.download_file(base.blob_name)
+    content = await run_in_process(transcode, data, format, format_qualities()[format])
+    await azure_storage.upload_file(io.BytesIO(content), blob_name, CONTENT_TYPES[format])
+    await session.execute(
+        insert(MediaDerivative)
+        .values(
+            media_file_id=base.media_file_id,
+            size=base.size,
+            format=format,
+            blob_name=blob_name,
+            content_type=CONTENT_TYPES[format],
+            width=base.width,
+            height=base.height,
+            file_size=len(content),
+        )
+        .on_conflict_do_nothing()
+    )
+    await session.commit()
+    result = await session.execute(
+        select(MediaDerivative).where(MediaDerivative.blob_name == blob_name)
+    )
+    return result.scalar_one()
+
+
+async def get_derivative(
+    session: AsyncSession,
+    media_file: MediaFile,
+    size: int,
+    accept: Optional[str] = None
+) -> Optional[MediaDerivative]:
+    """
+    The smallest derivative whose longest edge is at least size pixels, in
+    the most preferred format the Accept header allows.
+
+    Returns None when the original should be served instead: when size is
+    larger than every derivative, or the image is too small to have any.
+    """
+    if not is_derivable(media_file):
+        return None
+    format = preferred_format(accept, settings.image_formats)
+    try:
+        if await _derivatives_status(session, media_file.id) is None:
+            return await _generate_requested(session, media_file, size, format)
+        derivatives = await _load_derivatives(session, media_file.id)
+    except Exception as e:
+        logger.error(f"Error generating derivatives of media file {media_file.id}: {e}")
+        await session.rollback()
+        return None
+
+    base = next((d for d in derivatives if d.size >= size and d.format in BASE_FORMATS), None)
+    if base is None:
+        return None
+    if format is None:
+        return base
+
+    variant = next((d for d in derivatives if d.size == base.size and d.format == format), None)
+    if variant is not None:
+        return variant
+    try:
+        async with _lock(media_file.id):
+            return await _transcode(session, media_file, base, format)
+    except Exception as e:
+        logger.error(f"Error converting media file {media_file.id} to {format}: {e}")
+        await session.rollback()
+        return base
@@ -0,0 +1,86 @@
+"""
+HTTP range requests (RFC 9110 section 14).
+
+Only single byte ranges are served as 206 Partial Content; a Range header
+with several ranges, or one that cannot be parsed, is ignored and the full
+content is sent, as the RFC allows.
+"""
+import re
+from typing import Optional
+
+# An entity tag of an If-None-Match list; the opaque part may contain commas
+_ENTITY_TAG = re.compile(r'(?:W/)?"([^"]*)"')
+
+
+class RangeNotSatisfiable(Exception):
+    """The requested range lies outside the content."""
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[tuple[int, int]]:
+    """
+    Parse a Range header against content of the given size.
+
+    Returns:
+        tuple: First and last byte position (inclusive), or None to send the full content
+
+    Raises:
+        RangeNotSatisfiable: If the range does not overlap the content
+    """
+    if not header:
+        return None
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+
+    first, sep, last = ranges.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else max(size - 1, start)
+            if start < 0 or end < start:
+                return None
+        else:
+            # Suffix range: the last N bytes
+            suffix = int(last)
+            if suffix <= 0:
+                raise RangeNotSatisfiable()
+            start, end = max(size - suffix, 0), size - 1
+    except ValueError:
+        return None
+
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+def if_range_matches(if_range: Optional[str], etag: Optional[str], last_modified: Optional[str]) -> bool:
+    """
+    Check an If-Range precondition; a Range header is only honoured when it holds.
+
+    If-Range carries either an entity tag, which must match strongly, or the
+    exact Last-Modified date sent earlier.
+    """
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith(("W/", '"')):
+        return not if_range.startswith("W/") and if_range == etag
+    return if_range == last_modified
+
+
+def if_none_match_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Check an If-None-Match precondition; a match is answered with 304.
+
+    The header is a list of entity tags or "*", compared weakly:
+    W/"x" and "x" match each other.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    match = _ENTITY_TAG.fullmatch(etag)
+    opaque = match.group(1) if match else etag
+    return opaque in _ENTITY_TAG.findall(if_none_match)
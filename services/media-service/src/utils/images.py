@@ -0,0 +1,172 @@
+"""
+Image decoding and re-encoding with Pillow.
+
+The functions here are CPU-bound and meant to run in the process pool; they
+take and return plain bytes and dataclasses so they can be pickled.
+
+Derivatives are downscaled copies whose longest edge fits a target size.
+JPEG sources are decoded at a reduced scale with draft mode when the
+largest target allows it, and every size is resampled from the next larger
+one instead of from the full image. The EXIF orientation is applied so
+derivatives display upright, and metadata such as GPS is not copied.
+
+Each size is encoded as JPEG (PNG for images with transparency) and
+additionally in the requested modern formats (WebP, AVIF), so a resize is
+shared by all encodings of the same size.
+"""
+import io
+from dataclasses import dataclass
+from typing import Mapping, Optional, Sequence
+
+from PIL import Image, ImageOps
+
+CONTENT_TYPES = {
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "webp": "image/webp",
+    "avif": "image/avif",
+}
+
+ORIENTATION_TAG = 0x0112
+# EXIF orientations that swap width and height
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+class ImageTooLarge(Exception):
+    """The image has more pixels than allowed."""
+
+    def __init__(self, width: int, height: int):
+        super().__init__(f"{width}x{height} pixels")
+        self.width = width
+        self.height = height
+
+
+@dataclass
+class RenderedImage:
+    size: int
+    width: int
+    height: int
+    format: str
+    content_type: str
+    content: bytes
+
+
+@dataclass
+class RenderedDerivatives:
+    # Dimensions of the original as displayed, i.e. after applying the orientation
+    width: int
+    height: int
+    images: list[RenderedImage]
+
+
+def has_alpha(image: Image.Image) -> bool:
+    return image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+
+
+def oriented_size(image: Image.Image) -> tuple[int, int]:
+    """Width and height of an opened (not yet decoded) image once its EXIF orientation is applied."""
+    width, height = image.size
+    if image.getexif().get(ORIENTATION_TAG) in TRANSPOSED_ORIENTATIONS:
+        return height, width
+    return width, height
+
+
+def open_image(path: str, max_pixels: int) -> Image.Image:
+    """
+    Open an image without decoding it.
+
+    Raises:
+        ImageTooLarge: If the image has more than max_pixels pixels
+        PIL.UnidentifiedImageError: If the file is not a supported image
+    """
+    # Pillow's own limit would reject large survey scans before ours applies
+    Image.MAX_IMAGE_PIXELS = None
+    image = Image.open(path)
+    width, height = image.size
+    if width * height > max_pixels:
+        raise ImageTooLarge(width, height)
+    return image
+
+
+def encode(image: Image.Image, format: str, quality: int, icc_profile=None) -> bytes:
+    """Encode an image as one of CONTENT_TYPES; quality is ignored for PNG."""
+    buffer = io.BytesIO()
+    options = {"icc_profile": icc_profile} if icc_profile else {}
+    if format == "jpeg":
+        image.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True, **options)
+    elif format == "webp":
+        image.save(buffer, "WEBP", quality=quality, method=4, **options)
+    elif format == "avif":
+        image.save(buffer, "AVIF", quality=quality, **options)
+    else:
+        image.save(buffer, "PNG", optimize=True, **options)
+    return buffer.getvalue()
+
+
+def transcode(data: bytes, format: str, quality: int) -> bytes:
+    """Re-encode an already downscaled image in another format."""
+    image = Image.open(io.BytesIO(data))
+    icc_profile = image.info.get("icc_profile")
+    image = image.convert("RGBA" if has_alpha(image) else "RGB")
+    return encode(image, format, quality, icc_profile)
+
+
+def render_derivatives(
+    path: str,
+    sizes: Sequence[int],
+    quality: int,
+    max_pixels: int,
+    formats: Optional[Mapping[str, int]] = None,
+) -> RenderedDerivatives:
+    """
+    Downscale an image to each size that is smaller than the image.
+
+    Images with transparency become PNG, all others JPEG.
+
+    Args:
+        path: Local copy of the original image
+        sizes: Bounding sizes of the longest edge in pixels
+        quality: JPEG quality
+        max_pixels: Largest image that is decoded
+        formats: Further formats ("webp", "avif") to encode every size in, with their quality
+
+    Returns:
+        RenderedDerivatives: Original dimensions and the encoded derivatives, largest first,
+            the base format before the further formats of each size
+    """
+    image = open_image(path, max_pixels)
+    width, height = oriented_size(image)
+    targets = sorted((s for s in set(sizes) if s < max(width, height)), reverse=True)
+    if not targets:
+        return RenderedDerivatives(width=width, height=height, images=[])
+
+    # A CMYK profile does not describe the converted RGB pixels
+    icc_profile = image.info.get("icc_profile") if image.mode != "CMYK" else None
+    if image.format == "JPEG":
+        # Decode at the smallest 1/2^n scale that still covers the largest target
+        image.draft("RGB", (targets[0], targets[0]))
+    image = ImageOps.exif_transpose(image)
+
+    if has_alpha(image):
+        base_format = "png"
+        image = image.convert("RGBA")
+    else:
+        base_format = "jpeg"
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+    encodings = {base_format: quality, **(formats or {})}
+
+    rendered = []
+    for size in targets:
+        image = image.copy()
+        image.thumbnail((size, size), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        for format, format_quality in encodings.items():
+            rendered.append(RenderedImage(
+                size=size,
+                width=image.width,
+                height=image.height,
+                format=format,
+                content_type=CONTENT_TYPES[format],
+                content=encode(image, format, format_quality, icc_profile),
+            ))
+    return RenderedDerivatives(width=width, height=height, images=rendered)
@@ -0,0 +1,115 @@
+"""
+Background job handlers of media-service.
+
+    cave_deletion       Delete the media files and blobs of a deleted cave
+    image_derivatives   Generate the downscaled copies of an uploaded image
+    media_metadata      Extract the metadata of an uploaded file, queue its derivatives or tiles and
+                        optionally link it to the nearest cave
+    metadata_backfill   Extract the metadata of all files lacking the current version
+    tile_pyramid        Build the zoomable tiles of a large image or PDF
+"""
+from typing import Any
+from src.db.connection import async_session
+from src.models.media import MediaFile
+from src.utils.cave_deletion_handler import CaveDeletionHandler
+from src.utils.cave_suggestions import associate_nearest_cave
+from src.utils.derivatives import ensure_derivatives, is_derivable
+from src.utils.jobs import JobContext, JobRunner, job_runner
+from src.utils.media_metadata import backfill_metadata, store_metadata
+from src.utils.tiles import PDF_CONTENT_TYPE, build_tile_pyramid, needs_tile_pyramid, request_tile_pyramid
+
+
+async def cave_deletion_job(context: JobContext, payload: dict[str, Any]) -> None:
+    """Delete the media of a deleted cave, reporting progress per file."""
+    async def on_progress(handled: int, total: int) -> None:
+        await context.progress(handled, total)
+
+    await CaveDeletionHandler().handle_cave_deletion(
+        payload["cave_id"],
+        payload.get("cave_name", "Unknown"),
+        payload.get("owner_email"),
+        payload.get("media_file_ids", []),
+        on_progress=on_progress,
+    )
+
+
+async def image_derivatives_job(context: JobContext, payload: dict[str, Any]) -> dict[str, Any]:
+    """
+    Generate the derivatives of an image; a file deleted meanwhile is skipped.
+
+    Images found to be larger than settings.tile_min_size are queued for a tile pyramid.
+    """
+    async with async_session() as session:
+        media_file = await session.get(MediaFile, payload["media_file_id"])
+        if media_file is None:
+            return {"derivatives": 0}
+        derivatives = await ensure_derivatives(session, media_file)
+        if await needs_tile_pyramid(session, media_file):
+            await request_tile_pyramid(session, media_file)
+    return {"derivatives": len(derivatives)}
+
+
+async def media_metadata_job(context: JobContext, payload: dict[str, Any]) -> dict[str, Any]:
+    """
+    Extract the metadata of an uploaded file, then queue the work that depends on it.
+
+    Derivatives and tiles are queued even when extraction fails, since they
+    are also generated when first requested. With associate_within_m in the
+    payload, the file is also linked to the nearest cave its owner may edit.
+    """
+    async with async_session() as session:
+        media_file = await session.get(MediaFile, payload["media_file_id"])
+        if media_file is None:
+            return {"metadata": 0}
+        derivable, tileable = is_derivable(media_file), media_file.content_type == PDF_CONTENT_TYPE
+        try:
+            entries = await store_metadata(session, media_file)
+        except Exception:
+            await session.rollback()
+            raise
+        finally:
+            if derivable:
+                await job_runner.submit("image_derivatives", {"media_file_id": payload["media_file_id"]})
+            elif tileable:
+                await request_tile_pyramid(session, await session.get(MediaFile, payload["media_file_id"]))
+
+        result = {"metadata": len(entries)}
+        if payload.get("associate_within_m"):
+            result["associated_cave_id"] = await associate_nearest_cave(
+                session,
+                media_file.id,
+                payload["owner_email"],
+                payload["associate_within_m"],
+                upload_cave_id=payload.get("cave_id"),
+            )
+    return result
+
+
+async def metadata_backfill_job(context: JobContext, payload: dict[str, Any]) -> dict[str, Any]:
+    """Extract metadata of every file without the current version, reporting progress per batch."""
+    async def on_progress(done: int, total: int) -> None:
+        await context.progress(done, total)
+
+    async with async_session() as session:
+        return await backfill_metadata(session, on_progress=on_progress)
+
+
+async def tile_pyramid_job(context: JobContext, payload: dict[str, Any]) -> dict[str, Any]:
+    """Build the tile pyramid of a file, reporting progress per row of tiles."""
+    async def on_progress(stored: int, total: int) -> None:
+        await context.progress(stored, total)
+
+    async with async_session() as session:
+        media_file = await session.get(MediaFile, payload["media_file_id"])
+        if media_file is None:
+            return {"tiles": 0}
+        tile_pyramid = await build_tile_pyramid(session, media_file, on_progress=on_progress)
+        return {"tiles": tile_pyramid.tile_count, "max_zoom": tile_pyramid.max_zoom}
+
+
+def register_job_handlers(runner: JobRunner) -> None:
+    runner.register("cave_deletion", cave_deletion_job)
+    runner.register("image_derivatives", image_derivatives_job)
+    runner.register("media_metadata", media_metadata_job)
+    runner.register("metadata_backfill", metadata_backfill_job)
+    runner.register("tile_pyramid", tile_pyramid_job)
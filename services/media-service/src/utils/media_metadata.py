@@ -0,0 +1,277 @@
+"""
+Technical metadata extracted from stored files.
+
+Files are opened through azure_storage.open_reader, so the parsers only
+download the byte ranges they read: Pillow reads an image's header and
+EXIF block without decoding pixels, and pdfium reads a PDF's trailer and
+page tree. Parsing runs in worker threads.
+
+Images get width and height as displayed (after the EXIF orientation),
+orientation, taken_at, camera_make, camera_model and gps_latitude,
+gps_longitude and gps_altitude when present; PDFs get page_count. Every
+processed file is marked with metadata_version, which the backfill uses to
+find files that still need extracting.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, BinaryIO, Callable, Optional
+
+from PIL import Image, UnidentifiedImageError
+from sqlalchemy import delete, func, insert, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.config.settings import settings
+from src.models.media import MediaFile, MediaMetadata
+from src.schemas.media import MediaMetadataCreate
+from src.utils.azure_storage import azure_storage
+
+logger = logging.getLogger(__name__)
+
+METADATA_VERSION_KEY = "metadata_version"
+# Raise to extract again from all files with the backfill
+METADATA_VERSION = "1"
+BACKFILL_BATCH_SIZE = 100
+
+# EXIF tags and IFDs
+EXIF_IFD = 0x8769
+GPS_IFD = 0x8825
+MAKE = 0x010F
+MODEL = 0x0110
+ORIENTATION = 0x0112
+DATE_TIME = 0x0132
+DATE_TIME_ORIGINAL = 0x9003
+OFFSET_TIME = 0x9010
+OFFSET_TIME_ORIGINAL = 0x9011
+GPS_LATITUDE_REF = 1
+GPS_LATITUDE = 2
+GPS_LONGITUDE_REF = 3
+GPS_LONGITUDE = 4
+GPS_ALTITUDE_REF = 5
+GPS_ALTITUDE = 6
+GPS_STATUS = 9
+
+# EXIF orientations that swap width and height
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+def _entry(key: str, value: Any, metadata_type: str = "string") -> MediaMetadataCreate:
+    return MediaMetadataCreate(key=key, value=str(value), metadata_type=metadata_type)
+
+
+def _text(value: Any) -> Optional[str]:
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", errors="replace")
+    if not isinstance(value, str):
+        return None
+    value = value.strip("\x00 ")
+    return value or None
+
+
+def _timestamp(value: Any, offset: Any) -> Optional[str]:
+    """ISO 8601 time of an EXIF "YYYY:MM:DD HH:MM:SS" value and optional "+HH:MM" offset."""
+    text = _text(value)
+    if text is None:
+        return None
+    try:
+        taken_at = datetime.strptime(text[:19], "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+    offset = _text(offset)
+    if offset and len(offset) == 6 and offset[0] in "+-":
+        return taken_at.isoformat() + offset
+    return taken_at.isoformat()
+
+
+def _degrees(value: Any, ref: Any, negative_ref: str) -> Optional[float]:
+    """Decimal degrees of an EXIF (degrees, minutes, seconds) rational triple."""
+    try:
+        degrees, minutes, seconds = (float(part) for part in value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    result = degrees + minutes / 60 + seconds / 3600
+    if result != result:  # NaN from a zero denominator
+        return None
+    return -result if _text(ref) == negative_ref else result
+
+
+def _gps_entries(gps: dict) -> list[MediaMetadataCreate]:
+    if not gps or _text(gps.get(GPS_STATUS)) == "V":
+        return []
+    latitude = _degrees(gps.get(GPS_LATITUDE), gps.get(GPS_LATITUDE_REF), "S")
+    longitude = _degrees(gps.get(GPS_LONGITUDE), gps.get(GPS_LONGITUDE_REF), "W")
+    # Cameras without a fix often write zeros
+    if latitude is None or longitude is None or (latitude == 0 and longitude == 0):
+        return []
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return []
+
+    entries = [
+        _entry("gps_latitude", round(latitude, 7), "number"),
+        _entry("gps_longitude", round(longitude, 7), "number"),
+    ]
+    try:
+        altitude = float(gps[GPS_ALTITUDE])
+        if altitude == altitude:
+            # Reference 1 means below sea level
+            if gps.get(GPS_ALTITUDE_REF) in (1, b"\x01"):
+                altitude = -altitude
+            entries.append(_entry("gps_altitude", round(altitude, 1), "number"))
+    except (KeyError, TypeError, ValueError, ZeroDivisionError):
+        pass
+    return entries
+
+
+def extract_image_metadata(file: BinaryIO) -> list[MediaMetadataCreate]:
+    """Dimensions and EXIF data of an image, read from its header."""
+    Image.MAX_IMAGE_PIXELS = None
+    with Image.open(file) as image:
+        width, height = image.size
+        # A PNG's EXIF chunk can follow the pixel data, and getexif() would decode them to find it
+        exif = image.getexif() if image.format != "PNG" or "exif" in image.info else Image.Exif()
+
+        orientation = exif.get(ORIENTATION)
+        if orientation in TRANSPOSED_ORIENTATIONS:
+            width, height = height, width
+        entries = [_entry("width", width, "number"), _entry("height", height, "number")]
+        if isinstance(orientation, int) and 1 <= orientation <= 8:
+            entries.append(_entry("orientation", orientation, "number"))
+
+        exif_ifd = exif.get_ifd(EXIF_IFD)
+        taken_at = _timestamp(exif_ifd.get(DATE_TIME_ORIGINAL), exif_ifd.get(OFFSET_TIME_ORIGINAL)) \
+            or _timestamp(exif.get(DATE_TIME), exif_ifd.get(OFFSET_TIME))
+        if taken_at:
+            entries.append(_entry("taken_at", taken_at))
+        for key, tag in (("camera_make", MAKE), ("camera_model", MODEL)):
+            value = _text(exif.get(tag))
+            if value:
+                entries.append(_entry(key, value))
+        entries.extend(_gps_entries(exif.get_ifd(GPS_IFD)))
+    return entries
+
+
+def extract_pdf_metadata(file: BinaryIO) -> list[MediaMetadataCreate]:
+    """Page count of a PDF, read from its trailer and page tree."""
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(file)
+    try:
+        return [_entry("page_count", len(pdf), "number")]
+    finally:
+        pdf.close()
+
+
+def has_extractor(content_type: Optional[str]) -> bool:
+    return bool(content_type) and (
+        content_type == "application/pdf"
+        or (content_type.startswith("image/") and content_type != "image/svg+xml")
+    )
+
+
+async def extract_metadata(media_file: MediaFile) -> list[MediaMetadataCreate]:
+    """
+    Extract the metadata of a stored file.
+
+    Files that cannot be parsed only get the metadata_version marker, so they
+    are not read again.
+    """
+    entries = []
+    if has_extractor(media_file.content_type):
+        extractor = extract_pdf_metadata if media_file.content_type == "application/pdf" else extract_image_metadata
+        reader = await azure_storage.open_reader(media_file.filename, settings.metadata_read_block_size)
+        loop = asyncio.get_event_loop()
+        try:
+            entries = await loop.run_in_executor(None, extractor, reader)
+        except (UnidentifiedImageError, OSError, ValueError, SyntaxError) as e:
+            logger.warning(f"Could not read metadata of media file {media_file.id}: {e}")
+        except Exception as e:
+            # pdfium raises its own error types for damaged files
+            if type(e).__module__.startswith("pypdfium2"):
+                logger.warning(f"Could not read metadata of media file {media_file.id}: {e}")
+            else:
+                raise
+        logger.info(f"Read {reader.bytes_fetched} of {reader.size} bytes of media file {media_file.id} for metadata")
+    entries.append(_entry(METADATA_VERSION_KEY, METADATA_VERSION))
+    return entries
+
+
+async def write_metadata(session: AsyncSession, entries: dict[int, list[MediaMetadataCreate]]) -> None:
+    """
+    Set metadata of several files with one DELETE and one INSERT.
+
+    Existing values of the keys being written are replaced; other keys are
+    kept. The caller commits.
+    """
+    pairs = [(media_file_id, entry.key) for media_file_id, items in entries.items() for entry in items]
+    if not pairs:
+        return
+    await session.execute(
+        delete(MediaMetadata).where(tuple_(MediaMetadata.media_file_id, MediaMetadata.key).in_(pairs))
+    )
+    await session.execute(
+        insert(MediaMetadata),
+        [
+            {"media_file_id": media_file_id, **entry.model_dump()}
+            for media_file_id, items in entries.items()
+            for entry in items
+        ]
+    )
+
+
+async def store_metadata(session: AsyncSession, media_file: MediaFile) -> list[MediaMetadataCreate]:
+    """Extract and store the metadata of one file."""
+    entries = await extract_metadata(media_file)
+    await write_metadata(session, {media_file.id: entries})
+    await session.commit()
+    return entries
+
+
+async def backfill_metadata(
+    session: AsyncSession,
+    on_progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+) -> dict[str, Any]:
+    """
+    Extract metadata for every file without the current metadata_version.
+
+    Files are processed in keyset-paginated batches; the files of a batch
+    are read settings.metadata_concurrency at a time and their metadata is
+    written and committed together.
+    """
+    current = select(MediaMetadata.media_file_id).where(
+        MediaMetadata.key == METADATA_VERSION_KEY,
+        MediaMetadata.value == METADATA_VERSION
+    )
+    query = select(MediaFile).where(MediaFile.id.not_in(current))
+    total = await session.scalar(select(func.count()).select_from(query.subquery()))
+
+    done = extracted = failed = 0
+    last_id = 0
+    slots = asyncio.Semaphore(settings.metadata_concurrency)
+
+    async def extract(media_file: MediaFile) -> Optional[list[MediaMetadataCreate]]:
+        async with slots:
+            try:
+                return await extract_metadata(media_file)
+            except Exception as e:
+                logger.error(f"Error extracting metadata of media file {media_file.id}: {e}")
+                return None
+
+    while True:
+        result = await session.execute(query.where(MediaFile.id > last_id).order_by(MediaFile.id).limit(BACKFILL_BATCH_SIZE))
+        files = result.scalars().all()
+        if not files:
+            break
+        last_id = files[-1].id
+
+        results = await asyncio.gather(*(extract(media_file) for media_file in files))
+        entries = {media_file.id: items for media_file, items in zip(files, results) if items is not None}
+        await write_metadata(session, entries)
+        await session.commit()
+
+        extracted += len(entries)
+        failed += len(files) - len(entries)
+        done += len(files)
+        if on_progress is not None:
+            await on_progress(done, total)
+
+    return {"extracted": extracted, "failed": failed}
@@ -0,0 +1,196 @@
+"""
+Tile pyramids of large images and PDF sheets.
+
+The functions here run in the process pool and only exchange paths,
+dataclasses and encoded tiles with the caller.
+
+The source is first turned into an uncompressed raster file on disk that
+every worker memory-maps. A PDF page is rendered into it in horizontal
+strips, each by its own worker; an image is decoded once and copied into it
+strip by strip. Each pyramid level is then built one row of tiles at a
+time: a worker reads the strip of the level above that the row covers,
+halves it into the level's own raster file and encodes the row's tiles.
+Rows of one level are independent, so they are built in parallel, and a
+worker holds at most one strip of a level in memory.
+
+Levels are numbered like XYZ map tiles: level 0 is a single tile holding
+the whole image and every further level doubles the resolution, up to
+max_zoom at full resolution. Tiles at the right and bottom edges are padded
+to the full tile size with white (JPEG) or transparency (PNG).
+"""
+import math
+import os
+from dataclasses import dataclass, replace
+from typing import Optional
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from src.utils.images import ImageTooLarge, encode, has_alpha
+
+# Pillow modes of rasters with 1, 3 and 4 channels
+CHANNEL_MODES = {1: "L", 3: "RGB", 4: "RGBA"}
+PDF_POINTS_PER_INCH = 72
+
+
+@dataclass
+class Raster:
+    """Uncompressed 8-bit raster stored row by row in a file."""
+    path: str
+    width: int
+    height: int
+    channels: int
+
+    @property
+    def mode(self) -> str:
+        return CHANNEL_MODES[self.channels]
+
+
+def open_raster(raster: Raster, mode: str = "r") -> np.memmap:
+    return np.memmap(raster.path, dtype=np.uint8, mode=mode, shape=(raster.height, raster.width, raster.channels))
+
+
+def allocate_raster(raster: Raster) -> None:
+    """Create the file of a raster; it stays sparse until written."""
+    with open(raster.path, "wb") as f:
+        f.truncate(raster.height * raster.width * raster.channels)
+
+
+def max_zoom(width: int, height: int, tile_size: int) -> int:
+    """Level at which the image is at full resolution."""
+    return max(0, math.ceil(math.log2(max(width, height) / tile_size)))
+
+
+def level_raster(parent: Raster, path: str) -> Raster:
+    """The level below parent, at half its resolution (rounded up)."""
+    return replace(parent, path=path, width=(parent.width + 1) // 2, height=(parent.height + 1) // 2)
+
+
+def tile_format(raster: Raster) -> str:
+    return "png" if raster.channels == 4 else "jpeg"
+
+
+def decode_image(source_path: str, raster_path: str, max_pixels: int, strip_rows: int) -> Raster:
+    """
+    Decode an image into a raster file, upright and as L, RGB or RGBA.
+
+    Raises:
+        ImageTooLarge: If the image has more than max_pixels pixels
+        PIL.UnidentifiedImageError: If the file is not a supported image
+    """
+    Image.MAX_IMAGE_PIXELS = None
+    with Image.open(source_path) as image:
+        if image.width * image.height > max_pixels:
+            raise ImageTooLarge(image.width, image.height)
+        ImageOps.exif_transpose(image, in_place=True)
+        if has_alpha(image):
+            mode = "RGBA"
+        elif image.mode in ("1", "L"):
+            mode = "L"
+        else:
+            mode = "RGB"
+
+        raster = Raster(raster_path, image.width, image.height, len(mode))
+        allocate_raster(raster)
+        pixels = open_raster(raster, "r+")
+        # Converting strip by strip never holds a second full-size copy
+        for top in range(0, raster.height, strip_rows):
+            bottom = min(top + strip_rows, raster.height)
+            strip = image.crop((0, top, raster.width, bottom)).convert(mode)
+            pixels[top:bottom] = np.asarray(strip).reshape(bottom - top, raster.width, raster.channels)
+        pixels.flush()
+    return raster
+
+
+def pdf_raster(source_path: str, raster_path: str, dpi: int, max_pixels: int) -> tuple[Raster, float]:
+    """
+    Size of the raster of the first page of a PDF at dpi, reduced to fit max_pixels.
+
+    Returns:
+        tuple: The raster, not yet allocated, and the scale in pixels per PDF point
+    """
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(source_path)
+    try:
+        width_pt, height_pt = pdf[0].get_size()
+    finally:
+        pdf.close()
+    scale = dpi / PDF_POINTS_PER_INCH
+    scale = min(scale, math.sqrt(max_pixels / (width_pt * height_pt)))
+    raster = Raster(raster_path, max(1, round(width_pt * scale)), max(1, round(height_pt * scale)), 3)
+    return raster, scale
+
+
+def render_pdf_strip(source_path: str, raster: Raster, scale: float, top: int, bottom: int) -> None:
+    """Render rows top..bottom-1 of the first page of a PDF into its raster."""
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(source_path)
+    try:
+        page = pdf[0]
+        _, height_pt = page.get_size()
+        # Crop margins are in points from the left, bottom, right and top edges
+        crop = (0, height_pt - bottom / scale, 0, top / scale)
+        bitmap = page.render(scale=scale, crop=crop, rev_byteorder=True, may_draw_forms=True)
+        strip = bitmap.to_numpy()[:, :, :3]
+    finally:
+        pdf.close()
+
+    # The rendered strip can be a pixel off the requested size due to rounding
+    rows = min(bottom - top, strip.shape[0])
+    columns = min(raster.width, strip.shape[1])
+    pixels = open_raster(raster, "r+")
+    pixels[top:top + rows, :columns] = strip[:rows, :columns]
+    pixels.flush()
+
+
+def _to_image(pixels: np.ndarray) -> Image.Image:
+    """Image of a (rows, columns, channels) array."""
+    return Image.fromarray(np.ascontiguousarray(pixels[:, :, 0] if pixels.shape[2] == 1 else pixels))
+
+
+def build_tile_row(
+    level: Raster,
+    parent: Optional[Raster],
+    row: int,
+    tile_size: int,
+    quality: int
+) -> list[bytes]:
+    """
+    Encode one row of tiles of a level, left to right.
+
+    When parent is given, the rows of the level the tiles cover are first
+    computed by halving the parent and stored in the level's raster.
+    """
+    top = row * tile_size
+    bottom = min(top + tile_size, level.height)
+    if parent is None:
+        strip = np.array(open_raster(level)[top:bottom])
+    else:
+        parent_strip = open_raster(parent)[2 * top:min(2 * bottom, parent.height)]
+        image = _to_image(parent_strip)
+        # Box reduction rounds up, so odd edges keep their last pixel
+        strip = np.asarray(image.reduce(2)).reshape(bottom - top, level.width, level.channels)
+        pixels = open_raster(level, "r+")
+        pixels[top:bottom] = strip
+        pixels.flush()
+
+    format = tile_format(level)
+    background = {1: 255, 3: (255, 255, 255), 4: (0, 0, 0, 0)}[level.channels]
+    tiles = []
+    for left in range(0, level.width, tile_size):
+        image = _to_image(strip[:, left:left + tile_size])
+        if image.size != (tile_size, tile_size):
+            padded = Image.new(level.mode, (tile_size, tile_size), background)
+            padded.paste(image, (0, 0))
+            image = padded
+        tiles.append(encode(image, format, quality))
+    return tiles
+
+
+def remove_raster(raster: Raster) -> None:
+    try:
+        os.remove(raster.path)
+    except FileNotFoundError:
+        pass
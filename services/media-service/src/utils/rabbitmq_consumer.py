@@ -5,7 +5,7 @@ from typing import Optional, Dict, Any
 import aio_pika
 from aio_pika import connect_robust, ExchangeType
 from src.config.settings import settings
-from src.utils.cave_deletion_handler import CaveDeletionHandler
+from src.utils.jobs import job_runner
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
 logger = logging.getLogger(__name__)
@@ -22,11 +22,8 @@ class MessageHandler:
 class CaveDeletionMessageHandler(MessageHandler):
     """Handler for cave deletion events"""
 
-    def __init__(self):
-        self.deletion_handler = CaveDeletionHandler()
-
     async def handle(self, event_data: Dict[str, Any]) -> None:
-        """Handle cave deletion event"""
+        """Queue a job removing the media files of the deleted cave"""
         cave_id = event_data.get('caveId')
         cave_name = event_data.get('caveName', 'Unknown')
         owner_email = event_data.get('ownerEmail')
@@ -35,7 +32,13 @@ class CaveDeletionMessageHandler(MessageHandler):
         if not cave_id:
             raise ValueError("Cave deletion event missing caveId field")
 
-        await self.deletion_handler.handle_cave_deletion(cave_id, cave_name, owner_email, media_file_ids)
+        job = await job_runner.submit("cave_deletion", {
+            "cave_id": cave_id,
+            "cave_name": cave_name,
+            "owner_email": owner_email,
+            "media_file_ids": media_file_ids,
+        })
+        logger.info(f"Queued cave deletion job {job.job_id} for cave {cave_id}")
 
 
 class RabbitMQConsumer:
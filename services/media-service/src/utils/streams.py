@@ -0,0 +1,14 @@
+"""Helpers for byte streams."""
+from typing import AsyncIterable, AsyncIterator
+
+
+async def rechunk(stream: AsyncIterable[bytes], chunk_size: int) -> AsyncIterator[bytes]:
+    """Regroup a byte stream into chunks of chunk_size bytes; only the last one may be shorter."""
+    buffer = bytearray()
+    async for piece in stream:
+        buffer += piece
+        while len(buffer) >= chunk_size:
+            yield bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+    if buffer:
+        yield bytes(buffer)
@@ -0,0 +1,267 @@
+"""
+Tile pyramids for zooming into large images and PDF survey sheets.
+
+A pyramid is built by the tile_pyramid background job: the file is
+downloaded to settings.tile_work_dir and the levels are built by
+src.utils.pyramid in the process pool, one row of tiles per task, while the
+finished rows are uploaded as blobs. Rows are submitted only as fast as the
+pool works through them, so encoded tiles do not pile up in memory.
+
+Requesting the tiles of a file queues the job again when its pyramid
+failed at least settings.tile_retry_minutes ago, or is still processing
+although no tile_pyramid job for it is queued or running.
+"""
+import asyncio
+import io
+import logging
+import math
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.config.settings import settings
+from src.models.job import Job, JobStatus
+from src.models.media import MediaFile, MediaMetadata, TilePyramid, TilePyramidStatus
+from src.utils.azure_storage import azure_storage
+from src.utils.images import CONTENT_TYPES
+from src.utils.jobs import job_runner
+from src.utils.process_pool import run_in_process
+from src.utils import pyramid
+
+logger = logging.getLogger(__name__)
+
+PDF_CONTENT_TYPE = "application/pdf"
+
+
+def tile_prefix(filename: str) -> str:
+    """Blob name prefix of all tiles of a media file."""
+    return f"tiles/{filename}/"
+
+
+def tile_blob_name(filename: str, z: int, x: int, y: int, format: str) -> str:
+    extension = "jpg" if format == "jpeg" else format
+    return f"{tile_prefix(filename)}{z}/{x}/{y}.{extension}"
+
+
+def is_tileable(media_file: MediaFile) -> bool:
+    """Whether a pyramid can be built for this file, if it is large enough."""
+    return media_file.content_type == PDF_CONTENT_TYPE or (
+        bool(media_file.content_type)
+        and media_file.content_type.startswith("image/")
+        and media_file.content_type != "image/svg+xml"
+    )
+
+
+async def needs_tile_pyramid(session: AsyncSession, media_file: MediaFile) -> bool:
+    """
+    Whether the file should get a pyramid: PDFs always, images when their
+    recorded size exceeds settings.tile_min_size.
+    """
+    if media_file.content_type == PDF_CONTENT_TYPE:
+        return True
+    if not is_tileable(media_file):
+        return False
+    result = await session.execute(
+        select(MediaMetadata.value)
+        .where(MediaMetadata.media_file_id == media_file.id, MediaMetadata.key.in_(("width", "height")))
+    )
+    return any(int(value) > settings.tile_min_size for value in result.scalars())
+
+
+async def get_tile_pyramid(session: AsyncSession, media_file_id: int) -> Optional[TilePyramid]:
+    result = await session.execute(select(TilePyramid).where(TilePyramid.media_file_id == media_file_id))
+    return result.scalar_one_or_none()
+
+
+async def _has_live_job(session: AsyncSession, media_file_id: int) -> bool:
+    """Whether a tile_pyramid job for the file is queued or running."""
+    result = await session.execute(
+        select(Job.job_id)
+        .where(
+            Job.job_type == "tile_pyramid",
+            Job.status.in_((JobStatus.QUEUED, JobStatus.RUNNING)),
+            Job.payload["media_file_id"].as_integer() == media_file_id,
+        )
+        .limit(1)
+    )
+    return result.first() is not None
+
+
+async def _needs_retry(session: AsyncSession, tile_pyramid: TilePyramid) -> bool:
+    if tile_pyramid.status == TilePyramidStatus.FAILED:
+        retry_after = timedelta(minutes=settings.tile_retry_minutes)
+        return tile_pyramid.completed_at is None or datetime.utcnow() - tile_pyramid.completed_at >= retry_after
+    if tile_pyramid.status == TilePyramidStatus.PROCESSING:
+        return not await _has_live_job(session, tile_pyramid.media_file_id)
+    return False
+
+
+async def request_tile_pyramid(session: AsyncSession, media_file: MediaFile) -> TilePyramid:
+    """
+    The pyramid of a file, queueing the tile_pyramid job if it has none yet
+    or its last build failed or never ran.
+
+    The pyramid row is created, or reset with a conditional UPDATE on the
+    state that was read, before the job is queued, so concurrent requests
+    queue one job.
+    """
+    result = await session.execute(
+        insert(TilePyramid)
+        .values(media_file_id=media_file.id, status=TilePyramidStatus.PROCESSING, tile_size=settings.tile_size, tile_count=0)
+        .on_conflict_do_nothing()
+        .returning(TilePyramid.id)
+    )
+    queue = result.scalar_one_or_none() is not None
+    await session.commit()
+    tile_pyramid = await get_tile_pyramid(session, media_file.id)
+
+    if not queue and await _needs_retry(session, tile_pyramid):
+        # created_at is when the build was last requested
+        result = await session.execute(
+            update(TilePyramid)
+            .where(
+                TilePyramid.id == tile_pyramid.id,
+                TilePyramid.status == tile_pyramid.status,
+                TilePyramid.created_at == tile_pyramid.created_at,
+            )
+            .values(status=TilePyramidStatus.PROCESSING, error=None, created_at=datetime.utcnow())
+            .returning(TilePyramid.id)
+        )
+        queue = result.scalar_one_or_none() is not None
+        await session.commit()
+        await session.refresh(tile_pyramid)
+
+    if queue:
+        try:
+            await job_runner.submit("tile_pyramid", {"media_file_id": media_file.id})
+        except Exception:
+            # Let the next request try again
+            await session.delete(tile_pyramid)
+            await session.commit()
+            raise
+    return tile_pyramid
+
+
+async def _rasterize(media_file: MediaFile, source_path: str, raster_path: str) -> pyramid.Raster:
+    """Decode the image or render the first PDF page into a raster file."""
+    strip_rows = settings.tile_size * 4
+    if media_file.content_type != PDF_CONTENT_TYPE:
+        return await run_in_process(
+            pyramid.decode_image, source_path, raster_path, settings.tile_max_pixels, strip_rows
+        )
+
+    raster, scale = await run_in_process(
+        pyramid.pdf_raster, source_path, raster_path, settings.tile_pdf_dpi, settings.tile_max_pixels
+    )
+    pyramid.allocate_raster(raster)
+    await asyncio.gather(*(
+        run_in_process(pyramid.render_pdf_strip, source_path, raster, scale, top, min(top + strip_rows, raster.height))
+        for top in range(0, raster.height, strip_rows)
+    ))
+    return raster
+
+
+async def build_tile_pyramid(
+    session: AsyncSession,
+    media_file: MediaFile,
+    on_progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+) -> TilePyramid:
+    """
+    Build and store the tile pyramid of a file, replacing an earlier one.
+
+    Args:
+        session: Database session
+        media_file: Image or PDF to tile
+        on_progress: Awaited with (tiles stored, total tiles) after every row of tiles
+
+    Returns:
+        TilePyramid: The ready pyramid; a failure is recorded on it and re-raised
+    """
+    tile_pyramid = await get_tile_pyramid(session, media_file.id)
+    if tile_pyramid is None:
+        tile_pyramid = TilePyramid(media_file_id=media_file.id, tile_size=settings.tile_size)
+        session.add(tile_pyramid)
+    tile_pyramid.status = TilePyramidStatus.PROCESSING
+    tile_pyramid.tile_size = settings.tile_size
+    tile_pyramid.tile_count = 0
+    tile_pyramid.error = None
+    await session.commit()
+    await azure_storage.delete_prefix(tile_prefix(media_file.filename))
+
+    os.makedirs(settings.tile_work_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(dir=settings.tile_work_dir)
+    try:
+        source_path = os.path.join(work_dir, "source")
+        await azure_storage.download_to_path(media_file.filename, source_path)
+        raster = await _rasterize(media_file, source_path, os.path.join(work_dir, "raster"))
+        os.remove(source_path)
+
+        tile_size = settings.tile_size
+        top_zoom = pyramid.max_zoom(raster.width, raster.height, tile_size)
+        format = pyramid.tile_format(raster)
+        total = sum(
+            math.ceil(math.ceil(raster.width / 2 ** (top_zoom - z)) / tile_size)
+            * math.ceil(math.ceil(raster.height / 2 ** (top_zoom - z)) / tile_size)
+            for z in range(top_zoom + 1)
+        )
+        stored = 0
+        upload_slots = asyncio.Semaphore(settings.upload_max_concurrency)
+        # Rows being built or uploaded; twice the workers keeps the pool busy during uploads
+        row_slots = asyncio.Semaphore(settings.process_pool_workers * 2)
+
+        async def upload(z: int, x: int, y: int, content: bytes) -> None:
+            async with upload_slots:
+                await azure_storage.upload_file(
+                    io.BytesIO(content), tile_blob_name(media_file.filename, z, x, y, format), CONTENT_TYPES[format]
+                )
+
+        async def build_row(z: int, level: pyramid.Raster, parent: Optional[pyramid.Raster], y: int) -> None:
+            nonlocal stored
+            async with row_slots:
+                tiles = await run_in_process(
+                    pyramid.build_tile_row, level, parent, y, tile_size, settings.image_jpeg_quality
+                )
+                await asyncio.gather(*(upload(z, x, y, content) for x, content in enumerate(tiles)))
+            stored += len(tiles)
+            if on_progress is not None:
+                await on_progress(stored, total)
+
+        level, parent = raster, None
+        for z in range(top_zoom, -1, -1):
+            if parent is not None:
+                level = pyramid.level_raster(parent, os.path.join(work_dir, f"level-{z}"))
+                pyramid.allocate_raster(level)
+            await asyncio.gather(*(
+                build_row(z, level, parent, y) for y in range(math.ceil(level.height / tile_size))
+            ))
+            if parent is not None:
+                pyramid.remove_raster(parent)
+            parent = level
+
+        tile_pyramid.status = TilePyramidStatus.READY
+        tile_pyramid.width = raster.width
+        tile_pyramid.height = raster.height
+        tile_pyramid.max_zoom = top_zoom
+        tile_pyramid.format = format
+        tile_pyramid.tile_count = stored
+        tile_pyramid.completed_at = datetime.utcnow()
+        await session.commit()
+        logger.info(f"Stored {stored} tiles in {top_zoom + 1} levels for media file {media_file.id}")
+        return tile_pyramid
+
+    except Exception as e:
+        await session.rollback()
+        tile_pyramid.status = TilePyramidStatus.FAILED
+        tile_pyramid.error = str(e) or type(e).__name__
+        tile_pyramid.completed_at = datetime.utcnow()
+        await session.commit()
+        raise
+
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)